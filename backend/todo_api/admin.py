@@ -1,8 +1,45 @@
 from django.contrib import admin
+from django.db import transaction
 from .models import Todo
+from . import changes, rollups, scheduler, tag_index
+from .events import todo_create_event, todo_update_event, todo_delete_event
+from .response_cache import bump_generation
+from .serializers import TodoSerializer
 @admin.register(Todo)
 class TodoAdmin(admin.ModelAdmin):
     list_display = ('title', 'deadline', 'status', 'createdAt', 'updatedAt')
     list_filter = ('status',)
     search_fields = ('title', 'description')
     readonly_fields = ('id', 'createdAt', 'updatedAt')
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        old_state = rollups.rollup_state(Todo.objects.select_for_update().get(pk=obj.pk)) if change else None
+        super().save_model(request, obj, form, change)
+        data = TodoSerializer(obj).data
+        if change:
+            rollups.record_update(old_state, obj)
+            tag_index.reindex_todos([obj])
+            changes.record_change('update', obj.pk, todo_update_event(data))
+        else:
+            rollups.record_create(obj)
+            tag_index.index_todos([obj])
+            changes.record_change('create', obj.pk, todo_create_event(data))
+        scheduler.notify_deadlines([obj])
+        bump_generation()
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        todo_id = obj.pk
+        rollups.record_delete(Todo.objects.select_for_update().get(pk=todo_id))
+        super().delete_model(request, obj)
+        changes.record_change('delete', todo_id, todo_delete_event(todo_id))
+        bump_generation()
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        todo_ids = list(queryset.values_list('id', flat=True))
+        rollups.record_delete_queryset(queryset)
+        super().delete_queryset(request, queryset)
+        changes.record_changes('delete', todo_ids, [todo_delete_event(todo_id) for todo_id in todo_ids])
+        bump_generation()
@@ -0,0 +1,323 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Aggregate, Avg, Count, DateTimeField, DurationField, ExpressionWrapper, F, Q
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+from .models import Todo
+from . import rollups
+import bisect
+import calendar
+import datetime
+import math
+
+DEFAULT_WINDOW_DAYS = 90
+MAX_WINDOW_DAYS = 3650
+DEFAULT_BUCKET = 'week'
+
+DEFAULT_COMPLETION_LIMIT = 100
+MAX_COMPLETION_LIMIT = 1000
+COMPLETION_PERCENTILES = (50, 90, 99)
+# Upper edges (in hours) of the completion time histogram bins, the last
+# bin is open-ended
+COMPLETION_HISTOGRAM_EDGES = (1, 4, 12, 24, 72, 168)
+
+# bucket name -> (response key, row key prefix)
+BUCKETS = {
+    'day': ('daily_completion', 'day'),
+    'week': ('weekly_completion', 'week'),
+    'month': ('monthly_completion', 'month'),
+}
+
+def _add_months(value, months):
+    """
+    Moves a datetime forward by whole calendar months, clamping the day
+    to the length of the target month
+    """
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+def _next_bucket_start(value, bucket):
+    if bucket == 'day':
+        return value + datetime.timedelta(days=1)
+    if bucket == 'week':
+        return value + datetime.timedelta(days=7)
+    return _add_months(value, 1)
+
+def parse_window(value, default=DEFAULT_WINDOW_DAYS):
+    """
+    Parses the `window` query parameter (number of days to look back)
+
+    Raises:
+        ValueError: If the value is not a positive integer within MAX_WINDOW_DAYS
+    """
+    if value in (None, ''):
+        return default
+    try:
+        window = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid window "{value}": expected a number of days')
+    if window < 1 or window > MAX_WINDOW_DAYS:
+        raise ValueError(f'window must be between 1 and {MAX_WINDOW_DAYS} days')
+    return window
+
+def parse_bucket(value, default=DEFAULT_BUCKET):
+    """
+    Parses the `bucket` query parameter (day, week or month)
+
+    Raises:
+        ValueError: If the bucket is not one of BUCKETS
+    """
+    if value in (None, ''):
+        return default
+    if value not in BUCKETS:
+        raise ValueError(f'Invalid bucket "{value}": expected one of {", ".join(BUCKETS)}')
+    return value
+
+def bucket_bounds(start, end, bucket):
+    """
+    Splits [start, end] into consecutive [bucket_start, bucket_end) ranges
+    anchored at `start`. The last range may extend past `end`.
+    """
+    bounds = []
+    current = start
+    while current <= end:
+        bucket_end = _next_bucket_start(current, bucket)
+        bounds.append((current, bucket_end))
+        current = bucket_end
+    return bounds
+
+def status_distribution():
+    """
+    Returns the number of todos per status as a list of {'status', 'count'}
+    dicts, ordered by status like the original GROUP BY status returned them
+    on SQLite
+    """
+    if settings.TODO_ANALYTICS_USE_ROLLUPS:
+        return rollups.status_distribution()
+    return list(Todo.objects.values('status').annotate(count=Count('status')).order_by('status'))
+
+def completion_buckets(window=DEFAULT_WINDOW_DAYS, bucket=DEFAULT_BUCKET, now=None):
+    """
+    Computes created/completed counts for every bucket of the window in a
+    single grouped query
+
+    Buckets start at the time of day of `now - window`. Shifted back by that
+    time of day, every bucket starts at midnight, so the query counts the
+    todos per shifted date (at most one row per day of the window) and the
+    dates are added up into their bucket here, empty buckets included.
+
+    Args:
+        window: Number of days to look back from now
+        bucket: Bucket size, one of BUCKETS
+        now: Reference time (defaults to timezone.now())
+
+    Returns:
+        List of per-bucket dicts in chronological order
+    """
+    now = (now or timezone.now()).astimezone(datetime.timezone.utc)
+    start_date = now - datetime.timedelta(days=window)
+    bounds = bucket_bounds(start_date, now, bucket)
+    prefix = BUCKETS[bucket][1]
+
+    offset = start_date - start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    shifted = ExpressionWrapper(F('createdAt') - offset, output_field=DateTimeField())
+    rows = Todo.objects.filter(
+        createdAt__gte=start_date,
+        createdAt__lt=bounds[-1][1]
+    ).annotate(
+        day=TruncDate(shifted, tzinfo=datetime.timezone.utc)
+    ).order_by().values('day').annotate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='success'))
+    )
+
+    first_days = [bucket_start.date() for bucket_start, _ in bounds]
+    totals = [0] * len(bounds)
+    completed = [0] * len(bounds)
+    for row in rows:
+        index = bisect.bisect_right(first_days, row['day']) - 1
+        totals[index] += row['total']
+        completed[index] += row['completed']
+
+    buckets = []
+    for index, (bucket_start, bucket_end) in enumerate(bounds):
+        total = totals[index]
+        success = completed[index]
+
+        if total > 0:
+            completion_rate = (success / total) * 100
+        else:
+            completion_rate = 0
+
+        buckets.append({
+            f'{prefix}_start': bucket_start.strftime('%Y-%m-%d'),
+            f'{prefix}_end': bucket_end.strftime('%Y-%m-%d'),
+            'total_tasks': total,
+            'completed_tasks': success,
+            'completion_rate': round(completion_rate, 2)
+        })
+    return buckets
+
+def completion_stats(window=DEFAULT_WINDOW_DAYS, bucket=DEFAULT_BUCKET, now=None):
+    """
+    Builds the completion-stats payload: status distribution plus the
+    per-bucket completion series. Runs two queries regardless of window size.
+    """
+    return {
+        'status_distribution': status_distribution(),
+        BUCKETS[bucket][0]: completion_buckets(window, bucket, now)
+    }
+
+def _hours(duration):
+    """
+    Converts a timedelta to hours rounded to two decimals
+    """
+    if duration is None:
+        return 0
+    return round(duration.total_seconds() / 3600, 2)
+
+def parse_limit(value, default=DEFAULT_COMPLETION_LIMIT, maximum=MAX_COMPLETION_LIMIT):
+    """
+    Parses a row limit query parameter
+
+    Raises:
+        ValueError: If the value is not an integer between 0 and `maximum`
+    """
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid limit "{value}": expected a number')
+    if limit < 0 or limit > maximum:
+        raise ValueError(f'limit must be between 0 and {maximum}')
+    return limit
+
+def creation_hour_distribution():
+    """
+    Returns the number of todos created in each hour of the day, skipping
+    empty hours, from a single grouped query
+    """
+    if settings.TODO_ANALYTICS_USE_ROLLUPS:
+        return rollups.creation_hour_distribution()
+    return list(
+        Todo.objects.annotate(hour=ExtractHour('createdAt'))
+        .values('hour')
+        .annotate(count=Count('id'))
+        .order_by('hour')
+    )
+
+def completed_todos():
+    """
+    Completed todos annotated with their completion time (updatedAt - createdAt)
+    """
+    return Todo.objects.filter(status='success').annotate(
+        completion_time=ExpressionWrapper(
+            F('updatedAt') - F('createdAt'),
+            output_field=DurationField()
+        )
+    )
+
+def completion_times_queryset():
+    """
+    Completion time rows of completed todos, most recently completed first
+    """
+    return completed_todos().order_by('-updatedAt', '-id').values('id', 'title', 'completion_time')
+
+def completion_times(rows):
+    """
+    Converts completion time rows to the {'id', 'title', 'completion_time_hours'}
+    dicts of the productivity patterns payload
+    """
+    return [
+        {
+            'id': str(row['id']),
+            'title': row['title'],
+            'completion_time_hours': _hours(row['completion_time'])
+        }
+        for row in rows
+    ]
+
+class PercentileDisc(Aggregate):
+    """
+    PostgreSQL's percentile_disc of every COMPLETION_PERCENTILES at once.
+    percentile_disc(p) is the first value whose cumulative distribution
+    reaches p, the nearest rank.
+    """
+    function = 'percentile_disc'
+    template = '%(function)s(ARRAY[%(fractions)s]) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, **extra):
+        fractions = ', '.join(str(percentile / 100) for percentile in COMPLETION_PERCENTILES)
+        super().__init__(expression, fractions=fractions, **extra)
+
+def completion_percentiles(completed, count):
+    """
+    Computes the nearest-rank COMPLETION_PERCENTILES of the completion times
+    of `count` completed todos in one query: percentile_disc on PostgreSQL,
+    a single ordered fetch of the durations elsewhere
+
+    Returns:
+        List of timedeltas (None when there are no completed todos), in the
+        order of COMPLETION_PERCENTILES
+    """
+    if not count:
+        return [None] * len(COMPLETION_PERCENTILES)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.fields import ArrayField
+        return completed.aggregate(values=PercentileDisc(
+            'completion_time', output_field=ArrayField(DurationField())
+        ))['values']
+    ordered = list(completed.order_by('completion_time').values_list('completion_time', flat=True))
+    return [
+        ordered[max(math.ceil(percentile / 100 * count), 1) - 1]
+        for percentile in COMPLETION_PERCENTILES
+    ]
+
+def completion_time_summary():
+    """
+    Computes the average, percentiles and histogram of completion times in
+    the database
+
+    Returns:
+        Dict with the number of completed todos, average, p50/p90/p99 and
+        histogram of completion times in hours
+    """
+    completed = completed_todos()
+    aggregates = {
+        'count': Count('id'),
+        'avg': Avg('completion_time'),
+    }
+    lower = 0
+    for upper in COMPLETION_HISTOGRAM_EDGES + (None,):
+        in_bin = Q(completion_time__gte=datetime.timedelta(hours=lower))
+        if upper is not None:
+            in_bin &= Q(completion_time__lt=datetime.timedelta(hours=upper))
+        aggregates[f'bin_{lower}'] = Count('id', filter=in_bin)
+        lower = upper
+    result = completed.aggregate(**aggregates)
+
+    histogram = []
+    lower = 0
+    for upper in COMPLETION_HISTOGRAM_EDGES + (None,):
+        histogram.append({
+            'min_hours': lower,
+            'max_hours': upper,
+            'count': result[f'bin_{lower}']
+        })
+        lower = upper
+
+    values = completion_percentiles(completed, result['count'])
+    percentiles = {
+        f'p{percentile}': _hours(value) for percentile, value in zip(COMPLETION_PERCENTILES, values)
+    }
+
+    return {
+        'count': result['count'],
+        'avg_hours': _hours(result['avg']),
+        'percentiles': percentiles,
+        'histogram': histogram
+    }
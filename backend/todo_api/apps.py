@@ -2,3 +2,8 @@ from django.apps import AppConfig
 class TodoApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'todo_api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid='todo_api.metrics.query_recorder')
@@ -0,0 +1,150 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+from .models import Todo
+from .pagination import KeysetPagination
+from .serializers import TodoSerializer, todo_values, serialize_todo_row, serialize_todo_rows
+from . import writes
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND_MESSAGE = 'No Todo matches the given query.'
+
+# Async variants of the TodoViewSet list/retrieve/create/update/destroy
+# endpoints for the ASGI deployment, under /api/async/todos/. Reads use the
+# async ORM. Writes run their transaction (todo, rollups, change log) in a
+# single sync_to_async call, since the async ORM cannot run transactions;
+# their WebSocket event goes through the outbox like the sync writes.
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return JsonResponse(data, status=status_code, safe=False, encoder=JSONEncoder, json_dumps_params={'ensure_ascii': False})
+
+def envelope(data=None, message='', success=True, status_code=status.HTTP_200_OK):
+    """
+    Same response format as utils.create_response
+    """
+    return json_response({
+        'status': 'success' if success else 'error',
+        'message': message,
+        'data': data
+    }, status_code)
+
+def parse_body(request):
+    """
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    try:
+        return json.loads(request.body or b'{}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError('Invalid JSON body')
+
+async def run_write(write, *args):
+    """
+    Runs one of the writes.py functions, turning its errors into the same
+    envelope as the sync views (see utils.handle_exception)
+
+    Returns:
+        (event, None) tuple, or (None, error response)
+    """
+    try:
+        return await sync_to_async(write)(*args), None
+    except Todo.DoesNotExist:
+        # Deleted concurrently, after get_todo
+        return None, envelope(message=NOT_FOUND_MESSAGE, success=False, status_code=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return None, envelope(message=str(e), success=False, status_code=status.HTTP_400_BAD_REQUEST)
+
+async def get_todo(pk):
+    try:
+        return await Todo.objects.aget(pk=pk)
+    except Todo.DoesNotExist:
+        return None
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+async def todo_list(request):
+    """
+    GET: keyset paginated todos, same format as /api/todos/?pagination=cursor
+    POST: creates a todo
+    """
+    if request.method == 'POST':
+        return await todo_create(request)
+
+    paginator = KeysetPagination()
+    try:
+        page_size = int(request.GET.get(paginator.page_size_query_param, paginator.page_size))
+    except ValueError:
+        page_size = paginator.page_size
+    page_size = min(max(page_size, 1), paginator.max_page_size)
+    cursor = request.GET.get(paginator.cursor_query_param)
+    try:
+        position = paginator.parse_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return json_response({'detail': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    queryset = todo_values(paginator.filter_queryset(Todo.objects.all(), position))[:page_size + 1]
+    rows = [row async for row in queryset]
+    page = rows[:page_size]
+    next_link = None
+    if len(rows) > page_size:
+        next_cursor = paginator.encode_cursor(paginator.get_position(page[-1]))
+        next_link = replace_query_param(request.build_absolute_uri(), paginator.cursor_query_param, next_cursor)
+    return json_response({
+        'next': next_link,
+        'results': serialize_todo_rows(page)
+    })
+
+async def todo_create(request):
+    try:
+        serializer = TodoSerializer(data=parse_body(request))
+    except ValueError as e:
+        return envelope(message=str(e), success=False, status_code=status.HTTP_400_BAD_REQUEST)
+    if not serializer.is_valid():
+        return envelope(serializer.errors, 'Invalid todo', False, status.HTTP_400_BAD_REQUEST)
+    event, error = await run_write(writes.create_todo, serializer)
+    if error is not None:
+        return error
+    return envelope(event['todo'], 'Todo created successfully', status_code=status.HTTP_201_CREATED)
+
+@csrf_exempt
+@require_http_methods(['GET', 'PUT', 'PATCH', 'DELETE'])
+async def todo_detail(request, pk):
+    """
+    GET: retrieves a todo
+    PUT/PATCH: updates it
+    DELETE: deletes it
+    """
+    if request.method == 'GET':
+        try:
+            row = await todo_values(Todo.objects.filter(pk=pk)).aget()
+        except Todo.DoesNotExist:
+            return json_response({'detail': NOT_FOUND_MESSAGE}, status.HTTP_404_NOT_FOUND)
+        return json_response(serialize_todo_row(row))
+
+    todo = await get_todo(pk)
+    if todo is None:
+        return envelope(message=NOT_FOUND_MESSAGE, success=False, status_code=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'DELETE':
+        _, error = await run_write(writes.delete_todo, todo)
+        if error is not None:
+            return error
+        return envelope(message='Todo deleted successfully')
+
+    try:
+        serializer = TodoSerializer(todo, data=parse_body(request), partial=request.method == 'PATCH')
+    except ValueError as e:
+        return envelope(message=str(e), success=False, status_code=status.HTTP_400_BAD_REQUEST)
+    if not serializer.is_valid():
+        return envelope(serializer.errors, 'Invalid todo', False, status.HTTP_400_BAD_REQUEST)
+    event, error = await run_write(writes.update_todo, serializer)
+    if error is not None:
+        return error
+    return envelope(event['todo'], 'Todo updated successfully')
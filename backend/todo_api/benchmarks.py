@@ -0,0 +1,377 @@
+from asgiref.sync import async_to_sync
+from django.core import signals
+from django.db import close_old_connections, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from .events import TODO_GROUP, encode_frames, msgpack_enabled, todo_update_event
+from .models import Todo
+from .search import search_todos
+from .serializers import TodoSerializer, todo_values, serialize_todo_rows
+from . import tag_index
+from collections import Counter
+import asyncio
+import contextlib
+import datetime
+import math
+import time
+
+def seed_todos(count, batch_size=1000):
+    """
+    Bulk inserts `count` synthetic todos. Callers run inside a transaction
+    that is rolled back afterwards.
+    """
+    now = timezone.now()
+    statuses = ['ongoing', 'success', 'failure']
+    priorities = ['low', 'medium', 'high']
+    todos = Todo.objects.bulk_create(
+        (
+            Todo(
+                title=f'Benchmark todo {i}',
+                description='Generated by manage.py benchmark',
+                deadline=now + datetime.timedelta(hours=i % 500),
+                status=statuses[i % 3],
+                priority=priorities[i % 3],
+                tags=[f'tag{i % 10}', f'group{i % 4}']
+            )
+            for i in range(count)
+        ),
+        batch_size=batch_size
+    )
+    tag_index.index_todos(todos)
+
+def _best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark_serializers(rows=10000, repeat=3):
+    """
+    Compares rows/sec of TodoSerializer(many=True) against the .values()
+    fast path on the same queryset, including the database fetch
+    """
+    queryset = Todo.objects.all()[:rows]
+    model_time = _best_of(repeat, lambda: TodoSerializer(queryset.all(), many=True).data)
+    fast_time = _best_of(repeat, lambda: serialize_todo_rows(todo_values(queryset.all())))
+    return [
+        {'name': 'TodoSerializer', 'rows': rows, 'seconds': model_time, 'rows_per_sec': rows / model_time},
+        {'name': 'fast path', 'rows': rows, 'seconds': fast_time, 'rows_per_sec': rows / fast_time,
+         'speedup': model_time / fast_time},
+    ]
+
+async def _asgi_get(application, path, query_string=b''):
+    """
+    Sends one GET request through the ASGI application and returns its status
+    """
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('ascii'),
+        'query_string': query_string,
+        'root_path': '',
+        'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    response = {}
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Like a client keeping the connection open until the response is sent
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+
+    await application(scope, receive, send)
+    return response.get('status')
+
+async def _load(application, targets, concurrency):
+    """
+    Replays `targets` (path, query string) with `concurrency` clients
+
+    Returns:
+        (elapsed seconds, per-request latencies)
+    """
+    pending = list(reversed(targets))
+    latencies = []
+
+    async def client():
+        while pending:
+            path, query_string = pending.pop()
+            start = time.perf_counter()
+            status = await _asgi_get(application, path, query_string)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                raise RuntimeError(f'GET {path} returned {status}')
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percentile / 100 * len(ordered)) - 1, 0)]
+
+@contextlib.contextmanager
+def _requests_keep_connection():
+    """
+    ASGI requests close stale connections when they start and finish, which
+    would drop the transaction the benchmark data lives in
+    """
+    signals.request_started.disconnect(close_old_connections)
+    signals.request_finished.disconnect(close_old_connections)
+    try:
+        yield
+    finally:
+        signals.request_started.connect(close_old_connections)
+        signals.request_finished.connect(close_old_connections)
+
+def benchmark_async_views(rows=10000, requests=2000, concurrency=50):
+    """
+    Compares requests/sec and latency percentiles of the sync TodoViewSet and
+    the async views, driving the Django ASGI application in process the way
+    daphne does (sync views run in the thread-sensitive executor). The
+    response cache is disabled so every request reaches the database.
+    """
+    from django.core.asgi import get_asgi_application
+    application = get_asgi_application()
+    ids = [str(pk) for pk in Todo.objects.values_list('id', flat=True)[:requests]]
+    retrieve = [ids[i % len(ids)] for i in range(requests)]
+    scenarios = [
+        ('list sync', [('/api/todos/', b'pagination=cursor&page_size=50')] * requests),
+        ('list async', [('/api/async/todos/', b'page_size=50')] * requests),
+        ('retrieve sync', [(f'/api/todos/{pk}/', b'') for pk in retrieve]),
+        ('retrieve async', [(f'/api/async/todos/{pk}/', b'') for pk in retrieve]),
+    ]
+    results = []
+    with override_settings(TODO_RESPONSE_CACHE_ENABLED=False, TODO_EXPIRY_SWEEP_IN_BACKGROUND=False), \
+            _requests_keep_connection():
+        for name, targets in scenarios:
+            elapsed, latencies = async_to_sync(_load)(application, targets, concurrency)
+            results.append({
+                'name': name,
+                'requests': len(latencies),
+                'concurrency': concurrency,
+                'req_per_sec': len(latencies) / elapsed,
+                'p50_ms': _percentile(latencies, 50) * 1000,
+                'p99_ms': _percentile(latencies, 99) * 1000,
+            })
+    return results
+
+def benchmark_search(rows=10000, repeat=5, steps=3):
+    """
+    Times the first page of selective searches while the table doubles
+    `steps` times. Indexed searches stay flat as the table grows, the
+    icontains scan is the linear baseline.
+    """
+    far_deadline = timezone.now() + datetime.timedelta(days=3650)
+    needles = Todo.objects.bulk_create(
+        Todo(
+            title=f'Needle quartz {i}',
+            description='Benchmark search target',
+            deadline=far_deadline,
+            priority='high',
+            tags=['needle']
+        )
+        for i in range(20)
+    )
+    tag_index.index_todos(needles)
+    searches = [
+        ('q', {'q': 'quartz'}),
+        ('tags', {'tags': ['needle']}),
+        ('deadline', {'deadline_after': far_deadline}),
+        ('combined', {'q': 'quartz', 'tags': ['needle'], 'priority': ['high'], 'deadline_after': far_deadline}),
+    ]
+    scans = [('icontains scan', lambda: Todo.objects.filter(title__icontains='quartz'))]
+    queries = [
+        (name, lambda params=params: search_todos(Todo.objects.all(), **params))
+        for name, params in searches
+    ] + scans
+    first = {}
+    results = []
+    for step in range(steps):
+        if step:
+            seed_todos(Todo.objects.count())
+        table_rows = Todo.objects.count()
+        for name, queryset in queries:
+            page = lambda: list(queryset().values_list('id', flat=True)[:100])
+            seconds = _best_of(repeat, page)
+            first.setdefault(name, seconds)
+            results.append({
+                'name': f'{name} @ {table_rows} rows',
+                'matches': len(page()),
+                'ms': seconds * 1000,
+                'vs_smallest': seconds / first[name],
+            })
+    return results
+
+def benchmark_tag_stats(rows=10000, repeat=3):
+    """
+    Compares the per-tag aggregate over the tag index with counting the
+    decoded JSON tags in Python
+    """
+    def json_scan():
+        counts = {}
+        for tags, todo_status in Todo.objects.values_list('tags', 'status').iterator(chunk_size=2000):
+            for tag in set(tags):
+                counts.setdefault(tag, Counter())[todo_status] += 1
+        return counts
+
+    scan_time = _best_of(repeat, json_scan)
+    index_time = _best_of(repeat, lambda: tag_index.tag_stats(100))
+    return [
+        {'name': 'JSON scan', 'rows': rows, 'ms': scan_time * 1000},
+        {'name': 'tag index', 'rows': rows, 'ms': index_time * 1000, 'speedup': scan_time / index_time},
+    ]
+
+async def _fanout(todos, consumers, params, pre_encode=True, binary=False):
+    """
+    Joins `consumers` TodoConsumer instances with the subscription `params`
+    to the todos group of a fresh InMemoryChannelLayer, then group_sends one
+    todo_update per todo and waits until every consumer handled and wrote
+    them all. Frames are counted instead of being written to a socket.
+
+    Returns:
+        Dict of the wall time, the total CPU time and the CPU time spent in
+        the consumer handlers and writers (seconds), and the number of
+        frames sent
+    """
+    from channels.layers import InMemoryChannelLayer
+    from .consumers import TodoConsumer
+    from .subscriptions import Subscription
+    layer = InMemoryChannelLayer(capacity=len(todos) + 1)
+    frames = 0
+
+    async def base_send(message):
+        nonlocal frames
+        frames += 1
+
+    clients = []
+    for _ in range(consumers):
+        consumer = TodoConsumer()
+        consumer.channel_layer = layer
+        consumer.channel_name = await layer.new_channel()
+        consumer.base_send = base_send
+        consumer.binary = binary
+        consumer.start_writer()
+        consumer.subscribe(Subscription.parse(params))
+        if consumer.stream is not None:
+            consumer.stream.visible = set()
+        await layer.group_add(TODO_GROUP, consumer.channel_name)
+        clients.append(consumer)
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for seq, todo in enumerate(todos, 1):
+        event = todo_update_event(todo, seq)
+        await layer.group_send(TODO_GROUP, encode_frames(event) if pre_encode else event)
+    # layer.receive() scans every channel for expired messages on each call,
+    # which is quadratic with this many receivers, so the queues are read
+    # directly
+    handler_cpu = 0.0
+    for consumer in clients:
+        queue = layer.channels.pop(consumer.channel_name)
+        while not queue.empty():
+            _, message = queue.get_nowait()
+            handler_start = time.process_time()
+            await consumer.dispatch(message)
+            handler_cpu += time.process_time() - handler_start
+    handler_start = time.process_time()
+    await asyncio.gather(*(consumer.outbound.join() for consumer in clients))
+    handler_cpu += time.process_time() - handler_start
+    for consumer in clients:
+        consumer.stop_writer()
+    return {
+        'seconds': time.perf_counter() - start,
+        'cpu': time.process_time() - cpu_start,
+        'handler_cpu': handler_cpu,
+        'frames': frames,
+    }
+
+def benchmark_ws_fanout(rows=10000, consumers=10000, events=20):
+    """
+    Fans `events` todo updates out to `consumers` simulated WebSocket
+    clients, unfiltered and with a priority and a tag filter. Filtered
+    clients only serialize the frames they send.
+    """
+    todos = serialize_todo_rows(todo_values(Todo.objects.order_by('title')[:events]))
+    scenarios = [
+        ('unfiltered', {}),
+        ('priority=high', {'priority': 'high'}),
+        ('tags=tag0', {'tags': 'tag0'}),
+    ]
+    results = []
+    for name, params in scenarios:
+        run = async_to_sync(_fanout)(todos, consumers, params)
+        results.append({
+            'name': name,
+            'consumers': consumers,
+            'events': len(todos),
+            'frames': run['frames'],
+            'seconds': run['seconds'],
+            'deliveries_per_sec': consumers * len(todos) / run['seconds'],
+        })
+    return results
+
+# Subscriber counts benchmark_ws_frames runs at unless given `consumers`
+WS_FRAMES_SUBSCRIBERS = (10, 100, 1000, 10000)
+
+def benchmark_ws_frames(rows=10000, events=20, consumers=None):
+    """
+    CPU time per broadcast against the subscriber count, encoding the frame
+    in every consumer versus once in the sender (JSON, and msgpack when
+    installed). The handler CPU excludes the channel layer, whose
+    per-channel deepcopy of the event is the same in every scenario.
+
+    Runs at every WS_FRAMES_SUBSCRIBERS count, or at `consumers` subscribers
+    only when given.
+    """
+    subscribers = (consumers,) if consumers else WS_FRAMES_SUBSCRIBERS
+    todos = serialize_todo_rows(todo_values(Todo.objects.order_by('title')[:events]))
+    scenarios = [('encode per consumer', False, False), ('pre-encoded json', True, False)]
+    if msgpack_enabled():
+        scenarios.append(('pre-encoded msgpack', True, True))
+    results = []
+    for count in subscribers:
+        for name, pre_encode, binary in scenarios:
+            run = async_to_sync(_fanout)(todos, count, {}, pre_encode=pre_encode, binary=binary)
+            results.append({
+                'name': f'{name} @ {count} subscribers',
+                'cpu_ms_per_broadcast': run['cpu'] / len(todos) * 1000,
+                'handler_us_per_subscriber': run['handler_cpu'] / len(todos) / count * 1e6,
+            })
+    return results
+
+BENCHMARKS = {
+    'serializers': benchmark_serializers,
+    'async_views': benchmark_async_views,
+    'search': benchmark_search,
+    'tag_stats': benchmark_tag_stats,
+    'ws_fanout': benchmark_ws_fanout,
+    'ws_frames': benchmark_ws_frames,
+}
+
+def run_benchmark(name, rows, **options):
+    """
+    Seeds `rows` todos, runs the named benchmark and rolls everything back
+
+    Returns:
+        List of result dicts
+    """
+    with transaction.atomic():
+        seed_todos(rows)
+        results = BENCHMARKS[name](rows=rows, **options)
+        transaction.set_rollback(True)
+    return results
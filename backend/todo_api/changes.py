@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Min
+from .events import todo_create_event, todo_update_event, todo_delete_event
+from .models import Todo, TodoChange
+from .pagination import KeysetPagination
+from .serializers import todo_values, serialize_todo_rows
+from . import outbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock serializing the change log writers
+SEQ_LOCK_ID = 0x746f646f
+
+def lock_sequence():
+    """
+    Holds the change log until the current transaction ends, so seqs are
+    allocated in commit order
+
+    A seq is allocated at insert, not at commit. If a transaction could
+    commit seq 11 while another still held an uncommitted seq 10, a client
+    that saw 11 would resume past 10 and never receive it. SQLite already
+    lets a single transaction write at a time, PostgreSQL takes a
+    transaction-level advisory lock.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [SEQ_LOCK_ID])
+
+def record_changes(op, todo_ids, events):
+    """
+    Appends one change per todo to the change log, which is also the
+    WebSocket outbox. Must be called inside the transaction of the write, so
+    the log never disagrees with the table and every committed write is
+    eventually broadcast.
+
+    Args:
+        op: 'create', 'update' or 'delete'
+        todo_ids: Ids of the written todos
+        events: The WebSocket event of each todo, published by the outbox
+            relay with the allocated `seq`
+
+    Returns:
+        List of the allocated sequence numbers, in the order of todo_ids
+    """
+    lock_sequence()
+    rows = TodoChange.objects.bulk_create(
+        [
+            TodoChange(todo_id=todo_id, op=op, payload=event)
+            for todo_id, event in zip(todo_ids, events)
+        ],
+        batch_size=settings.TODO_BULK_BATCH_SIZE
+    )
+    outbox.relay_on_commit()
+    return [row.seq for row in rows]
+
+def record_change(op, todo_id, event):
+    """
+    Appends a single change to the change log and returns its sequence number
+    """
+    return record_changes(op, [todo_id], [event])[0]
+
+def latest_seq():
+    """
+    Returns the sequence number of the latest change, 0 if there is none
+    """
+    return TodoChange.objects.aggregate(seq=Max('seq'))['seq'] or 0
+
+def changes_since(since, limit=None):
+    """
+    Returns the events a client at version `since` needs to catch up
+
+    Every todo changed since then is sent once, with its current state (or
+    as a delete if it no longer exists), so the delta never grows beyond the
+    number of distinct todos written.
+
+    Args:
+        since: The last sequence number the client applied
+        limit: Maximum number of log entries to replay, TODO_SYNC_MAX_DELTA
+            by default
+
+    Returns:
+        (seq, events) tuple, or None when the client must start over from a
+        snapshot: `since` was pruned from the log, is ahead of it, or more
+        than `limit` changes happened since
+    """
+    limit = limit or settings.TODO_SYNC_MAX_DELTA
+    bounds = TodoChange.objects.aggregate(first=Min('seq'), last=Max('seq'))
+    if bounds['last'] is None:
+        return (0, []) if since == 0 else None
+    if since > bounds['last'] or since < bounds['first'] - 1:
+        return None
+
+    rows = list(
+        TodoChange.objects.filter(seq__gt=since)
+        .order_by('seq')
+        .values_list('seq', 'todo_id', 'op')[:limit + 1]
+    )
+    if len(rows) > limit:
+        return None
+    if not rows:
+        return since, []
+
+    # todo id -> (seq of its last change, created within the delta)
+    latest = {}
+    for seq, todo_id, op in rows:
+        created = latest[todo_id][1] if todo_id in latest else op == 'create'
+        latest[todo_id] = (seq, created)
+    todos = {
+        todo['id']: todo
+        for todo in serialize_todo_rows(todo_values(Todo.objects.filter(pk__in=list(latest))))
+    }
+
+    events = []
+    for todo_id, (seq, created) in sorted(latest.items(), key=lambda item: item[1][0]):
+        todo = todos.get(str(todo_id))
+        if todo is None:
+            events.append(todo_delete_event(todo_id, seq))
+        elif created:
+            events.append(todo_create_event(todo, seq))
+        else:
+            events.append(todo_update_event(todo, seq))
+    return rows[-1][0], events
+
+def snapshot_page(cursor=None, page_size=None, todos=None):
+    """
+    Returns one chunk of the full todo list, newest first
+
+    Args:
+        cursor: The `next` cursor of the previous chunk, None for the first one
+        page_size: Todos per chunk, TODO_SYNC_SNAPSHOT_CHUNK by default
+        todos: Queryset of the todos to list, all of them by default
+
+    Returns:
+        (todos, next_cursor) tuple, next_cursor is None on the last chunk
+
+    Raises:
+        ValueError: If the cursor cannot be decoded
+    """
+    page_size = page_size or settings.TODO_SYNC_SNAPSHOT_CHUNK
+    paginator = KeysetPagination()
+    position = paginator.parse_cursor(cursor) if cursor else None
+    todos = Todo.objects.all() if todos is None else todos
+    rows = list(todo_values(paginator.filter_queryset(todos, position))[:page_size + 1])
+    page = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size:
+        next_cursor = paginator.encode_cursor(paginator.get_position(page[-1]))
+    return serialize_todo_rows(page), next_cursor
+
+def prune_changes(keep):
+    """
+    Deletes all but the latest `keep` changes (at least one is always kept,
+    so the latest sequence number survives). Changes still waiting for the
+    outbox relay are never deleted.
+
+    Returns:
+        Number of deleted changes
+    """
+    cutoff = latest_seq() - max(keep, 1)
+    deleted, _ = TodoChange.objects.filter(seq__lte=cutoff, publishedAt__isnull=False).delete()
+    logger.info(f'Pruned {deleted} todo changes')
+    return deleted
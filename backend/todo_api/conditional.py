@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from .models import Todo
+from .response_cache import get_generation, get_last_modified, request_fingerprint
+import functools
+import hashlib
+import time
+
+def _etag(*parts):
+    return quote_etag(hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32])
+
+def collection_etag(request, *args, **kwargs):
+    """
+    ETag of list and analytics responses: the write generation plus the
+    normalized URL and Accept header. Costs no database query.
+    """
+    return _etag(get_generation(), request_fingerprint(request), request.META.get('HTTP_ACCEPT', ''))
+
+def collection_last_modified(request, *args, **kwargs):
+    return get_last_modified()
+
+def analytics_etag(request, *args, **kwargs):
+    """
+    ETag of analytics responses. These are relative to the current time, so
+    the ETag also rolls over every TODO_RESPONSE_CACHE_TIMEOUT seconds.
+    """
+    time_bucket = int(time.time() // settings.TODO_RESPONSE_CACHE_TIMEOUT)
+    return _etag(collection_etag(request), time_bucket)
+
+def _todo_updated_at(request, pk):
+    """
+    Looks up the updatedAt of a single todo, once per request
+    """
+    if not hasattr(request, '_todo_updated_at'):
+        try:
+            request._todo_updated_at = Todo.objects.filter(pk=pk).values_list('updatedAt', flat=True).first()
+        except Exception:
+            # Malformed ids are reported by the view itself
+            request._todo_updated_at = None
+    return request._todo_updated_at
+
+def todo_etag(request, pk=None, **kwargs):
+    """
+    ETag of a single todo, derived from its updatedAt
+    """
+    updated_at = _todo_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return _etag(pk, updated_at.isoformat(), request.META.get('HTTP_ACCEPT', ''))
+
+def todo_last_modified(request, pk=None, **kwargs):
+    return _todo_updated_at(request, pk)
+
+def http_last_modified(modified, now=None):
+    """
+    Returns the Last-Modified timestamp of a modification time, in whole
+    seconds, or None while that second is not over
+
+    HTTP dates have one-second granularity, so a write later in the same
+    second would get the same Last-Modified and clients revalidating with
+    If-Modified-Since would get a stale 304. Until the second is over only
+    the ETag validates the response.
+    """
+    if modified is None:
+        return None
+    last_modified = int(modified.timestamp())
+    if last_modified >= int(now if now is not None else time.time()):
+        return None
+    return last_modified
+
+def conditional_response(etag_func, last_modified_func=None):
+    """
+    Decorator adding ETag/Last-Modified headers to successful GET responses
+    of API views and answering matching If-None-Match/If-Modified-Since
+    requests with 304 Not Modified before the view runs, so nothing is
+    queried or serialized. Last-Modified is left out while it could still
+    be shared by a later write (see http_last_modified).
+
+    Args:
+        etag_func: Called with (request, *args, **kwargs), returns the ETag or None
+        last_modified_func: Called the same way, returns a datetime or None
+
+    Returns:
+        Decorator for view methods
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return func(self, request, *args, **kwargs)
+
+            etag = etag_func(request, *args, **kwargs)
+            last_modified = None
+            if last_modified_func:
+                last_modified = http_last_modified(last_modified_func(request, *args, **kwargs))
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = func(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                if etag:
+                    response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+conditional_collection = conditional_response(collection_etag, collection_last_modified)
+conditional_todo = conditional_response(todo_etag, todo_last_modified)
+conditional_analytics = conditional_response(analytics_etag)
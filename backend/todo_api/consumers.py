@@ -1,9 +1,15 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from urllib.parse import parse_qs
+from . import changes, metrics
+from .events import MSGPACK_SUBPROTOCOL, client_message, decode_message, encode_message, msgpack_enabled, todo_batch_event
 from .models import Todo
-from .serializers import TodoSerializer
+from .outbound import CLOSE, EVENT, MESSAGE, OutboundQueue, queue_stats
+from .subscriptions import FilteredStream, Subscription
 import logging
+import operator
 
 logger = logging.getLogger(__name__)
 
@@ -11,7 +17,37 @@ class TodoConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for real-time todo updates
     Manages connections, disconnections, and message handling
+
+    Sync protocol: every broadcast event carries the change sequence number
+    `seq` of its write. A client reconnecting with ?since=<seq> (or sending
+    request_todos with "since") receives a todo_delta with the changes it
+    missed. Without `since`, or when the gap is no longer in the change log,
+    it receives the todo list as todo_list chunks: the first one carries the
+    `seq` the snapshot started at, and each one a `next` cursor the client
+    sends back in request_todos to get the following chunk.
+
+    Filters: a client showing only some todos connects with
+    ?status=, ?priority= and/or ?tags= (comma separated), or sends
+    {"type": "subscribe", "filter": {"status": [...], "priority": [...],
+    "tags": [...]}} to change its filter and start over from a snapshot.
+    Snapshots and deltas only hold matching todos, and events are filtered
+    here before being serialized (see subscriptions.FilteredStream).
+
+    Encoding: messages are JSON text frames, or msgpack binary frames for
+    clients offering the todos.msgpack subprotocol. Broadcast events carry
+    both frames, encoded once by the sender (see events.encode_frames), and
+    are forwarded as is unless the client's filter changes them.
+
+    Backpressure: messages are queued and written by a per-connection
+    writer task (see outbound.OutboundQueue). A client falling behind gets
+    the queued events merged into the latest one per todo; one that still
+    cannot keep up gets {"type": "resync_required"} and is disconnected
+    with code 4008, it reconnects with ?since= to catch up.
     """
+    stream = None
+    binary = False
+    outbound = None
+    writer = None
     
     async def connect(self):
         """
@@ -25,25 +61,35 @@ class TodoConsumer(AsyncWebsocketConsumer):
                 "todos",
                 self.channel_name
             )
-            await self.accept()
+            if MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', []) and msgpack_enabled():
+                self.binary = True
+                await self.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+            else:
+                await self.accept()
             
             logger.info("WebSocket connected")
             
-            # Send initial todo list on connect
-            todos = await self.get_todos()
-            await self.send(text_data=json.dumps({
-                'type': 'todo_list',
-                'todos': todos
-            }))
+            # Send the missed changes or the first snapshot chunk on connect
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            try:
+                self.subscribe(Subscription.parse({name: values[0] for name, values in query.items()}))
+            except ValueError as e:
+                await self.send_message({
+                    'type': 'error',
+                    'message': str(e)
+                })
+                self.enqueue(CLOSE)
+                return
+            await self.sync(since=query.get('since', [None])[0])
         except Exception as e:
             logger.error(f"Error in WebSocket connect: {str(e)}")
             # Still try to accept the connection to send an error
             if not self.accepted:
                 await self.accept()
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Connection error'
-                }))
+                })
     
     async def disconnect(self, close_code):
         """
@@ -51,6 +97,9 @@ class TodoConsumer(AsyncWebsocketConsumer):
         """
         try:
             logger.info(f"WebSocket disconnected with code {close_code}")
+            metrics.ws_disconnections.inc(code=close_code)
+            if self.writer is not None:
+                self.stop_writer()
             await self.channel_layer.group_discard(
                 "todos",
                 self.channel_name
@@ -58,40 +107,180 @@ class TodoConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error in WebSocket disconnect: {str(e)}")
     
-    async def receive(self, text_data):
+    async def accept(self, subprotocol=None):
+        """
+        Accepts the socket and starts the writer task
+        """
+        await super().accept(subprotocol=subprotocol)
+        self.start_writer()
+        metrics.ws_connections.inc()
+
+    def start_writer(self):
+        self.outbound = OutboundQueue()
+        self.writer = asyncio.ensure_future(self.write_loop())
+        queue_stats.record_connection(1)
+
+    def stop_writer(self):
+        self.writer.cancel()
+        self.outbound.release()
+        queue_stats.record_connection(-1)
+
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Receive message from WebSocket
         Handle different message types (like requesting todos)
         """
         try:
-            data = json.loads(text_data)
+            if bytes_data is not None and self.binary:
+                data = decode_message(bytes_data, binary=True)
+            else:
+                data = json.loads(text_data)
             message_type = data.get('type', '')
             logger.info(f"Received WebSocket message type: {message_type}")
             
             if message_type == 'request_todos':
-                # Client is requesting the todo list
-                todos = await self.get_todos()
-                await self.send(text_data=json.dumps({
-                    'type': 'todo_list',
-                    'todos': todos
-                }))
+                # Client is requesting the missed changes or a snapshot chunk
+                await self.sync(since=data.get('since'), cursor=data.get('cursor'))
+            elif message_type == 'subscribe':
+                # Client changed its filter, it gets the matching todos again
+                self.subscribe(Subscription.parse(data.get('filter') or {}))
+                await self.sync()
         except Exception as e:
             logger.error(f"Error in WebSocket receive: {str(e)}")
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': f'Message processing error: {str(e)}'
-            }))
+            })
     
+    def subscribe(self, subscription):
+        self.stream = FilteredStream(subscription) if subscription.is_filtered else None
+
+    def route(self, event):
+        """
+        Returns the event to send to this client, None to drop it
+        """
+        return self.stream.route(event) if self.stream is not None else event
+
+    async def sync(self, since=None, cursor=None):
+        """
+        Sends the changes since version `since` when they are still in the
+        change log, otherwise the snapshot chunk at `cursor`
+        """
+        if cursor is None and since is not None:
+            try:
+                since = int(since)
+            except (TypeError, ValueError):
+                since = None
+        if cursor is None and since is not None:
+            delta = await self.get_changes(since)
+            if delta is not None:
+                seq, events = delta
+                if self.stream is not None:
+                    # The todos the client kept from before are unknown
+                    self.stream.visible = None
+                    events = [event for event in map(self.route, events) if event is not None]
+                await self.send_message({
+                    'type': 'todo_delta',
+                    'since': since,
+                    'seq': seq,
+                    'events': events
+                })
+                return
+
+        if self.stream is not None and cursor is None:
+            self.stream.visible = set()
+        todos, next_cursor, seq = await self.get_snapshot(cursor)
+        if self.stream is not None:
+            self.stream.show(todos)
+        await self.send_message({
+            'type': 'todo_list',
+            'todos': todos,
+            'seq': seq,
+            'next': next_cursor
+        })
+
+    def enqueue(self, kind, payload=None):
+        """
+        Queues a message for the writer task. Overflowing the queue drops
+        it and asks the client to resync.
+        """
+        if self.outbound.overflowed:
+            return
+        if not self.outbound.put(kind, payload):
+            logger.warning("WebSocket client fell behind, asking it to resync")
+            self.outbound.resync({
+                'type': 'resync_required',
+                'message': 'Too many pending updates, reconnect to resync'
+            })
+
+    async def send_message(self, message):
+        """
+        Queues a message for this client
+        """
+        self.enqueue(MESSAGE, message)
+
+    async def send_frame(self, event):
+        """
+        Queues a broadcast event for this client
+        """
+        self.enqueue(EVENT, event)
+
+    async def write_loop(self):
+        """
+        Writes the queued messages to WebSocket, waiting for each write
+        """
+        while True:
+            kind, payload = await self.outbound.get()
+            try:
+                if kind == CLOSE:
+                    await self.close(code=payload)
+                    return
+                if kind == EVENT:
+                    await self.write_frame(payload)
+                else:
+                    await self.write_message(payload)
+            except Exception as e:
+                logger.error(f"Error writing to WebSocket: {str(e)}")
+
+    async def write_message(self, message):
+        """
+        Encodes a message for this client and sends it to WebSocket
+        """
+        if self.binary:
+            await self.send(bytes_data=encode_message(message, binary=True))
+        else:
+            await self.send(text_data=encode_message(message))
+
+    async def write_frame(self, event):
+        """
+        Sends a broadcast event to WebSocket, forwarding the frame encoded
+        by the sender when it has one for this client's encoding
+        """
+        frame = event.get('frame_bytes' if self.binary else 'frame_text')
+        if frame is None:
+            # Changed by the filter, or sent without frames
+            await self.write_message(client_message(event))
+        elif self.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_event(self, event):
+        """
+        Sends a todo_create, todo_update or todo_delete event to WebSocket
+        if it passes the client's filter. An update of a todo leaving the
+        filter is sent as a todo_delete.
+        """
+        routed = self.route(event)
+        if routed is not None:
+            await self.send_frame(routed)
+
     async def todo_update(self, event):
         """
         Receive todo_update event from group and send to WebSocket
         """
         try:
-            # Send the todo update to the WebSocket
-            await self.send(text_data=json.dumps({
-                'type': 'todo_update',
-                'todo': event['todo']
-            }))
+            await self.send_event(event)
         except Exception as e:
             logger.error(f"Error in todo_update: {str(e)}")
     
@@ -100,11 +289,7 @@ class TodoConsumer(AsyncWebsocketConsumer):
         Receive todo_create event from group and send to WebSocket
         """
         try:
-            # Send the new todo to the WebSocket
-            await self.send(text_data=json.dumps({
-                'type': 'todo_create',
-                'todo': event['todo']
-            }))
+            await self.send_event(event)
         except Exception as e:
             logger.error(f"Error in todo_create: {str(e)}")
     
@@ -113,22 +298,46 @@ class TodoConsumer(AsyncWebsocketConsumer):
         Receive todo_delete event from group and send to WebSocket
         """
         try:
-            # Send the deleted todo ID to the WebSocket
-            await self.send(text_data=json.dumps({
-                'type': 'todo_delete',
-                'todo_id': event['todo_id']
-            }))
+            await self.send_event(event)
         except Exception as e:
             logger.error(f"Error in todo_delete: {str(e)}")
     
-    @database_sync_to_async
-    def get_todos(self):
+    async def todo_batch(self, event):
         """
-        Get all todos from the database
+        Receive todo_batch event from group and send its todo_create,
+        todo_update and todo_delete events to WebSocket as one message
         """
         try:
-            todos = Todo.objects.all()
-            return TodoSerializer(todos, many=True).data
+            if self.stream is None:
+                await self.send_frame(event)
+                return
+            events = [routed for routed in map(self.route, event['events']) if routed is not None]
+            if len(events) == len(event['events']) and all(map(operator.is_, events, event['events'])):
+                # Every event passed the filter unchanged
+                await self.send_frame(event)
+            elif events:
+                await self.send_frame(todo_batch_event(events))
         except Exception as e:
+            logger.error(f"Error in todo_batch: {str(e)}")
+
+    @database_sync_to_async
+    def get_changes(self, since):
+        """
+        Get the changes since version `since`, None if a snapshot is needed
+        """
+        return changes.changes_since(since)
+
+    @database_sync_to_async
+    def get_snapshot(self, cursor):
+        """
+        Get one chunk of the todo list, with the current version on the
+        first chunk
+        """
+        seq = changes.latest_seq() if cursor is None else None
+        todos = self.stream.subscription.filter_queryset(Todo.objects.all()) if self.stream is not None else None
+        try:
+            todos, next_cursor = changes.snapshot_page(cursor, todos=todos)
+        except ValueError as e:
             logger.error(f"Error getting todos: {str(e)}")
-            return [] 
\ No newline at end of file
+            return [], None, seq
+        return todos, next_cursor, seq
@@ -1,49 +1,76 @@
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from .models import Todo
-from .serializers import TodoSerializer
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from . import changes, rollups, tag_index
+from .response_cache import bump_generation
+from .serializers import todo_values, serialize_todo_rows
+from .events import todo_update_event
 import logging
 
 logger = logging.getLogger(__name__)
 
+def expire_chunk(now, chunk_size):
+    """
+    Moves up to `chunk_size` expired todos to 'failure' in one transaction
+
+    The rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so
+    concurrent sweeps each take a different chunk instead of waiting for
+    (or double-processing) the rows another one is already expiring.
+
+    Returns:
+        List of (todo id, change seq) of the todos expired by this call
+    """
+    with transaction.atomic():
+        expired_ids = list(
+            Todo.objects.filter(status='ongoing', deadline__lt=now)
+            .order_by('deadline')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not expired_ids:
+            return []
+        expired_todos = Todo.objects.filter(pk__in=expired_ids)
+        rollups.record_status_change(expired_todos, 'failure')
+        tag_index.record_status_change(expired_ids, 'failure')
+        expired_todos.update(status='failure', updatedAt=now)
+        # The outbox relay broadcasts the chunk as todo_batch messages
+        todos = {todo['id']: todo for todo in serialize_todo_rows(todo_values(expired_todos))}
+        seqs = changes.record_changes(
+            'update', expired_ids, [todo_update_event(todos[str(todo_id)]) for todo_id in expired_ids]
+        )
+        bump_generation()
+    return list(zip(expired_ids, seqs))
+
+def expire_todos(now=None, chunk_size=None):
+    """
+    Yields the chunks of todos expired as of `now`, each one committed
+    before it is yielded
+
+    Args:
+        now: Expiry cutoff, the current time by default
+        chunk_size: Todos per transaction, TODO_EXPIRY_CHUNK_SIZE by default
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or settings.TODO_EXPIRY_CHUNK_SIZE
+    while True:
+        chunk = expire_chunk(now, chunk_size)
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+
 def update_todo_statuses():
     """
     Updates expired todos (status='ongoing', deadline < now) to 'failure' status
     Returns a dict with operation status information
     """
     try:
-        now = timezone.now()
-        expired_todos = Todo.objects.filter(
-            status='ongoing',
-            deadline__lt=now
-        )
-        count = expired_todos.update(status='failure')
+        count = 0
+        for chunk in expire_todos():
+            count += len(chunk)
         logger.info(f'Updated {count} expired todos to failure status')
         
-        # If any todos were updated, notify WebSocket clients
-        if count > 0:
-            # Get the updated todos
-            updated_todos = Todo.objects.filter(
-                status='failure',
-                deadline__lt=now
-            ).order_by('-updatedAt')[:count]
-            
-            # Serialize the todos
-            serializer = TodoSerializer(updated_todos, many=True)
-            todo_data = serializer.data
-            
-            # Notify WebSocket clients about each updated todo
-            channel_layer = get_channel_layer()
-            for todo in todo_data:
-                async_to_sync(channel_layer.group_send)(
-                    "todos",
-                    {
-                        "type": "todo_update",
-                        "todo": todo
-                    }
-                )
-        
         return {
             'status': 'success',
             'message': f'Updated {count} expired todos to failure status',
@@ -57,4 +84,4 @@ def update_todo_statuses():
             'status': 'error',
             'message': f'Error updating todo statuses: {str(e)}',
             'data': None
-        } 
\ No newline at end of file
+        }
@@ -0,0 +1,176 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import metrics
+import json
+import logging
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Channel layer group every TodoConsumer joins
+TODO_GROUP = "todos"
+
+# WebSocket subprotocol of the clients receiving msgpack binary frames
+MSGPACK_SUBPROTOCOL = "todos.msgpack"
+
+def msgpack_enabled():
+    return msgpack is not None and settings.TODO_WS_MSGPACK
+
+def client_message(event):
+    """
+    Returns the WebSocket message of a todo_create, todo_update,
+    todo_delete or todo_batch event
+    """
+    if event["type"] == "todo_batch":
+        return {"type": "todo_batch", "events": event["events"]}
+    if event["type"] == "todo_delete":
+        return {"type": "todo_delete", "todo_id": event["todo_id"], "seq": event.get("seq")}
+    return {"type": event["type"], "todo": event["todo"], "seq": event.get("seq")}
+
+def encode_message(message, binary=False):
+    return msgpack.packb(message) if binary else json.dumps(message)
+
+def decode_message(data, binary=False):
+    return msgpack.unpackb(data) if binary else json.loads(data)
+
+def encode_frames(event):
+    """
+    Adds the encoded WebSocket frames of an event, so consumers forward them
+    instead of encoding the same message once per client
+    """
+    message = client_message(event)
+    event = {**event, "frame_text": encode_message(message)}
+    if msgpack_enabled():
+        event["frame_bytes"] = encode_message(message, binary=True)
+    return event
+
+def broadcast(event):
+    """
+    Sends an event to every WebSocket client of the todos group, with its
+    frames encoded once here
+
+    Args:
+        event: Channel layer event, its "type" selects the TodoConsumer handler
+    """
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(TODO_GROUP, encode_frames(event))
+    metrics.ws_broadcasts.inc(type=event["type"])
+    metrics.ws_broadcast_events.inc(len(event["events"]) if event["type"] == "todo_batch" else 1)
+
+# `seq` is the change log sequence number of the write (see changes.py),
+# clients keep the highest one they applied to resume from on reconnect
+
+def todo_create_event(todo, seq=None):
+    return {"type": "todo_create", "todo": todo, "seq": seq}
+
+def todo_update_event(todo, seq=None):
+    return {"type": "todo_update", "todo": todo, "seq": seq}
+
+def todo_delete_event(todo_id, seq=None):
+    return {"type": "todo_delete", "todo_id": str(todo_id), "seq": seq}
+
+def todo_batch_event(events):
+    """
+    Wraps several todo_create/todo_update/todo_delete events into a single
+    channel layer message, delivered to clients as one frame
+    """
+    return {"type": "todo_batch", "events": list(events)}
+
+class BroadcastStats:
+    """
+    Per-process counters of the coalesced broadcasts
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.events = 0
+        self.max_batch_size = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, size, latency):
+        with self.lock:
+            self.batches += 1
+            self.events += size
+            self.max_batch_size = max(self.max_batch_size, size)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'batches': self.batches,
+                'events': self.events,
+                'avg_batch_size': round(self.events / self.batches, 2) if self.batches else 0,
+                'max_batch_size': self.max_batch_size,
+                'avg_flush_latency_ms': round(self.total_latency / self.batches * 1000, 3) if self.batches else 0,
+                'max_flush_latency_ms': round(self.max_latency * 1000, 3)
+            }
+
+broadcast_stats = BroadcastStats()
+
+class CoalescingBroadcaster:
+    """
+    Buffers todo events and sends them as a single todo_batch message
+
+    The buffer is flushed once it holds `max_size` events, `window` seconds
+    after its first event was added (never with a window of 0), and when the
+    broadcaster is closed (use it as a context manager). Flush latency is the time the first event
+    of a batch spent buffered until the batch was sent.
+    """
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Serializes flushes so batches are sent in the order they were filled
+        self.send_lock = threading.Lock()
+        self.events = []
+        self.first_added = None
+        self.timer = None
+
+    def add(self, event):
+        with self.lock:
+            self.events.append(event)
+            if self.first_added is None:
+                self.first_added = time.monotonic()
+                if self.window > 0:
+                    self.timer = threading.Timer(self.window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+            full = len(self.events) >= self.max_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.send_lock:
+            with self.lock:
+                events, first_added = self.events, self.first_added
+                self.events, self.first_added = [], None
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            if not events:
+                return
+            broadcast(events[0] if len(events) == 1 else todo_batch_event(events))
+            latency = time.monotonic() - first_added
+        broadcast_stats.record(len(events), latency)
+        logger.debug(f'Broadcast {len(events)} todo events after {latency * 1000:.1f}ms')
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
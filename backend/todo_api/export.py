@@ -0,0 +1,123 @@
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .serializers import TODO_FIELDS, iter_serialized_todos
+from .utils import STREAM_CHUNK_SIZE, chunked, encode_json, ndjson_blocks
+import csv
+import io
+import uuid
+import zlib
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+EXPORT_FIELDS = TODO_FIELDS
+
+def parse_export_format(value):
+    """
+    Raises:
+        ValueError: If the export format is not one of EXPORT_FORMATS
+    """
+    value = value or 'ndjson'
+    if value not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format "{value}": expected one of {", ".join(EXPORT_FORMATS)}')
+    return value
+
+def parse_resume_position(since, after=None):
+    """
+    Parses the `since` (updatedAt) and optional `after` (id) resume parameters
+
+    Returns:
+        (since, after) tuple, (None, None) for a full export
+
+    Raises:
+        ValueError: If either value is malformed
+    """
+    if not since:
+        if after:
+            raise ValueError('after can only be used together with since')
+        return None, None
+    since_value = parse_datetime(since)
+    if since_value is None:
+        raise ValueError(f'Invalid since "{since}": expected an ISO 8601 datetime')
+    if timezone.is_naive(since_value):
+        since_value = timezone.make_aware(since_value)
+    after_value = None
+    if after:
+        try:
+            after_value = uuid.UUID(after)
+        except ValueError:
+            raise ValueError(f'Invalid after "{after}": expected a todo id')
+    return since_value, after_value
+
+def export_queryset(queryset, since=None, after=None):
+    """
+    Orders the export by (updatedAt, id) and applies the resume position
+
+    A client that was cut off resumes with since=<updatedAt of the last row>
+    and after=<id of the last row>. Without `after`, every row updated at
+    `since` is sent again.
+    """
+    if since is not None:
+        if after is not None:
+            queryset = queryset.filter(Q(updatedAt__gt=since) | Q(updatedAt=since, id__gt=after))
+        else:
+            queryset = queryset.filter(updatedAt__gte=since)
+    return queryset.order_by('updatedAt', 'id')
+
+def csv_blocks(rows, chunk_size=STREAM_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for chunk in chunked(rows, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in chunk:
+            writer.writerow([
+                encode_json(row['tags']) if field == 'tags' else row[field]
+                for field in EXPORT_FIELDS
+            ])
+        yield buffer.getvalue()
+
+def gzip_blocks(blocks):
+    """
+    Compresses text blocks on the fly into a single gzip stream, flushing
+    after every block so clients receive data while the export runs
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        yield compressor.compress(block.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def export_response(queryset, export_format, gzip=False, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streams the queryset as NDJSON or CSV with constant memory use
+
+    Args:
+        queryset: Todos to export, already ordered and filtered
+        export_format: One of EXPORT_FORMATS
+        gzip: Whether to gzip the stream on the fly
+        chunk_size: Rows fetched and written per block
+
+    Returns:
+        StreamingHttpResponse
+    """
+    rows = iter_serialized_todos(queryset, chunk_size)
+    if export_format == 'csv':
+        blocks = csv_blocks(rows, chunk_size)
+    else:
+        blocks = ndjson_blocks(rows, chunk_size)
+    if gzip:
+        blocks = gzip_blocks(blocks)
+    else:
+        blocks = (block.encode('utf-8') for block in blocks)
+    response = StreamingHttpResponse(blocks, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="todos.{export_format}"'
+    response['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from todo_api.benchmarks import BENCHMARKS, run_benchmark
+import inspect
+class Command(BaseCommand):
+    help = 'Runs a performance benchmark against synthetic todos (rolled back afterwards)'
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS), help='Benchmark to run')
+        parser.add_argument('--rows', type=int, default=10000, help='Number of synthetic todos')
+        parser.add_argument('--requests', type=int, help='Requests per scenario (load benchmarks)')
+        parser.add_argument('--concurrency', type=int, help='Concurrent clients (load benchmarks)')
+        parser.add_argument('--consumers', type=int, help='Simulated WebSocket clients (fan-out benchmarks)')
+        parser.add_argument('--events', type=int, help='Events broadcast (fan-out benchmarks)')
+    def handle(self, *args, **options):
+        extra = {
+            name: options[name]
+            for name in ('requests', 'concurrency', 'consumers', 'events')
+            if options[name] is not None
+        }
+        accepted = inspect.signature(BENCHMARKS[options['name']]).parameters
+        unsupported = sorted(name for name in extra if name not in accepted)
+        if unsupported:
+            raise CommandError(
+                f'The {options["name"]} benchmark does not take '
+                + ', '.join(f'--{name}' for name in unsupported)
+            )
+        results = run_benchmark(options['name'], options['rows'], **extra)
+        for result in results:
+            details = ', '.join(
+                f'{key}={value:,.2f}' if isinstance(value, float) else f'{key}={value}'
+                for key, value in result.items() if key != 'name'
+            )
+            self.stdout.write(f'{result["name"]}: {details}')
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from todo_api import changes
+class Command(BaseCommand):
+    help = 'Deletes old entries of the todo change log used by WebSocket delta sync'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=settings.TODO_CHANGE_LOG_RETENTION,
+            help='Number of latest changes to keep'
+        )
+    def handle(self, *args, **options):
+        deleted = changes.prune_changes(options['keep'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully pruned {deleted} todo changes')
+        )
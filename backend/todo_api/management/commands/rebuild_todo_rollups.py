@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from todo_api import rollups
+class Command(BaseCommand):
+    help = 'Rebuilds the analytics rollup tables from the todo table and tag index, or checks it with --check'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=rollups.DEFAULT_BATCH_SIZE,
+            help='Number of rollup buckets read and written per batch'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare the rollups against the live aggregate, without rebuilding'
+        )
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['check']:
+            mismatches = rollups.check_rollups(batch_size=batch_size)
+            for mismatch in mismatches:
+                bucket = ' '.join(str(value) for value in mismatch['bucket'])
+                self.stdout.write(
+                    f'{mismatch["table"]} {bucket}: '
+                    f'expected {mismatch["expected"]}, found {mismatch["actual"]}'
+                )
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} rollup buckets are out of sync')
+            self.stdout.write(self.style.SUCCESS('Todo rollups are consistent'))
+            return
+        written = rollups.rebuild_rollups(batch_size=batch_size)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {written} rollup buckets')
+        )
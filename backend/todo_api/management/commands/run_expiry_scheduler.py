@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from todo_api.scheduler import ExpiryScheduler
+import asyncio
+class Command(BaseCommand):
+    help = 'Runs the deadline-driven expiry scheduler (set TODO_EXPIRY_SCHEDULER=command)'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horizon',
+            type=int,
+            default=None,
+            help='Seconds of upcoming deadlines kept in memory between reloads'
+        )
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Expiry scheduler started'))
+        try:
+            asyncio.run(ExpiryScheduler(horizon=options['horizon']).serve())
+        except KeyboardInterrupt:
+            self.stdout.write('Expiry scheduler stopped')
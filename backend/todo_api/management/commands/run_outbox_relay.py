@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from todo_api.outbox import run_relay
+import threading
+class Command(BaseCommand):
+    help = 'Publishes the WebSocket events of committed todo writes (set TODO_OUTBOX_RELAY=command)'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.TODO_OUTBOX_COMMAND_POLL_INTERVAL,
+            help='Seconds between polls of the outbox, the commits of the web processes do not wake this relay'
+        )
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Outbox relay started'))
+        try:
+            run_relay(threading.Event(), poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Outbox relay stopped')
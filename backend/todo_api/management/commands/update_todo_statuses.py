@@ -1,18 +1,12 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from todo_api.models import Todo
+from django.core.management.base import BaseCommand, CommandError
+from todo_api.cron import update_todo_statuses
 class Command(BaseCommand):
     help = 'Updates todo statuses based on deadlines'
     def handle(self, *args, **kwargs):
-        # Get current time
-        now = timezone.now()
-        # Find all ongoing todos with deadlines in the past
-        expired_todos = Todo.objects.filter(
-            status='ongoing',
-            deadline__lt=now
-        )
-        # Update their status to 'failure'
-        count = expired_todos.update(status='failure')
+        # Same chunked, concurrency-safe sweep as the cron job and middleware
+        result = update_todo_statuses()
+        if result['status'] != 'success':
+            raise CommandError(result['message'])
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully updated {count} expired todos to failure status')
-        ) 
\ No newline at end of file
+            self.style.SUCCESS(f'Successfully updated {result["data"]["count"]} expired todos to failure status')
+        )
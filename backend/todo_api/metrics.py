@@ -0,0 +1,241 @@
+from contextvars import ContextVar
+import math
+import threading
+import time
+
+# Prometheus metrics of this process, served at /metrics in the text
+# exposition format. Every worker process keeps its own values, scrape each
+# one (or sum them) like the other per-process stats.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {", ".join(self.labelnames)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.extend(self.samples(key, value))
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def reset(self):
+        with self.lock:
+            # A counter without labels is exposed from 0 on
+            self.values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self, key, value):
+        return [f'{self.name}{_labels(self.labelnames, key)} {_number(value)}']
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts, then the sum of the observations
+                counts = self.values[key] = [0] * len(self.buckets) + [0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def get(self, **labels):
+        """
+        Returns (count, sum) of the observations
+        """
+        counts = self.values.get(self._key(labels))
+        return (sum(counts[:-1]), counts[-1]) if counts else (0, 0)
+
+    def samples(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", _number(float(bound)))])} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(counts[-1])}')
+        lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+class Registry:
+    """
+    Metrics and collectors rendered by /metrics. A collector is a callable
+    returning (name, type, documentation, value) tuples, read at scrape
+    time from counters kept elsewhere.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, function):
+        self.collectors.append(function)
+        return function
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, metric_type, documentation, value in collector():
+                lines.extend([
+                    f'# HELP {name} {documentation}',
+                    f'# TYPE {name} {metric_type}',
+                    f'{name} {_number(value)}',
+                ])
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'todo_http_requests_total', 'HTTP requests by route and status code', ['method', 'route', 'status'])
+http_duration = registry.histogram(
+    'todo_http_request_duration_seconds', 'HTTP request latency', ['method', 'route'])
+http_response_size = registry.histogram(
+    'todo_http_response_size_bytes', 'Size of the response bodies, streamed responses excluded',
+    ['method', 'route'], buckets=SIZE_BUCKETS)
+db_queries = registry.histogram(
+    'todo_db_queries_per_request', 'Database queries run by one request', ['method', 'route'],
+    buckets=QUERY_COUNT_BUCKETS)
+db_duration = registry.histogram(
+    'todo_db_query_duration_seconds_per_request', 'Time one request spent in database queries',
+    ['method', 'route'])
+ws_connections = registry.counter(
+    'todo_ws_connections_total', 'Accepted WebSocket connections')
+ws_disconnections = registry.counter(
+    'todo_ws_disconnections_total', 'Closed WebSocket connections by close code', ['code'])
+ws_broadcasts = registry.counter(
+    'todo_ws_broadcasts_total', 'Messages sent to the todos group by type', ['type'])
+ws_broadcast_events = registry.counter(
+    'todo_ws_broadcast_events_total', 'Todo events sent to the todos group, batched or not')
+
+@registry.collector
+def collect_websocket_stats():
+    from .events import broadcast_stats
+    from .outbound import queue_stats
+    queues = queue_stats.as_dict()
+    batches = broadcast_stats.as_dict()
+    return [
+        ('todo_ws_open_connections', 'gauge', 'Open WebSocket connections', queues['connections']),
+        ('todo_ws_queued_messages', 'gauge', 'Messages waiting in the WebSocket send queues', queues['queued']),
+        ('todo_ws_max_queued_messages', 'gauge', 'Highest total of queued WebSocket messages', queues['max_queued']),
+        ('todo_ws_merged_events_total', 'counter', 'Events merged into a later event of the same todo', queues['merged_events']),
+        ('todo_ws_dropped_events_total', 'counter', 'Events dropped from the queues of resynced clients', queues['dropped_events']),
+        ('todo_ws_resyncs_total', 'counter', 'Clients disconnected for falling behind', queues['resyncs']),
+        ('todo_ws_coalesced_batches_total', 'counter', 'Coalesced broadcast batches', batches['batches']),
+    ]
+
+class QueryRecorder:
+    """
+    Counts the queries and their time while it is the current recorder
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+current_recorder = ContextVar('todo_query_recorder', default=None)
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper of every connection (see install_query_recorder). The
+    recorder is found through a context variable, so queries that async
+    views run in sync_to_async threads count towards their request.
+    """
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.count += 1
+        recorder.duration += time.perf_counter() - start
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver adding record_query to the connection's
+    execute wrappers, once per connection object
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else 'unmatched'
+
+def observe_request(request, response, recorder, duration):
+    labels = {'method': request.method, 'route': route_name(request)}
+    http_requests.inc(status=response.status_code, **labels)
+    http_duration.observe(duration, **labels)
+    db_queries.observe(recorder.count, **labels)
+    db_duration.observe(recorder.duration, **labels)
+    if not response.streaming:
+        http_response_size.observe(len(response.content), **labels)
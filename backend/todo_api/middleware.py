@@ -1,20 +1,139 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from .cron import update_todo_statuses
+from . import metrics
+import logging
+import os
+import socket
+import threading
 import time
 
+logger = logging.getLogger(__name__)
+
+SWEEP_LEASE_KEY = 'todo_api:lease:expiry_sweep'
+
+def acquire_sweep_lease(ttl):
+    """
+    Takes the expiry sweep lease for `ttl` seconds. cache.add() is atomic,
+    so among all processes sharing the cache only one gets it per interval.
+    The lease is never released, its expiry is what spaces the sweeps.
+    """
+    holder = f'{socket.gethostname()}:{os.getpid()}'
+    return caches[settings.TODO_EXPIRY_LEASE_CACHE_ALIAS].add(SWEEP_LEASE_KEY, holder, timeout=ttl)
+
 class UpdateExpiredTodosMiddleware:
+    # Async capable so async views under ASGI do not pay a thread hop per request
+    sync_capable = True
+    async_capable = True
+
     last_update_time = 0
-    update_interval = 60  # Only update once per minute
+    sweep_thread = None
 
     def __init__(self, get_response):
+        # The expiry scheduler expires todos on time, requests stay sweep-free
+        if settings.TODO_EXPIRY_SCHEDULER:
+            raise MiddlewareNotUsed
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @property
+    def update_interval(self):
+        # Only update once per interval across all processes, read per call
+        # so the setting can change at runtime
+        return settings.TODO_EXPIRY_SWEEP_INTERVAL
 
     def __call__(self, request):
-        # Only update expired todos if enough time has passed since last update
-        current_time = time.time()
-        if current_time - self.__class__.last_update_time > self.__class__.update_interval:
-            if not request.path.startswith('/admin/'):
-                update_todo_statuses()
-                self.__class__.last_update_time = current_time
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.sweep_due(request):
+            self.try_sweep()
                 
         response = self.get_response(request)
-        return response 
\ No newline at end of file
+        return response
+
+    async def __acall__(self, request):
+        if self.sweep_due(request):
+            await sync_to_async(self.try_sweep)()
+        return await self.get_response(request)
+
+    def sweep_due(self, request):
+        """
+        Whether enough time has passed since this process last tried to
+        take the shared lease
+        """
+        current_time = time.time()
+        if current_time - self.__class__.last_update_time <= self.update_interval:
+            return False
+        if request.path.startswith('/admin/'):
+            return False
+        self.__class__.last_update_time = current_time
+        return True
+
+    def try_sweep(self):
+        if acquire_sweep_lease(self.update_interval):
+            self.start_sweep()
+
+    @classmethod
+    def start_sweep(cls):
+        """
+        Runs the sweep off the request thread, one at a time per process
+        """
+        if not settings.TODO_EXPIRY_SWEEP_IN_BACKGROUND:
+            update_todo_statuses()
+            return
+        if cls.sweep_thread is not None and cls.sweep_thread.is_alive():
+            return
+        cls.sweep_thread = threading.Thread(target=cls.sweep, name='todo-expiry-sweep', daemon=True)
+        cls.sweep_thread.start()
+
+    @staticmethod
+    def sweep():
+        try:
+            update_todo_statuses()
+        finally:
+            # The sweep thread's connections are not closed by any request
+            connections.close_all()
+
+class MetricsMiddleware:
+    """
+    Records the latency, database queries and response size of every
+    request by route (see metrics.py). Goes first in MIDDLEWARE so the
+    other middleware is measured too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.TODO_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = metrics.QueryRecorder()
+        token = metrics.current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_recorder.reset(token)
+        metrics.observe_request(request, response, recorder, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        recorder = metrics.QueryRecorder()
+        token = metrics.current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_recorder.reset(token)
+        metrics.observe_request(request, response, recorder, time.perf_counter() - start)
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:17
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractHour, TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    Todo = apps.get_model('todo_api', 'Todo')
+    TodoRollup = apps.get_model('todo_api', 'TodoRollup')
+    rows = (
+        Todo.objects.order_by()
+        .annotate(day=TruncDate('createdAt'), hour=ExtractHour('createdAt'))
+        .values('day', 'hour', 'status', 'priority')
+        .annotate(count=Count('id'))
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        batch.append(TodoRollup(**row))
+        if len(batch) >= 1000:
+            TodoRollup.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        TodoRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0002_todo_priority_todo_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('status', models.CharField(choices=[('ongoing', 'Ongoing'), ('success', 'Success'), ('failure', 'Failure')], max_length=10)),
+                ('priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'hour', 'status', 'priority'), name='todo_rollup_unique_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0003_todorollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['-createdAt', '-id'], name='todo_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['status', '-createdAt', '-id'], name='todo_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['status', '-updatedAt', '-id'], name='todo_status_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(condition=models.Q(('status', 'ongoing')), fields=['status', 'deadline'], name='todo_ongoing_deadline_idx'),
+        ),
+    ]
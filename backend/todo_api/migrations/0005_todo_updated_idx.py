@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0004_todo_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['updatedAt', 'id'], name='todo_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0005_todo_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('todo_id', models.UUIDField()),
+                ('op', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['seq'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:38
+
+from django.db import migrations, models
+
+
+def mark_existing_published(apps, schema_editor):
+    """
+    Changes logged before the outbox existed were already broadcast
+    """
+    TodoChange = apps.get_model('todo_api', 'TodoChange')
+    TodoChange.objects.update(publishedAt=models.F('createdAt'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0006_todochange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todochange',
+            name='payload',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='todochange',
+            name='publishedAt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_published, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='todochange',
+            index=models.Index(condition=models.Q(('publishedAt__isnull', True)), fields=['seq'], name='todo_change_unpublished_idx'),
+        ),
+    ]
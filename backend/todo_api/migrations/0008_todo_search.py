@@ -0,0 +1,79 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+# Must match search.SEARCH_CONFIG and search.FTS_TABLE
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'todo_api_todo_fts'
+
+# The FTS5 row of a todo is found through the todo_id column of the
+# full-text index itself, then checked for an exact match
+FTS_ROW = f"{FTS_TABLE} MATCH 'todo_id:\"' || old.id || '\"' AND todo_id = old.id"
+
+# SQLite drops the triggers when a migration rebuilds todo_api_todo (most
+# AlterField/RemoveField operations), such migrations must re-create them
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(todo_id, title, description, tokenize='porter unicode61')",
+    f'INSERT INTO {FTS_TABLE} (todo_id, title, description) SELECT id, title, description FROM todo_api_todo',
+    f'CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON todo_api_todo BEGIN '
+    f'INSERT INTO {FTS_TABLE} (todo_id, title, description) VALUES (new.id, new.title, new.description); END',
+    f'CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF title, description ON todo_api_todo BEGIN '
+    f'UPDATE {FTS_TABLE} SET title = new.title, description = new.description WHERE {FTS_ROW}; END',
+    f'CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON todo_api_todo BEGIN '
+    f'DELETE FROM {FTS_TABLE} WHERE {FTS_ROW}; END',
+]
+
+SQLITE_DROP = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def postgres_indexes():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    return [
+        # Same expression as the search.py query, so the planner uses it
+        GinIndex(SearchVector('title', 'description', config=SEARCH_CONFIG), name='todo_search_idx'),
+        # tags @> '[...]' containment lookups
+        GinIndex(fields=['tags'], opclasses=['jsonb_path_ops'], name='todo_tags_idx'),
+    ]
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        Todo = apps.get_model('todo_api', 'Todo')
+        for index in postgres_indexes():
+            schema_editor.add_index(Todo, index)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        Todo = apps.get_model('todo_api', 'Todo')
+        for index in postgres_indexes():
+            schema_editor.remove_index(Todo, index)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0007_todochange_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['deadline', 'id'], name='todo_deadline_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
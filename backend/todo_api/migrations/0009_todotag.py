@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0008_todo_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('ongoing', 'Ongoing'), ('success', 'Success'), ('failure', 'Failure')], max_length=10)),
+                ('todo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_entries', to='todo_api.todo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'status'], name='todo_tag_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tag', 'todo'), name='todo_tag_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:46
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+MAX_LENGTH = 100
+
+
+def backfill_tags(apps, schema_editor):
+    """
+    Indexes the existing JSON tags, one transaction per batch of todos so a
+    large table is neither locked nor held in memory as a whole. Rows the
+    application indexed in the meantime are skipped.
+    """
+    Todo = apps.get_model('todo_api', 'Todo')
+    TodoTag = apps.get_model('todo_api', 'TodoTag')
+    last_id = None
+    while True:
+        todos = Todo.objects.order_by('id')
+        if last_id is not None:
+            todos = todos.filter(id__gt=last_id)
+        batch = list(todos.values_list('id', 'tags', 'status')[:BATCH_SIZE])
+        if not batch:
+            break
+        entries = [
+            TodoTag(todo_id=todo_id, tag=tag, status=status)
+            for todo_id, tags, status in batch if isinstance(tags, list)
+            for tag in set(tags) if isinstance(tag, str) and 0 < len(tag) <= MAX_LENGTH
+        ]
+        with transaction.atomic():
+            TodoTag.objects.bulk_create(entries, ignore_conflicts=True)
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('todo_api', '0009_todotag'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:19
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_tag_rollups(apps, schema_editor):
+    TodoTag = apps.get_model('todo_api', 'TodoTag')
+    TodoTagRollup = apps.get_model('todo_api', 'TodoTagRollup')
+    rows = (
+        TodoTag.objects.order_by()
+        .annotate(day=TruncDate('todo__createdAt'))
+        .values('day', 'tag', 'status')
+        .annotate(count=Count('id'))
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        batch.append(TodoTagRollup(**row))
+        if len(batch) >= 1000:
+            TodoTagRollup.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        TodoTagRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo_api', '0010_backfill_todotag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoTagRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('tag', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('ongoing', 'Ongoing'), ('success', 'Success'), ('failure', 'Failure')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'tag', 'status'), name='todo_tag_rollup_unique_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_tag_rollups, migrations.RunPython.noop),
+    ]
@@ -33,7 +33,128 @@ class Todo(models.Model):
     updatedAt = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-createdAt'] 
+        ordering = ['-createdAt']
+        indexes = [
+            # Default listing order and the createdAt range scans of the analytics
+            models.Index(fields=['-createdAt', '-id'], name='todo_created_idx'),
+            # ongoing/success/failure actions
+            models.Index(fields=['status', '-createdAt', '-id'], name='todo_status_created_idx'),
+            # Completed todos ordered by completion time (updatedAt)
+            models.Index(fields=['status', '-updatedAt', '-id'], name='todo_status_updated_idx'),
+            # Resumable export order
+            models.Index(fields=['updatedAt', 'id'], name='todo_updated_idx'),
+            # Expiry sweep: only ongoing todos can expire
+            models.Index(
+                fields=['status', 'deadline'],
+                condition=models.Q(status='ongoing'),
+                name='todo_ongoing_deadline_idx'
+            ),
+            # Deadline range search (see search.py). The full-text and tag
+            # indexes are vendor specific and created by 0008_todo_search.
+            models.Index(fields=['deadline', 'id'], name='todo_deadline_idx'),
+        ]
     
     def __str__(self):
         return self.title
+
+class TodoTag(models.Model):
+    """
+    Inverted index of Todo.tags, one row per (tag, todo), kept in sync on
+    every write (see tag_index.py). The todo status is copied so per-tag
+    status counts never join the todos.
+    """
+    MAX_LENGTH = 100
+
+    todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='tag_entries')
+    tag = models.CharField(max_length=MAX_LENGTH)
+    status = models.CharField(max_length=10, choices=Todo.STATUS_CHOICES)
+
+    class Meta:
+        constraints = [
+            # Also the index of the tag lookups
+            models.UniqueConstraint(fields=['tag', 'todo'], name='todo_tag_unique'),
+        ]
+        indexes = [
+            # Covers the per-tag status aggregates
+            models.Index(fields=['tag', 'status'], name='todo_tag_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag}: {self.todo_id}'
+
+class TodoRollup(models.Model):
+    """
+    Materialized todo counts per creation day, creation hour, status and
+    priority, maintained incrementally on every write (see rollups.py)
+    """
+    day = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=10, choices=Todo.STATUS_CHOICES)
+    priority = models.CharField(max_length=10, choices=Todo.PRIORITY_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'hour', 'status', 'priority'],
+                name='todo_rollup_unique_bucket'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.hour:02d}h {self.status}/{self.priority}: {self.count}'
+
+class TodoTagRollup(models.Model):
+    """
+    Materialized todo counts per creation day, tag and status, maintained
+    together with TodoRollup (see rollups.py)
+    """
+    day = models.DateField()
+    tag = models.CharField(max_length=TodoTag.MAX_LENGTH)
+    status = models.CharField(max_length=10, choices=Todo.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'tag', 'status'],
+                name='todo_tag_rollup_unique_bucket'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.tag} {self.status}: {self.count}'
+
+class TodoChange(models.Model):
+    """
+    Append-only log of todo writes. `seq` is the sync version WebSocket
+    clients resume from after a reconnect (see changes.py). It doubles as
+    the transactional outbox: `payload` is the WebSocket event of the write,
+    published by the relay (see outbox.py), which then sets `publishedAt`.
+    """
+    OP_CHOICES = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True)
+    todo_id = models.UUIDField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    payload = models.JSONField(null=True, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+    publishedAt = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['seq']
+        indexes = [
+            # Outbox relay: only the few unpublished changes are indexed
+            models.Index(
+                fields=['seq'],
+                condition=models.Q(publishedAt__isnull=True),
+                name='todo_change_unpublished_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'#{self.seq} {self.op} {self.todo_id}'
@@ -0,0 +1,206 @@
+from collections import deque
+from django.conf import settings
+from .events import client_message
+import asyncio
+import threading
+
+# Kinds of queued items: a broadcast event (forwarded with its pre-encoded
+# frame), a message encoded for the client, a batch of merged events
+# (written as one todo_batch message) or the request to close
+EVENT = 'event'
+MESSAGE = 'message'
+MERGED = 'merged'
+CLOSE = 'close'
+
+# Close code of the clients dropped for falling behind, they reconnect
+# with ?since= to get what they missed
+RESYNC_CLOSE_CODE = 4008
+
+class QueueStats:
+    """
+    Per-process counters of the WebSocket outbound queues
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.merged = 0
+        self.dropped = 0
+        self.resyncs = 0
+
+    def record_depth(self, delta):
+        with self.lock:
+            self.depth += delta
+            self.max_depth = max(self.max_depth, self.depth)
+
+    def record_connection(self, delta):
+        with self.lock:
+            self.connections += delta
+
+    def record_merged(self, count):
+        with self.lock:
+            self.merged += count
+
+    def record_resync(self, dropped):
+        with self.lock:
+            self.resyncs += 1
+            self.dropped += dropped
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'connections': self.connections,
+                'queued': self.depth,
+                'max_queued': self.max_depth,
+                'merged_events': self.merged,
+                'dropped_events': self.dropped,
+                'resyncs': self.resyncs
+            }
+
+queue_stats = QueueStats()
+
+def _todo_id(event):
+    return event['todo_id'] if event['type'] == 'todo_delete' else event['todo']['id']
+
+def _flatten(event):
+    return event['events'] if event['type'] == 'todo_batch' else [event]
+
+class OutboundQueue:
+    """
+    Bounded queue of the messages waiting to be written to one WebSocket
+
+    The consumer's writer task takes items off the queue and awaits each
+    write, so a client that reads slower than events arrive makes the
+    queue grow instead of the server's socket buffer. Once `merge_at` items
+    are waiting, the queued and incoming broadcast events are merged into
+    the latest event per todo id. A client with more than `max_size` items
+    waiting even then overflows: its queue is dropped and it must resync.
+    """
+    def __init__(self, max_size=None, merge_at=None):
+        self.max_size = max_size or settings.TODO_WS_QUEUE_MAX
+        self.merge_at = merge_at or settings.TODO_WS_QUEUE_MERGE_AT
+        self.items = deque()
+        # todo id -> latest event, the open merge batch at the tail of items
+        self.merging = None
+        self.depth = 0
+        self.overflowed = False
+        self.ready = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def __len__(self):
+        return self.depth
+
+    def _resize(self, delta):
+        self.depth += delta
+        queue_stats.record_depth(delta)
+
+    def put(self, kind, payload=None):
+        """
+        Queues an item for the writer
+
+        Returns:
+            False if the queue overflowed, the item is then dropped
+        """
+        if self.overflowed:
+            return False
+        if kind == EVENT and (self.merging is not None or self.depth >= self.merge_at):
+            self._merge(payload)
+        else:
+            self.merging = None
+            self.items.append((kind, payload))
+            self._resize(1)
+        if self.depth > self.max_size:
+            self.overflow()
+            return False
+        self.idle.clear()
+        self.ready.set()
+        return True
+
+    def _merge(self, event):
+        if self.merging is None:
+            # Fold the broadcast events at the tail of the queue, up to the
+            # last message that must keep its place
+            self.merging = {}
+            self.items.append((MERGED, self.merging))
+            folded = []
+            while len(self.items) > 1 and self.items[-2][0] == EVENT:
+                folded.append(self.items[-2][1])
+                del self.items[-2]
+                self._resize(-1)
+            for queued in reversed(folded):
+                self._merge_events(_flatten(queued))
+        self._merge_events(_flatten(event))
+
+    def _merge_events(self, events):
+        for event in events:
+            todo_id = _todo_id(event)
+            previous = self.merging.pop(todo_id, None)
+            if previous is None:
+                self._resize(1)
+            else:
+                queue_stats.record_merged(1)
+                if previous['type'] == 'todo_create' and event['type'] == 'todo_update':
+                    # Not sent yet, so the client still has to create it
+                    event = {**event, 'type': 'todo_create'}
+            self.merging[todo_id] = event
+
+    def overflow(self):
+        """
+        Drops every queued item
+        """
+        dropped = sum(len(payload) if kind == MERGED else 1 for kind, payload in self.items)
+        self.release()
+        self.overflowed = True
+        queue_stats.record_resync(dropped)
+
+    def resync(self, message):
+        """
+        Queues the resync message and the close request of an overflowed
+        queue, bypassing the limits
+        """
+        self.items.extend([(MESSAGE, message), (CLOSE, RESYNC_CLOSE_CODE)])
+        self._resize(2)
+        self.idle.clear()
+        self.ready.set()
+
+    async def get(self):
+        """
+        Waits for the next item to write
+
+        Returns:
+            (kind, payload) tuple, merged events come as one todo_batch message
+        """
+        while not self.items:
+            self.idle.set()
+            self.ready.clear()
+            await self.ready.wait()
+        kind, payload = self.items.popleft()
+        if kind == MERGED:
+            if payload is self.merging:
+                self.merging = None
+            self._resize(-len(payload))
+            return MESSAGE, {'type': 'todo_batch', 'events': [client_message(event) for event in payload.values()]}
+        self._resize(-1)
+        if kind == CLOSE:
+            # Nothing is written after the close
+            self.idle.set()
+        return kind, payload
+
+    def release(self):
+        """
+        Removes the items left at disconnect from the stats
+        """
+        self.items.clear()
+        self.merging = None
+        self._resize(-self.depth)
+
+    async def join(self):
+        """
+        Waits until the writer has taken every item and asks for the next one
+        """
+        await self.idle.wait()
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from .events import CoalescingBroadcaster
+from .models import TodoChange
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Outbox relay: publishes the events stored in the change log by the writes
+# (see changes.record_changes) to the todos group. A write therefore only
+# costs its own transaction, whatever the state of the channel layer, and
+# an event whose publication fails is retried until it goes through.
+#
+# TODO_OUTBOX_RELAY selects who runs the relay: 'thread' wakes a background
+# thread of the writing process after every commit, 'command' leaves it to
+# `manage.py run_outbox_relay` workers and 'inline' publishes right after
+# the commit in the writing thread (the in-memory channel layer used with
+# DEBUG cannot deliver messages sent from another thread).
+#
+# Any number of relays may run, one per web process with 'thread', but only
+# one publishes at a time: relay_batch holds RELAY_LOCK_ID (and the process
+# lock) while it reads, publishes and marks its batch. Change seqs are
+# allocated in commit order (see changes.lock_sequence), so the oldest
+# unpublished rows are always the next ones to send and events go out in
+# seq order whichever relay publishes them. Several relays on one SQLite
+# database are not serialized, SQLite is for development only.
+
+# Key of the PostgreSQL advisory lock held by the publishing relay
+RELAY_LOCK_ID = 0x72656c61
+relay_lock = threading.Lock()
+# First delay before retrying after a failed publication, doubled on every
+# further failure up to TODO_OUTBOX_MAX_RETRY_DELAY
+MIN_RETRY_DELAY = 0.5
+
+def lock_relay():
+    """
+    Makes the current transaction the only one publishing, until it ends
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [RELAY_LOCK_ID])
+
+def relay_batch(batch_size=None):
+    """
+    Publishes the oldest unpublished events as one todo_batch message and
+    marks them published, in one transaction
+
+    Returns:
+        Number of events published
+
+    Raises:
+        Exception: Whatever the channel layer raised, the events then stay
+            unpublished for the next attempt
+    """
+    batch_size = batch_size or settings.TODO_OUTBOX_BATCH_SIZE
+    with relay_lock, transaction.atomic():
+        lock_relay()
+        rows = list(
+            TodoChange.objects.filter(publishedAt__isnull=True)
+            .order_by('seq')[:batch_size]
+        )
+        if not rows:
+            return 0
+        with CoalescingBroadcaster(window=0, max_size=batch_size) as broadcaster:
+            for row in rows:
+                if row.payload is not None:
+                    broadcaster.add({**row.payload, 'seq': row.seq})
+        TodoChange.objects.filter(pk__in=[row.seq for row in rows]).update(publishedAt=timezone.now())
+    return len(rows)
+
+def relay_pending(batch_size=None):
+    """
+    Publishes every unpublished event, batch by batch
+
+    Returns:
+        Number of events published
+    """
+    batch_size = batch_size or settings.TODO_OUTBOX_BATCH_SIZE
+    published = 0
+    while True:
+        count = relay_batch(batch_size)
+        published += count
+        if count < batch_size:
+            return published
+
+def run_relay(stop, wake=None, poll_interval=None):
+    """
+    Relay loop: publishes pending events whenever `wake` is set, and every
+    `poll_interval` seconds without a wake-up, backing off exponentially
+    while publishing fails
+
+    Args:
+        stop: threading.Event ending the loop
+        wake: Optional threading.Event set by writers after their commit
+        poll_interval: Seconds between polls, TODO_OUTBOX_POLL_INTERVAL by
+            default. With `wake` the poll is only a safety net for events
+            another process committed but could not publish.
+    """
+    poll_interval = poll_interval or settings.TODO_OUTBOX_POLL_INTERVAL
+    wake = wake or threading.Event()
+    retry_delay = 0
+    while not stop.is_set():
+        try:
+            relay_pending()
+            retry_delay = 0
+        except Exception as e:
+            retry_delay = min(max(retry_delay * 2, MIN_RETRY_DELAY), settings.TODO_OUTBOX_MAX_RETRY_DELAY)
+            logger.error(f'Error relaying todo events, retrying in {retry_delay:.1f}s: {str(e)}')
+            stop.wait(retry_delay)
+            continue
+        wake.wait(poll_interval)
+        wake.clear()
+
+class RelayThread:
+    """
+    Per-process relay started on the first write, for TODO_OUTBOX_RELAY='thread'.
+    Woken after every commit of the process, it otherwise polls every
+    TODO_OUTBOX_POLL_INTERVAL seconds.
+    """
+    lock = threading.Lock()
+    thread = None
+    wake = threading.Event()
+    stop = threading.Event()
+
+    @classmethod
+    def notify(cls):
+        with cls.lock:
+            if cls.thread is None or not cls.thread.is_alive():
+                cls.thread = threading.Thread(target=cls.run, name='todo-outbox-relay', daemon=True)
+                cls.thread.start()
+        cls.wake.set()
+
+    @classmethod
+    def run(cls):
+        try:
+            run_relay(cls.stop, cls.wake)
+        finally:
+            connections.close_all()
+
+def relay_inline():
+    try:
+        relay_pending()
+    except Exception as e:
+        # Left in the outbox for the next write or relay run
+        logger.error(f'Error relaying todo events: {str(e)}')
+
+def relay_on_commit():
+    """
+    Triggers the relay of this process once the current transaction commits
+    """
+    if settings.TODO_OUTBOX_RELAY == 'thread':
+        transaction.on_commit(RelayThread.notify)
+    elif settings.TODO_OUTBOX_RELAY == 'inline':
+        transaction.on_commit(relay_inline)
@@ -0,0 +1,158 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections.abc import Mapping
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+import uuid
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on (createdAt, id), newest first
+
+    Every page is a single index range scan on todo_created_idx, so fetching
+    page N costs the same as fetching page 1, and rows inserted while a
+    client is paging never shift the pages it has not read yet.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    ordering = ('-createdAt', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, position):
+        created, pk = position
+        token = f'{created.isoformat()}|{pk}'.encode('ascii')
+        return urlsafe_b64encode(token).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        Returns the (createdAt, id) position encoded in the cursor query
+        parameter, or None on the first page
+
+        Raises:
+            ParseError: If the cursor cannot be decoded, a 400 like every
+                other malformed query parameter
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return self.parse_cursor(encoded)
+        except ValueError:
+            raise ParseError(self.invalid_cursor_message)
+
+    def parse_cursor(self, encoded):
+        """
+        Returns the (createdAt, id) position of an encoded cursor
+
+        Raises:
+            ValueError: If the cursor cannot be decoded
+        """
+        try:
+            created, pk = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created = parse_datetime(created)
+            pk = uuid.UUID(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise ValueError(self.invalid_cursor_message)
+        if created is None:
+            raise ValueError(self.invalid_cursor_message)
+        return created, pk
+
+    def filter_queryset(self, queryset, position):
+        """
+        Orders the queryset and skips every row up to and including `position`
+        """
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            created, pk = position
+            queryset = queryset.filter(
+                Q(createdAt__lt=created) | Q(createdAt=created, id__lt=pk)
+            )
+        return queryset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = self.filter_queryset(queryset, self.decode_cursor(request))
+
+        rows = list(queryset[:self.page_size + 1])
+        page = rows[:self.page_size]
+        self.next_position = None
+        if len(rows) > self.page_size:
+            self.next_position = self.get_position(page[-1])
+        return page
+
+    def get_position(self, row):
+        """
+        Returns the (createdAt, id) of a model instance or a .values() row
+        """
+        if isinstance(row, Mapping):
+            return row['createdAt'], row['id']
+        return row.createdAt, row.id
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+class CappedListPagination(BasePagination):
+    """
+    Backs the legacy ?no_page parameter: returns a plain list like an
+    unpaginated response, but never more than TODO_NO_PAGE_MAX_RESULTS rows.
+    Truncated responses point to the streaming export with a Link header.
+    """
+    export_path = '/api/todos/export/'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.max_results = settings.TODO_NO_PAGE_MAX_RESULTS
+        rows = list(queryset[:self.max_results + 1])
+        self.truncated = len(rows) > self.max_results
+        return rows[:self.max_results]
+
+    def get_paginated_response(self, data):
+        headers = {}
+        if self.truncated:
+            export_url = self.request.build_absolute_uri(self.export_path)
+            headers['X-Results-Truncated'] = str(self.max_results)
+            headers['Link'] = f'<{export_url}>; rel="export"'
+        return Response(data, headers=headers)
+
+    def get_paginated_response_schema(self, schema):
+        return schema
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+from urllib.parse import urlencode
+import datetime
+import functools
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'todo_api'
+GENERATION_KEY = f'{KEY_PREFIX}:generation'
+HITS_KEY = f'{KEY_PREFIX}:cache_hits'
+MISSES_KEY = f'{KEY_PREFIX}:cache_misses'
+LAST_MODIFIED_KEY = f'{KEY_PREFIX}:last_modified'
+
+def get_cache():
+    return caches[settings.TODO_RESPONSE_CACHE_ALIAS]
+
+def _incr(key):
+    """
+    Increments a counter, creating it if it was evicted or never set
+    """
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Seed with a time based value so a re-created generation never
+        # repeats one that is still referenced by cached entries or ETags
+        initial = time.time_ns() if key == GENERATION_KEY else 0
+        cache.add(key, initial, timeout=None)
+        return cache.incr(key)
+
+def get_generation():
+    """
+    Returns the current write generation, initializing it if needed
+    """
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+def bump_generation():
+    """
+    Invalidates every cached todo/analytics response by starting a new
+    write generation. Deferred until the current transaction commits so no
+    reader can cache pre-commit data under the new generation.
+    """
+    transaction.on_commit(_start_generation)
+
+def _start_generation():
+    _incr(GENERATION_KEY)
+    get_cache().set(LAST_MODIFIED_KEY, time.time(), timeout=None)
+
+def get_last_modified():
+    """
+    Returns the time of the last write as a UTC datetime, or None if it is
+    not known (no write since the cache was last cleared)
+    """
+    timestamp = get_cache().get(LAST_MODIFIED_KEY)
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+def request_fingerprint(request):
+    """
+    Digest of the request path and its sorted query parameters, so that
+    equivalent URLs map to the same cache entry and ETag
+    """
+    query = urlencode(sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+    ))
+    return hashlib.sha1(f'{request.path}?{query}'.encode('utf-8')).hexdigest()
+
+def cache_key(request, generation):
+    """
+    Builds the cache key of a GET request for the given write generation
+    """
+    return f'{KEY_PREFIX}:response:{generation}:{request_fingerprint(request)}'
+
+def get_stats():
+    """
+    Returns the response cache hit/miss counters
+    """
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / lookups, 4) if lookups else 0,
+        'generation': get_generation()
+    }
+
+def cached_response(func):
+    """
+    Decorator caching successful GET responses of API views
+
+    Entries are keyed on the path, the normalized query parameters and the
+    write generation, so every write invalidates them at once. Eviction is
+    left to the cache backend (LRU + TODO_RESPONSE_CACHE_TIMEOUT).
+
+    Args:
+        func: The view method to wrap
+
+    Returns:
+        Wrapped view method
+    """
+    @functools.wraps(func)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET' or not settings.TODO_RESPONSE_CACHE_ENABLED:
+            return func(self, request, *args, **kwargs)
+
+        cache = get_cache()
+        key = cache_key(request, get_generation())
+        cached = cache.get(key)
+        if cached is not None:
+            _incr(HITS_KEY)
+            response = Response(cached['data'], status=cached['status'], headers=cached['headers'])
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _incr(MISSES_KEY)
+        response = func(self, request, *args, **kwargs)
+        # Streaming responses and errors are never cached
+        if isinstance(response, Response) and response.status_code == 200:
+            cache.set(key, {
+                'data': response.data,
+                'status': response.status_code,
+                'headers': dict(response.items())
+            }, timeout=settings.TODO_RESPONSE_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
@@ -0,0 +1,264 @@
+from collections import Counter
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+from .models import Todo, TodoRollup, TodoTag, TodoTagRollup
+from .tag_index import index_tags
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+# Buckets changed per UPDATE, each one adds a WHEN branch and a WHERE term
+DELTA_BATCH_SIZE = 200
+
+BUCKET_FIELDS = ('day', 'hour', 'status', 'priority')
+TAG_BUCKET_FIELDS = ('day', 'tag', 'status')
+
+def rollup_key(todo):
+    """
+    Returns the (day, hour, status, priority) rollup bucket of a todo
+
+    The day and hour are taken in the current timezone so they agree with
+    TruncDate/ExtractHour in the database.
+    """
+    created = timezone.localtime(todo.createdAt)
+    return (created.date(), created.hour, todo.status, todo.priority)
+
+def tag_rollup_keys(todo):
+    """
+    Returns the (day, tag, status) tag rollup buckets of a todo, one per
+    indexed tag
+    """
+    day = timezone.localtime(todo.createdAt).date()
+    return frozenset((day, tag, todo.status) for tag in index_tags(todo.tags))
+
+def rollup_state(todo):
+    """
+    Returns every bucket a todo is counted in, as (rollup key, tag rollup
+    keys). Taken from the locked row before an update and passed to
+    record_update(s).
+    """
+    return rollup_key(todo), tag_rollup_keys(todo)
+
+def _apply(model, fields, deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    keys = sorted(deltas)
+    for start in range(0, len(keys), DELTA_BATCH_SIZE):
+        batch = [(dict(zip(fields, key)), deltas[key]) for key in keys[start:start + DELTA_BATCH_SIZE]]
+        # Create the missing buckets empty, skipping those that exist or
+        # that a concurrent writer creates, then add every delta in one UPDATE
+        model.objects.bulk_create([model(count=0, **values) for values, _ in batch], ignore_conflicts=True)
+        model.objects.filter(reduce(or_, (Q(**values) for values, _ in batch))).update(
+            count=F('count') + Case(
+                *[When(Q(**values), then=Value(delta)) for values, delta in batch],
+                output_field=IntegerField()
+            )
+        )
+
+def apply_deltas(deltas, tag_deltas=None):
+    """
+    Adds the given count deltas to their rollup buckets, in two queries per
+    table and DELTA_BATCH_SIZE buckets
+
+    Args:
+        deltas: Mapping of rollup key -> count delta
+        tag_deltas: Mapping of tag rollup key -> count delta
+    """
+    _apply(TodoRollup, BUCKET_FIELDS, deltas)
+    _apply(TodoTagRollup, TAG_BUCKET_FIELDS, tag_deltas or {})
+
+def _state_deltas(deltas, tag_deltas, old_state, new_state):
+    (old_key, old_tag_keys), (new_key, new_tag_keys) = old_state, new_state
+    if old_key != new_key:
+        deltas[old_key] -= 1
+        deltas[new_key] += 1
+    for key in old_tag_keys - new_tag_keys:
+        tag_deltas[key] -= 1
+    for key in new_tag_keys - old_tag_keys:
+        tag_deltas[key] += 1
+
+def record_create(todo):
+    """
+    Counts a newly created todo
+    """
+    record_creates([todo])
+
+def record_update(old_state, todo):
+    """
+    Moves a todo from its previous buckets to its current ones if they changed
+
+    Args:
+        old_state: rollup_state() of the todo before the update
+        todo: The updated todo
+    """
+    record_updates({todo.pk: old_state}, [todo])
+
+def record_creates(todos):
+    """
+    Counts a batch of newly created todos
+    """
+    deltas, tag_deltas = Counter(), Counter()
+    for todo in todos:
+        deltas[rollup_key(todo)] += 1
+        tag_deltas.update(tag_rollup_keys(todo))
+    apply_deltas(deltas, tag_deltas)
+
+def record_updates(old_states, todos):
+    """
+    Moves a batch of updated todos to their current buckets
+
+    Args:
+        old_states: Mapping of todo id -> rollup_state() before the update
+        todos: The updated todos
+    """
+    deltas, tag_deltas = Counter(), Counter()
+    for todo in todos:
+        _state_deltas(deltas, tag_deltas, old_states[todo.pk], rollup_state(todo))
+    apply_deltas(deltas, tag_deltas)
+
+def record_delete(todo):
+    """
+    Removes a deleted todo from its buckets
+    """
+    tag_deltas = Counter()
+    tag_deltas.subtract(tag_rollup_keys(todo))
+    apply_deltas({rollup_key(todo): -1}, tag_deltas)
+
+def record_delete_queryset(queryset):
+    """
+    Removes every todo of `queryset` from its buckets. Must be called before
+    the queryset is deleted, inside the same transaction as the delete.
+    """
+    deltas, tag_deltas = Counter(), Counter()
+    for row in _grouped_counts(queryset):
+        deltas[_key(row, BUCKET_FIELDS)] -= row['count']
+    for row in _grouped_tag_counts(TodoTag.objects.filter(todo__in=queryset)):
+        tag_deltas[_key(row, TAG_BUCKET_FIELDS)] -= row['count']
+    apply_deltas(deltas, tag_deltas)
+
+def record_status_change(queryset, new_status):
+    """
+    Moves every todo of `queryset` to `new_status`. Must be called before
+    the queryset and the tag index are updated, inside the same transaction
+    as the update.
+    """
+    deltas, tag_deltas = Counter(), Counter()
+    for row in _grouped_counts(queryset):
+        deltas[_key(row, BUCKET_FIELDS)] -= row['count']
+        deltas[_key({**row, 'status': new_status}, BUCKET_FIELDS)] += row['count']
+    for row in _grouped_tag_counts(TodoTag.objects.filter(todo__in=queryset)):
+        tag_deltas[_key(row, TAG_BUCKET_FIELDS)] -= row['count']
+        tag_deltas[_key({**row, 'status': new_status}, TAG_BUCKET_FIELDS)] += row['count']
+    apply_deltas(deltas, tag_deltas)
+
+def _key(row, fields):
+    return tuple(row[field] for field in fields)
+
+def _grouped_counts(queryset):
+    return (
+        queryset.order_by()
+        .annotate(day=TruncDate('createdAt'), hour=ExtractHour('createdAt'))
+        .values('day', 'hour', 'status', 'priority')
+        .annotate(count=Count('id'))
+    )
+
+def _grouped_tag_counts(queryset):
+    return (
+        queryset.order_by()
+        .annotate(day=TruncDate('todo__createdAt'))
+        .values('day', 'tag', 'status')
+        .annotate(count=Count('id'))
+    )
+
+# Rollup table -> (key fields, live aggregate of the key fields and counts)
+TABLES = (
+    (TodoRollup, BUCKET_FIELDS, lambda: _grouped_counts(Todo.objects.all())),
+    (TodoTagRollup, TAG_BUCKET_FIELDS, lambda: _grouped_tag_counts(TodoTag.objects.all())),
+)
+
+def live_counts(batch_size=DEFAULT_BATCH_SIZE, model=TodoRollup):
+    """
+    Yields the buckets of a rollup table computed from the live tables
+    """
+    for table, fields, grouped in TABLES:
+        if table is model:
+            for row in grouped().iterator(chunk_size=batch_size):
+                yield _key(row, fields), row['count']
+
+def rebuild_rollups(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Rebuilds the rollup tables from scratch, reading the live aggregates and
+    writing the buckets in batches of `batch_size`
+
+    Returns:
+        Number of buckets written
+    """
+    written = 0
+    with transaction.atomic():
+        for model, fields, _ in TABLES:
+            model.objects.all().delete()
+            batch = []
+            for key, count in live_counts(batch_size, model):
+                batch.append(model(count=count, **dict(zip(fields, key))))
+                if len(batch) >= batch_size:
+                    model.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                model.objects.bulk_create(batch)
+                written += len(batch)
+    logger.info(f'Rebuilt todo rollups: {written} buckets')
+    return written
+
+def check_rollups(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Compares the rollup tables against the live aggregates
+
+    Returns:
+        List of {'table', 'bucket', 'expected', 'actual'} dicts, empty when
+        consistent
+    """
+    mismatches = []
+    for model, fields, _ in TABLES:
+        expected = dict(live_counts(batch_size, model))
+        actual = {
+            _key(row, fields): row['count']
+            for row in model.objects.values(*fields, 'count').iterator(chunk_size=batch_size)
+        }
+        for key in sorted(set(expected) | set(actual)):
+            if expected.get(key, 0) != actual.get(key, 0):
+                mismatches.append({
+                    'table': model._meta.db_table,
+                    'bucket': key,
+                    'expected': expected.get(key, 0),
+                    'actual': actual.get(key, 0)
+                })
+    return mismatches
+
+def status_distribution():
+    """
+    Returns the number of todos per status from the rollup table, in the
+    order of analytics.status_distribution()
+    """
+    return list(
+        TodoRollup.objects.values('status')
+        .annotate(count=Sum('count'))
+        .filter(count__gt=0)
+        .order_by('status')
+    )
+
+def creation_hour_distribution():
+    """
+    Returns the number of todos created in each hour of the day from the
+    rollup table, skipping empty hours
+    """
+    return list(
+        TodoRollup.objects.values('hour')
+        .annotate(count=Sum('count'))
+        .filter(count__gt=0)
+        .order_by('hour')
+    )
@@ -0,0 +1,194 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from .cron import update_todo_statuses
+from .models import Todo
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Channel layer group the scheduler listens on for new deadlines
+EXPIRY_GROUP = 'todo_expiry'
+
+# Margin added to a deadline before sweeping, the sweep expires deadline < now
+EXPIRY_MARGIN = 0.01
+# Delay before restarting a failed scheduler loop, doubled on every further
+# failure up to MAX_RETRY_DELAY
+MIN_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 60.0
+
+def scheduler_enabled():
+    return bool(settings.TODO_EXPIRY_SCHEDULER)
+
+def notify_deadlines(todos):
+    """
+    Tells the expiry scheduler about the deadlines of written todos once the
+    current transaction commits. Only ongoing todos can expire.
+    """
+    if not scheduler_enabled():
+        return
+    deadlines = sorted({todo.deadline.timestamp() for todo in todos if todo.status == 'ongoing'})
+    if deadlines:
+        transaction.on_commit(lambda: _send_deadlines(deadlines))
+
+def _send_deadlines(deadlines):
+    try:
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(EXPIRY_GROUP, {
+            'type': 'expiry.schedule',
+            'deadlines': deadlines
+        })
+    except Exception as e:
+        # The scheduler reloads its deadlines every horizon, a lost
+        # notification only delays that todo's expiry
+        logger.error(f'Error notifying the expiry scheduler: {str(e)}')
+
+def upcoming_deadlines(until):
+    """
+    Returns the distinct deadlines (timestamps) of ongoing todos before `until`
+    """
+    cutoff = datetime.datetime.fromtimestamp(until, tz=datetime.timezone.utc)
+    return [
+        deadline.timestamp()
+        for deadline in Todo.objects.filter(status='ongoing', deadline__lt=cutoff)
+        .order_by().values_list('deadline', flat=True).distinct()
+    ]
+
+class ExpiryScheduler:
+    """
+    Expires todos when their deadline passes instead of polling
+
+    Keeps a min-heap of the deadlines of ongoing todos due within the next
+    `horizon` seconds, sleeps until the earliest one and runs the expiry
+    sweep. Writes push new deadlines through the channel layer (see
+    notify_deadlines) and the heap is reloaded from the database every
+    horizon. The sweep itself selects the expired rows in the database, so
+    a deadline that was changed or completed in the meantime only costs an
+    empty sweep.
+    """
+    def __init__(self, horizon=None):
+        self.horizon = horizon or settings.TODO_EXPIRY_SCHEDULER_HORIZON
+        self.heap = []
+        self.scheduled = set()
+        self.reload_at = 0
+        self.wakeup = asyncio.Event()
+
+    def schedule(self, deadline):
+        """
+        Adds a deadline (timestamp) to the heap, waking the scheduler up if
+        it is now the earliest one
+        """
+        if deadline in self.scheduled or deadline >= self.reload_at:
+            return
+        heapq.heappush(self.heap, deadline)
+        self.scheduled.add(deadline)
+        if self.heap[0] == deadline:
+            self.wakeup.set()
+
+    async def load(self):
+        self.reload_at = time.time() + self.horizon
+        deadlines = await database_sync_to_async(upcoming_deadlines)(self.reload_at)
+        # A sorted list is a valid heap
+        self.heap = sorted(deadlines)
+        self.scheduled = set(self.heap)
+        logger.info(f'Expiry scheduler loaded {len(self.heap)} deadlines')
+
+    async def expire(self):
+        now = time.time()
+        while self.heap and self.heap[0] + EXPIRY_MARGIN <= now:
+            self.scheduled.discard(heapq.heappop(self.heap))
+        result = await database_sync_to_async(update_todo_statuses)()
+        if result['status'] != 'success':
+            logger.error(result['message'])
+
+    async def run(self):
+        """
+        Main loop, catching up on the deadlines missed while not running first
+        """
+        await self.load()
+        await self.expire()
+        while True:
+            now = time.time()
+            if now >= self.reload_at:
+                await self.load()
+                continue
+            if self.heap and self.heap[0] + EXPIRY_MARGIN <= now:
+                await self.expire()
+                continue
+            next_at = min(self.heap[0] + EXPIRY_MARGIN, self.reload_at) if self.heap else self.reload_at
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=next_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def listen(self):
+        """
+        Receives the deadlines sent by notify_deadlines
+        """
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(EXPIRY_GROUP, channel)
+        try:
+            while True:
+                message = await channel_layer.receive(channel)
+                for deadline in message.get('deadlines', []):
+                    self.schedule(deadline)
+        finally:
+            await channel_layer.group_discard(EXPIRY_GROUP, channel)
+
+    async def supervise(self, loop):
+        """
+        Runs a scheduler loop forever, restarting it with exponential backoff
+        whenever it fails, so a database or channel layer outage only delays
+        expiries
+        """
+        retry_delay = 0
+        while True:
+            started = time.monotonic()
+            try:
+                await loop()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if time.monotonic() - started > MAX_RETRY_DELAY:
+                    retry_delay = 0
+                retry_delay = min(max(retry_delay * 2, MIN_RETRY_DELAY), MAX_RETRY_DELAY)
+                logger.exception(f'Expiry scheduler {loop.__name__} failed, restarting in {retry_delay:.1f}s')
+                await asyncio.sleep(retry_delay)
+                # Deadlines sent while the listener was down are missed,
+                # reload them from the database
+                self.reload_at = 0
+                self.wakeup.set()
+
+    async def serve(self):
+        await asyncio.gather(self.supervise(self.run), self.supervise(self.listen))
+
+class ExpirySchedulerLifespan:
+    """
+    ASGI lifespan app running the scheduler inside the server process when
+    TODO_EXPIRY_SCHEDULER is 'lifespan' (servers without lifespan support,
+    like daphne, need `manage.py run_expiry_scheduler` instead)
+    """
+    # The running scheduler task, referenced so it is not garbage collected
+    task = None
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if settings.TODO_EXPIRY_SCHEDULER == 'lifespan':
+                    self.task = asyncio.ensure_future(ExpiryScheduler().serve())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.task is not None:
+                    self.task.cancel()
+                    self.task = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
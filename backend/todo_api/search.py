@@ -0,0 +1,153 @@
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.filters import BaseFilterBackend
+from .models import Todo
+from .tag_index import tagged_todo_ids
+import re
+
+# Text search configuration of the PostgreSQL search index. Must match
+# migration 0008_todo_search, otherwise the index is not used.
+SEARCH_CONFIG = 'english'
+# SQLite full-text index kept in sync with todo_api_todo by triggers
+# (see migration 0008_todo_search)
+FTS_TABLE = 'todo_api_todo_fts'
+
+TAG_MATCHES = ('any', 'all')
+MAX_TAGS = 20
+PRIORITIES = [value for value, _ in Todo.PRIORITY_CHOICES]
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def _parse_deadline(name, value):
+    deadline = parse_datetime(value)
+    if deadline is None:
+        raise ValueError(f'Invalid {name} "{value}": expected an ISO 8601 datetime')
+    if timezone.is_naive(deadline):
+        deadline = timezone.make_aware(deadline)
+    return deadline
+
+def parse_search_params(query_params):
+    """
+    Parses the search query parameters of the todo listings:
+    q, tags (comma separated), tags_match (any or all), priority (comma
+    separated), deadline_after and deadline_before (ISO 8601)
+
+    Returns:
+        Keyword arguments for search_todos, empty when no filter is set
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    params = {}
+    q = query_params.get('q', '').strip()
+    if q:
+        params['q'] = q
+    tags = _split(query_params.get('tags', ''))
+    if len(tags) > MAX_TAGS:
+        raise ValueError(f'At most {MAX_TAGS} tags can be searched at once')
+    tags_match = query_params.get('tags_match') or 'any'
+    if tags_match not in TAG_MATCHES:
+        raise ValueError(f'Invalid tags_match "{tags_match}": expected one of {", ".join(TAG_MATCHES)}')
+    if tags:
+        params['tags'] = tags
+        params['tags_match'] = tags_match
+    priorities = _split(query_params.get('priority', ''))
+    for priority in priorities:
+        if priority not in PRIORITIES:
+            raise ValueError(f'Invalid priority "{priority}": expected one of {", ".join(PRIORITIES)}')
+    if priorities:
+        params['priority'] = priorities
+    for name in ('deadline_after', 'deadline_before'):
+        value = query_params.get(name)
+        if value:
+            params[name] = _parse_deadline(name, value)
+    return params
+
+def fts_query(q):
+    """
+    Turns free text into an FTS5 query matching rows that contain every
+    word in the title or description. Words are quoted so FTS5 operators in
+    user input are searched literally.
+
+    Returns:
+        The MATCH expression, None if `q` has no word to search for
+    """
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    phrases = ' '.join(f'"{word}"' for word in words)
+    return f'{{title description}}: ({phrases})'
+
+def _text_filter(queryset, q):
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+        return queryset.annotate(
+            search=SearchVector('title', 'description', config=SEARCH_CONFIG)
+        ).filter(search=SearchQuery(q, config=SEARCH_CONFIG, search_type='websearch'))
+    if connection.vendor == 'sqlite':
+        match = fts_query(q)
+        if match is None:
+            # Nothing searchable, like PostgreSQL's empty tsquery
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT todo_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]
+        ))
+    condition = Q()
+    for word in q.split():
+        condition &= Q(title__icontains=word) | Q(description__icontains=word)
+    return queryset.filter(condition)
+
+def _tags_filter(queryset, tags, tags_match):
+    if connection.vendor == 'postgresql':
+        # tags @> '["tag"]', served by the todo_tags_idx GIN index
+        if tags_match == 'all':
+            return queryset.filter(tags__contains=tags)
+        condition = Q()
+        for tag in tags:
+            condition |= Q(tags__contains=[tag])
+        return queryset.filter(condition)
+    return queryset.filter(id__in=tagged_todo_ids(tags, tags_match))
+
+def search_todos(queryset, q=None, tags=None, tags_match='any', priority=None,
+                 deadline_after=None, deadline_before=None):
+    """
+    Applies the search filters to a todo queryset, keeping its ordering
+
+    Args:
+        queryset: Todos to search
+        q: Free text matched against the title and description
+        tags: Tags to match, any or all of them depending on `tags_match`
+        priority: Priorities to keep
+        deadline_after: Keep todos due at or after this datetime
+        deadline_before: Keep todos due before this datetime
+
+    Returns:
+        Filtered queryset
+    """
+    if priority:
+        queryset = queryset.filter(priority__in=priority)
+    if deadline_after is not None:
+        queryset = queryset.filter(deadline__gte=deadline_after)
+    if deadline_before is not None:
+        queryset = queryset.filter(deadline__lt=deadline_before)
+    if tags:
+        queryset = _tags_filter(queryset, tags, tags_match)
+    if q:
+        queryset = _text_filter(queryset, q)
+    return queryset
+
+class TodoSearchFilter(BaseFilterBackend):
+    """
+    Filters todo listings with the parameters of parse_search_params
+    """
+    def filter_queryset(self, request, queryset, view):
+        try:
+            params = parse_search_params(request.query_params)
+        except ValueError as e:
+            raise ParseError(str(e))
+        return search_todos(queryset, **params)
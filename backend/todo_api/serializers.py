@@ -1,8 +1,124 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Todo
+from .models import Todo, TodoTag
+import uuid
+
+class TodoListSerializer(serializers.ListSerializer):
+    """
+    many=True serializer of the bulk endpoints: validates every item, then
+    writes them all with a single bulk_create/bulk_update
+
+    For updates, `instance` maps str(id) -> Todo and every item of the data
+    must carry the id of the todo it changes, in any form parse_todo_ids
+    accepts.
+    """
+    @staticmethod
+    def instance_key(item):
+        """
+        Returns the `instance` key of an item's id, None if it has no valid id
+        """
+        try:
+            return str(uuid.UUID(str(item['id'])))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            todo = self.instance.get(self.instance_key(data)) if isinstance(data, dict) else None
+            if todo is None:
+                raise serializers.ValidationError({'id': ['Unknown or missing todo id.']})
+            self.child.instance = todo
+            self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        todos = [Todo(**attrs) for attrs in validated_data]
+        return Todo.objects.bulk_create(todos, batch_size=settings.TODO_BULK_BATCH_SIZE)
+
+    def update(self, instance, validated_data):
+        # bulk_update() skips auto_now, so updatedAt is set here
+        now = timezone.now()
+        todos = []
+        fields = {'updatedAt'}
+        for item, attrs in zip(self.initial_data, validated_data):
+            todo = instance[self.instance_key(item)]
+            for attr, value in attrs.items():
+                setattr(todo, attr, value)
+            todo.updatedAt = now
+            fields.update(attrs)
+            todos.append(todo)
+        Todo.objects.bulk_update(todos, sorted(fields), batch_size=settings.TODO_BULK_BATCH_SIZE)
+        return todos
 
 class TodoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Todo
         fields = ['id', 'title', 'description', 'deadline', 'status', 'priority', 'tags', 'createdAt', 'updatedAt']
-        read_only_fields = ['id', 'createdAt', 'updatedAt'] 
\ No newline at end of file
+        read_only_fields = ['id', 'createdAt', 'updatedAt']
+        list_serializer_class = TodoListSerializer
+
+    def validate_tags(self, value):
+        """
+        Tags are indexed (see tag_index.py), so they must be short strings
+        """
+        if not isinstance(value, list):
+            raise serializers.ValidationError('Expected a list of tags.')
+        for tag in value:
+            if not isinstance(tag, str) or not tag:
+                raise serializers.ValidationError('Tags must be non-empty strings.')
+            if len(tag) > TodoTag.MAX_LENGTH:
+                raise serializers.ValidationError(f'Tags can be at most {TodoTag.MAX_LENGTH} characters long.')
+        return value
+
+# Read-only fast path: builds the exact TodoSerializer representation from
+# .values() rows, without instantiating models or serializer fields
+TODO_FIELDS = TodoSerializer.Meta.fields
+
+def _datetime_converter():
+    """
+    Returns a function with the same output as DRF's DateTimeField (default
+    ISO 8601 format), bound to the current timezone once per batch
+    """
+    current_timezone = timezone.get_current_timezone()
+
+    def convert(value):
+        if not value:
+            return None
+        value = value.astimezone(current_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+def todo_values(queryset):
+    """
+    Restricts a todo queryset to the serialized fields, yielding dict rows
+    """
+    return queryset.values(*TODO_FIELDS)
+
+def serialize_todo_row(row, convert_datetime=None):
+    """
+    Converts a todo_values() row in place to the TodoSerializer representation
+    """
+    convert_datetime = convert_datetime or _datetime_converter()
+    row['id'] = str(row['id'])
+    row['deadline'] = convert_datetime(row['deadline'])
+    row['createdAt'] = convert_datetime(row['createdAt'])
+    row['updatedAt'] = convert_datetime(row['updatedAt'])
+    return row
+
+def serialize_todo_rows(rows):
+    """
+    Serializes an iterable of todo_values() rows
+    """
+    convert_datetime = _datetime_converter()
+    return [serialize_todo_row(row, convert_datetime) for row in rows]
+
+def iter_serialized_todos(queryset, chunk_size):
+    """
+    Yields serialized todos, reading `chunk_size` rows from the database at a time
+    """
+    convert_datetime = _datetime_converter()
+    for row in todo_values(queryset).iterator(chunk_size=chunk_size):
+        yield serialize_todo_row(row, convert_datetime)
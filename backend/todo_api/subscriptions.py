@@ -0,0 +1,120 @@
+from .events import todo_delete_event
+from .models import Todo
+from .search import MAX_TAGS, PRIORITIES, search_todos
+
+STATUSES = [value for value, _ in Todo.STATUS_CHOICES]
+
+def _parse_list(name, value, choices=None):
+    """
+    Accepts a list or a comma separated string
+
+    Raises:
+        ValueError: If the value is malformed or holds an unknown choice
+    """
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f'Invalid {name}: expected a list of strings')
+    for item in value:
+        if choices is not None and item not in choices:
+            raise ValueError(f'Invalid {name} "{item}": expected one of {", ".join(choices)}')
+    return value or None
+
+class Subscription:
+    """
+    Filter of the todos a WebSocket client displays: any of `statuses`,
+    any of `priorities` and at least one of `tags`. None matches everything.
+    """
+    def __init__(self, statuses=None, priorities=None, tags=None):
+        self.statuses = set(statuses) if statuses else None
+        self.priorities = set(priorities) if priorities else None
+        self.tags = set(tags) if tags else None
+
+    @classmethod
+    def parse(cls, params):
+        """
+        Builds a subscription from the connect query parameters or the
+        filter of a subscribe message ({"status", "priority", "tags"})
+
+        Raises:
+            ValueError: If a filter value is malformed
+        """
+        tags = _parse_list('tags', params.get('tags'))
+        if tags and len(tags) > MAX_TAGS:
+            raise ValueError(f'At most {MAX_TAGS} tags can be subscribed to')
+        return cls(
+            statuses=_parse_list('status', params.get('status'), STATUSES),
+            priorities=_parse_list('priority', params.get('priority'), PRIORITIES),
+            tags=tags
+        )
+
+    @property
+    def is_filtered(self):
+        return bool(self.statuses or self.priorities or self.tags)
+
+    def matches(self, todo):
+        """
+        Whether a serialized todo passes the filter
+        """
+        if self.statuses and todo['status'] not in self.statuses:
+            return False
+        if self.priorities and todo['priority'] not in self.priorities:
+            return False
+        if self.tags and (not isinstance(todo['tags'], list) or self.tags.isdisjoint(todo['tags'])):
+            return False
+        return True
+
+    def filter_queryset(self, queryset):
+        if self.statuses:
+            queryset = queryset.filter(status__in=self.statuses)
+        return search_todos(
+            queryset,
+            tags=sorted(self.tags) if self.tags else None,
+            priority=sorted(self.priorities) if self.priorities else None
+        )
+
+class FilteredStream:
+    """
+    Routes the events of the todos group for one filtered client
+
+    The ids of the todos the client was sent are tracked, so an update that
+    takes a todo out of the filter is forwarded as a todo_delete, and events
+    of todos the client never saw are dropped before being serialized. After
+    a delta resume the ids the client holds are unknown, removals and
+    deletes are then always forwarded.
+    """
+    def __init__(self, subscription, visible=None):
+        self.subscription = subscription
+        self.visible = visible
+
+    def show(self, todos):
+        """
+        Records todos sent to the client outside of events (snapshot chunks)
+        """
+        if self.visible is not None:
+            self.visible.update(todo['id'] for todo in todos)
+
+    def route(self, event):
+        """
+        Returns the event to send to the client, or None to drop it
+        """
+        if event['type'] == 'todo_delete':
+            return event if self._hide(event['todo_id']) else None
+        todo = event['todo']
+        if self.subscription.matches(todo):
+            if self.visible is not None:
+                self.visible.add(todo['id'])
+            return event
+        if event['type'] != 'todo_create' and self._hide(todo['id']):
+            return todo_delete_event(todo['id'], event.get('seq'))
+        return None
+
+    def _hide(self, todo_id):
+        if self.visible is None:
+            return True
+        if todo_id in self.visible:
+            self.visible.discard(todo_id)
+            return True
+        return False
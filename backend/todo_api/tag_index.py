@@ -0,0 +1,115 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from .models import Todo, TodoTag, TodoTagRollup
+
+def index_tags(tags):
+    """
+    Returns the distinct tags of a Todo.tags value that are indexed. Values
+    written before tags were validated may hold anything.
+    """
+    if not isinstance(tags, list):
+        return set()
+    return {
+        tag for tag in tags
+        if isinstance(tag, str) and 0 < len(tag) <= TodoTag.MAX_LENGTH
+    }
+
+def index_todos(todos):
+    """
+    Indexes the tags of newly created todos
+    """
+    TodoTag.objects.bulk_create(
+        [
+            TodoTag(todo_id=todo.pk, tag=tag, status=todo.status)
+            for todo in todos for tag in index_tags(todo.tags)
+        ],
+        batch_size=settings.TODO_BULK_BATCH_SIZE
+    )
+
+def reindex_todos(todos):
+    """
+    Brings the index entries of updated todos in line with their tags and
+    status, touching only the entries that changed
+    """
+    todos = {todo.pk: todo for todo in todos}
+    if not todos:
+        return
+    wanted = {(todo.pk, tag) for todo in todos.values() for tag in index_tags(todo.tags)}
+    stale = []
+    moved = defaultdict(list)
+    existing = set()
+    for pk, todo_id, tag, status in TodoTag.objects.filter(
+        todo_id__in=list(todos)
+    ).values_list('pk', 'todo_id', 'tag', 'status'):
+        existing.add((todo_id, tag))
+        if (todo_id, tag) not in wanted:
+            stale.append(pk)
+        elif status != todos[todo_id].status:
+            moved[todos[todo_id].status].append(pk)
+    if stale:
+        TodoTag.objects.filter(pk__in=stale).delete()
+    for status, pks in moved.items():
+        TodoTag.objects.filter(pk__in=pks).update(status=status)
+    TodoTag.objects.bulk_create(
+        [
+            TodoTag(todo_id=todo_id, tag=tag, status=todos[todo_id].status)
+            for todo_id, tag in wanted - existing
+        ],
+        batch_size=settings.TODO_BULK_BATCH_SIZE
+    )
+
+def record_status_change(todo_ids, new_status):
+    """
+    Copies a status change made with a queryset update() to the index
+    """
+    TodoTag.objects.filter(todo_id__in=todo_ids).update(status=new_status)
+
+def tagged_todo_ids(tags, match='any'):
+    """
+    Returns a subquery of the ids of the todos carrying any or all of `tags`
+    """
+    entries = TodoTag.objects.filter(tag__in=tags)
+    if match == 'all':
+        # (tag, todo) is unique, so a todo has every tag iff it matches len(tags) times
+        entries = entries.values('todo_id').annotate(
+            matched=Count('id')
+        ).filter(matched=len(set(tags)))
+    return entries.values('todo_id')
+
+def tag_stats(limit, rollup=False):
+    """
+    Counts the todos of every tag per status, most used tags first
+
+    The aggregate is an index-only scan of todo_tag_status_idx, it neither
+    joins the todos nor decodes any JSON. With `rollup` it sums the per-day
+    tag buckets of TodoTagRollup (see rollups.py) instead.
+
+    Args:
+        limit: Maximum number of tags returned
+        rollup: Read the tag rollup table instead of the index
+
+    Returns:
+        List of per-tag dicts with total, per-status counts and completion rate
+    """
+    statuses = [value for value, _ in Todo.STATUS_CHOICES]
+    if rollup:
+        queryset = TodoTagRollup.objects.all()
+        measure = lambda condition=None: Coalesce(Sum('count', filter=condition), 0)
+    else:
+        queryset = TodoTag.objects.all()
+        measure = lambda condition=None: Count('id', filter=condition)
+    rows = queryset.values('tag').annotate(
+        total=measure(),
+        **{status: measure(Q(status=status)) for status in statuses}
+    ).filter(total__gt=0).order_by('-total', 'tag')[:limit]
+    return [
+        {
+            'tag': row['tag'],
+            'total': row['total'],
+            'status_counts': {status: row[status] for status in statuses},
+            'completion_rate': round(row['success'] / row['total'] * 100, 2)
+        }
+        for row in rows
+    ]
@@ -1 +1,1220 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from django.db import connection, transaction
+from django.db.models import Count
+from rest_framework.test import APIRequestFactory, APITestCase
+from .cron import expire_todos, update_todo_statuses
+from .middleware import UpdateExpiredTodosMiddleware
+from .scheduler import ExpiryScheduler, notify_deadlines
+from .consumers import TodoConsumer
+from .events import MSGPACK_SUBPROTOCOL, CoalescingBroadcaster, broadcast, broadcast_stats, client_message, encode_frames, todo_batch_event, todo_create_event, todo_update_event, todo_delete_event
+from .models import Todo, TodoChange, TodoTag
+from .outbound import RESYNC_CLOSE_CODE, queue_stats
+from .response_cache import get_cache
+from .serializers import TodoSerializer, todo_values, serialize_todo_rows
+from .subscriptions import FilteredStream, Subscription
+from .benchmarks import seed_todos
+from .utils import QueryBudgetExceeded, count_queries, query_budget
+from . import analytics, changes, conditional, export, metrics, outbox, rollups, scheduler, tag_index, writes
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from unittest import mock, skipUnless
+import asyncio
+import datetime
+import gzip
+import json
+import re
+import threading
+import time
+import uuid
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+
+# Inline sweeps: a middleware sweep thread would use a second connection to
+# the test database. Views over their query budget fail the test.
+@override_settings(TODO_EXPIRY_SWEEP_IN_BACKGROUND=False, TODO_QUERY_BUDGETS=True)
+class TodoAPITestCase(APITestCase):
+    pass
+
+
+def make_todos(count, **overrides):
+    """
+    Bulk creates `count` todos, spreading createdAt over the last 120 days
+    and cycling through the statuses
+    """
+    now = timezone.now()
+    statuses = ['ongoing', 'success', 'failure']
+    todos = Todo.objects.bulk_create([
+        Todo(
+            title=f'Todo {i}',
+            deadline=now + datetime.timedelta(days=1),
+            status=statuses[i % 3],
+            **overrides
+        )
+        for i in range(count)
+    ])
+    for i, todo in enumerate(todos):
+        Todo.objects.filter(pk=todo.pk).update(
+            createdAt=now - datetime.timedelta(hours=i * 29 % (120 * 24))
+        )
+    # Rows written behind the API's back must not be masked by cached responses
+    get_cache().clear()
+    return todos
+
+
+def legacy_completion_stats(now):
+    """
+    Reference implementation of the original per-week COUNT loop
+    """
+    status_counts = Todo.objects.values('status').annotate(count=Count('status'))
+    start_date = now - datetime.timedelta(days=90)
+    weekly_data = []
+    current = start_date
+    while current <= now:
+        week_end = current + datetime.timedelta(days=7)
+        week_todos = Todo.objects.filter(createdAt__gte=current, createdAt__lt=week_end)
+        total = week_todos.count()
+        success = week_todos.filter(status='success').count()
+        if total > 0:
+            completion_rate = (success / total) * 100
+        else:
+            completion_rate = 0
+        weekly_data.append({
+            'week_start': current.strftime('%Y-%m-%d'),
+            'week_end': week_end.strftime('%Y-%m-%d'),
+            'total_tasks': total,
+            'completed_tasks': success,
+            'completion_rate': round(completion_rate, 2)
+        })
+        current = week_end
+    return {
+        'status_distribution': status_counts,
+        'weekly_completion': weekly_data
+    }
+
+
+class CompletionStatsTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(200)
+        rollups.rebuild_rollups()
+
+    def test_default_output_matches_legacy_loop(self):
+        now = timezone.now()
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(analytics.completion_stats(now=now)),
+            renderer.render(legacy_completion_stats(now))
+        )
+
+    def test_query_count_is_constant(self):
+        # The middleware expiry sweep would add its own queries
+        with mock.patch.object(UpdateExpiredTodosMiddleware, 'sweep_due', return_value=False):
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/analytics/completion-stats/', {'window': 365, 'bucket': 'day'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']['daily_completion']), 366)
+
+    def test_month_buckets_cover_window(self):
+        response = self.client.get('/api/analytics/completion-stats/', {'window': 120, 'bucket': 'month'})
+        buckets = response.data['data']['monthly_completion']
+        self.assertEqual(sum(b['total_tasks'] for b in buckets), Todo.objects.count())
+
+    def test_buckets_match_per_bucket_counts(self):
+        now = timezone.now()
+        bounds = analytics.bucket_bounds(now - datetime.timedelta(days=120), now, 'month')
+        # Created exactly when a bucket starts
+        Todo.objects.filter(pk__in=Todo.objects.values('pk')[:3]).update(createdAt=bounds[2][0])
+        for bucket in analytics.BUCKETS:
+            prefix = analytics.BUCKETS[bucket][1]
+            expected = [
+                (
+                    Todo.objects.filter(createdAt__gte=bucket_start, createdAt__lt=bucket_end).count(),
+                    Todo.objects.filter(createdAt__gte=bucket_start, createdAt__lt=bucket_end, status='success').count(),
+                    bucket_start.strftime('%Y-%m-%d')
+                )
+                for bucket_start, bucket_end in analytics.bucket_bounds(now - datetime.timedelta(days=120), now, bucket)
+            ]
+            buckets = analytics.completion_buckets(120, bucket, now)
+            self.assertEqual(
+                [(b['total_tasks'], b['completed_tasks'], b[f'{prefix}_start']) for b in buckets], expected, bucket
+            )
+
+        # Every allowed window works, whatever the bucket
+        response = self.client.get('/api/analytics/completion-stats/', {'window': analytics.MAX_WINDOW_DAYS, 'bucket': 'day'})
+        self.assertEqual(len(response.data['data']['daily_completion']), analytics.MAX_WINDOW_DAYS + 1)
+
+    def test_invalid_parameters(self):
+        response = self.client.get('/api/analytics/completion-stats/', {'bucket': 'year'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/analytics/completion-stats/', {'window': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductivityPatternsTests(TodoAPITestCase):
+    # Completion times (hours) of the completed todos, the last one
+    # completed most recently
+    HOURS = [0.5, 2, 3, 5, 20, 30, 100, 200, 300, 400]
+
+    def setUp(self):
+        now = timezone.now()
+        Todo.objects.create(title='Open', deadline=now + datetime.timedelta(days=1))
+        for i, hours in enumerate(self.HOURS):
+            completed = now - datetime.timedelta(minutes=len(self.HOURS) - i)
+            todo = Todo.objects.create(title=f'Done {i}', deadline=now, status='success')
+            Todo.objects.filter(pk=todo.pk).update(
+                createdAt=completed - datetime.timedelta(hours=hours), updatedAt=completed
+            )
+        get_cache().clear()
+
+    def test_percentiles_and_histogram(self):
+        response = self.client.get('/api/analytics/productivity-patterns/')
+        data = response.data['data']
+        self.assertEqual(data['completion_time_count'], 10)
+        self.assertEqual(data['avg_completion_time_hours'], 106.05)
+        # Nearest rank: p50 is the 5th of 10, p90 the 9th, p99 the 10th
+        self.assertEqual(data['completion_time_percentiles'], {'p50': 20.0, 'p90': 300.0, 'p99': 400.0})
+        self.assertEqual(
+            [(b['min_hours'], b['max_hours'], b['count']) for b in data['completion_time_histogram']],
+            [(0, 1, 1), (1, 4, 2), (4, 12, 1), (12, 24, 1), (24, 72, 1), (72, 168, 1), (168, None, 3)]
+        )
+
+    def test_completion_limit(self):
+        response = self.client.get('/api/analytics/productivity-patterns/', {'completion_limit': 3})
+        rows = response.data['data']['completion_time_data']
+        # Most recently completed first
+        self.assertEqual([row['completion_time_hours'] for row in rows], [400.0, 300.0, 200.0])
+        Todo.objects.bulk_create([
+            Todo(title=f'More {i}', deadline=timezone.now(), status='success')
+            for i in range(analytics.DEFAULT_COMPLETION_LIMIT)
+        ])
+        get_cache().clear()
+        response = self.client.get('/api/analytics/productivity-patterns/')
+        self.assertEqual(len(response.data['data']['completion_time_data']), analytics.DEFAULT_COMPLETION_LIMIT)
+        for limit in ('abc', -1, analytics.MAX_COMPLETION_LIMIT + 1):
+            response = self.client.get('/api/analytics/productivity-patterns/', {'completion_limit': limit})
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_completion_times_are_paginated(self):
+        url = '/api/analytics/productivity-patterns/completion-times/'
+        response = self.client.get(url, {'page_size': 4})
+        data = response.data['data']
+        self.assertEqual(data['count'], 10)
+        self.assertEqual([row['completion_time_hours'] for row in data['results']], [400.0, 300.0, 200.0, 100.0])
+        response = self.client.get(data['next'])
+        self.assertEqual(
+            [row['completion_time_hours'] for row in response.data['data']['results']], [30.0, 20.0, 5.0, 3.0]
+        )
+
+
+class RollupTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(30)
+        rollups.rebuild_rollups(batch_size=7)
+
+    def test_writes_keep_rollups_consistent(self):
+        deadline = timezone.now() + datetime.timedelta(days=1)
+        response = self.client.post('/api/todos/', {
+            'title': 'New', 'deadline': deadline.isoformat(), 'priority': 'high', 'tags': ['work', 'home']
+        }, format='json')
+        todo_id = response.data['data']['id']
+        self.client.patch(f'/api/todos/{todo_id}/', {'priority': 'low', 'tags': ['work']}, format='json')
+        self.client.patch(f'/api/todos/{todo_id}/mark_complete/')
+        self.client.post('/api/todos/', {
+            'title': 'Expiring', 'deadline': deadline.isoformat(), 'tags': ['home']
+        }, format='json')
+        Todo.objects.filter(status='ongoing').update(deadline=timezone.now() - datetime.timedelta(hours=1))
+        update_todo_statuses()
+        self.client.delete(f'/api/todos/{todo_id}/')
+        self.client.delete(f'/api/todos/{Todo.objects.first().pk}/')
+        self.assertEqual(rollups.check_rollups(), [])
+
+    def test_update_of_a_stale_instance_moves_the_current_buckets(self):
+        deadline = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        response = self.client.post('/api/todos/', {'title': 'New', 'deadline': deadline, 'tags': ['work']}, format='json')
+        stale = Todo.objects.get(pk=response.data['data']['id'])
+        # A concurrent request completes the todo after `stale` was read
+        self.client.patch(f'/api/todos/{stale.pk}/mark_complete/')
+        serializer = TodoSerializer(stale, data={'priority': 'high'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        writes.update_todo(serializer)
+        self.assertEqual(Todo.objects.get(pk=stale.pk).status, 'success')
+        self.assertEqual(rollups.check_rollups(), [])
+
+    def test_check_reports_drift(self):
+        Todo.objects.filter(status='ongoing').update(status='success')
+        self.assertNotEqual(rollups.check_rollups(), [])
+        rollups.rebuild_rollups()
+        self.assertEqual(rollups.check_rollups(), [])
+
+
+class QueryPlanTests(TestCase):
+    """
+    Asserts that the hot queries are served by an index. Fails as soon as
+    one of them falls back to a sequential scan (or an extra sort).
+    """
+    def setUp(self):
+        make_todos(50)
+        if connection.vendor == 'postgresql':
+            # Tiny test tables always favour a sequential scan otherwise
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+            self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?Sort\b')
+        elif connection.vendor == 'sqlite':
+            self.assertNotRegex(plan, r'SCAN todo_api_todo(?! USING)')
+            self.assertNotIn('TEMP B-TREE', plan)
+        return plan
+
+    def test_list(self):
+        self.assertUsesIndex(Todo.objects.all()[:100])
+
+    def test_status_actions(self):
+        for status in ('ongoing', 'success', 'failure'):
+            self.assertUsesIndex(Todo.objects.filter(status=status)[:100])
+
+    def test_expiry_sweep(self):
+        plan = self.assertUsesIndex(
+            Todo.objects.filter(status='ongoing', deadline__lt=timezone.now()).order_by()
+        )
+        self.assertIn('todo_ongoing_deadline_idx', plan)
+
+    def test_completion_buckets(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            Todo.objects.filter(createdAt__gte=now - datetime.timedelta(days=90), createdAt__lt=now).order_by()
+        )
+
+    def test_completion_times(self):
+        self.assertUsesIndex(analytics.completion_times_queryset()[:100])
+
+
+class KeysetPaginationTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(45)
+        # Force ties on createdAt so the id tie-breaker is exercised
+        Todo.objects.filter(status='success').update(createdAt=timezone.now())
+
+    def test_walks_every_row_once_despite_inserts(self):
+        expected = [str(pk) for pk in Todo.objects.order_by('-createdAt', '-id').values_list('id', flat=True)]
+        seen = []
+        url = '/api/todos/?pagination=cursor&page_size=10'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(todo['id'] for todo in response.data['results'])
+            url = response.data['next']
+            make_todos(1)
+        self.assertEqual(seen, expected)
+
+    def test_status_action_and_invalid_cursor(self):
+        response = self.client.get('/api/todos/failure/', {'pagination': 'cursor', 'page_size': 5})
+        self.assertEqual(len(response.data['data']['results']), 5)
+        self.assertIsNotNone(response.data['data']['next'])
+        for url in ('/api/todos/', '/api/todos/failure/', '/api/async/todos/'):
+            response = self.client.get(url, {'pagination': 'cursor', 'cursor': 'bogus'})
+            self.assertEqual(response.status_code, 400, url)
+
+
+class StatusActionTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(30)
+
+    def test_pages_and_streams(self):
+        expected = [
+            str(pk) for pk in Todo.objects.filter(status='ongoing').order_by('-createdAt').values_list('id', flat=True)
+        ]
+        response = self.client.get('/api/todos/ongoing/', {'page_size': 4})
+        page = response.data['data']
+        self.assertEqual(page['count'], 10)
+        self.assertEqual([todo['id'] for todo in page['results']], expected[:4])
+        self.assertIn('page=2', page['next'])
+
+        response = self.client.get('/api/todos/ongoing/', {'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(sorted(json.loads(line)['id'] for line in lines), sorted(expected))
+
+        response = self.client.get('/api/todos/ongoing/', {'stream': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(12)
+        self.expected = [
+            str(pk) for pk in Todo.objects.order_by('updatedAt', 'id').values_list('id', flat=True)
+        ]
+
+    def export(self, **params):
+        response = self.client.get('/api/todos/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_formats_and_resume(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], self.expected)
+
+        response, body = self.export(format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0].split(','), list(export.EXPORT_FIELDS))
+        self.assertEqual(len(lines), len(self.expected) + 1)
+
+        last = rows[4]
+        response, body = self.export(since=last['updatedAt'], after=last['id'])
+        resumed = [json.loads(line)['id'] for line in body.decode().splitlines()]
+        self.assertEqual(resumed, self.expected[5:])
+
+        response = self.client.get('/api/todos/export/', {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_gzip(self):
+        response = self.client.get('/api/todos/export/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], self.expected)
+
+    @override_settings(TODO_NO_PAGE_MAX_RESULTS=5)
+    def test_no_page_is_capped(self):
+        response = self.client.get('/api/todos/', {'no_page': 'true'})
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(response['X-Results-Truncated'], '5')
+        self.assertEqual(response['Link'], '<http://testserver/api/todos/export/>; rel="export"')
+        with override_settings(TODO_NO_PAGE_MAX_RESULTS=12):
+            get_cache().clear()
+            response = self.client.get('/api/todos/', {'no_page': 'true'})
+        self.assertEqual(len(response.data), 12)
+        self.assertNotIn('X-Results-Truncated', response)
+
+
+class ResponseCacheTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(5)
+
+    def stats(self):
+        return self.client.get('/api/cache/stats/').data['data']
+
+    def test_writes_invalidate_cached_responses(self):
+        first = self.client.get('/api/todos/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.client.get('/api/todos/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+
+        todo_id = first.data['results'][0]['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/todos/{todo_id}/', {'title': 'Renamed'}, format='json')
+        self.assertNotEqual(self.stats()['generation'], stats['generation'])
+        third = self.client.get('/api/todos/')
+        self.assertEqual(third['X-Cache'], 'MISS')
+        self.assertEqual(third.data['results'][0]['title'], 'Renamed')
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+
+class ConditionalRequestTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(5)
+        self.todo = Todo.objects.first()
+
+    def test_etags(self):
+        urls = ['/api/todos/', f'/api/todos/{self.todo.pk}/', '/api/analytics/completion-stats/']
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            etags[url] = response['ETag']
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response['ETag'], etags[url])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/todos/{self.todo.pk}/', {'title': 'Renamed'}, format='json')
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etags[url])
+
+    def test_last_modified(self):
+        url = f'/api/todos/{self.todo.pk}/'
+        Todo.objects.filter(pk=self.todo.pk).update(updatedAt=timezone.now() - datetime.timedelta(minutes=5))
+        response = self.client.get(url)
+        last_modified = response['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # A write in the second that is not over yet gets no Last-Modified,
+        # a second write in that second would share it
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'title': 'Renamed'}, format='json')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertNotIn('Last-Modified', self.client.get('/api/todos/'))
+
+        now = time.time()
+        modified = datetime.datetime.fromtimestamp(now, tz=datetime.timezone.utc)
+        self.assertIsNone(conditional.http_last_modified(modified, now))
+        self.assertEqual(conditional.http_last_modified(modified, now + 1), int(now))
+
+
+class FastSerializerTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(20)
+        Todo.objects.create(
+            title='Ünïcode ✓', description='', tags=['a', 'b c', 'ü'],
+            deadline=(timezone.now() + datetime.timedelta(days=2)).replace(microsecond=0), priority='high'
+        )
+
+    def test_matches_model_serializer(self):
+        queryset = Todo.objects.all()
+        expected = TodoSerializer(queryset, many=True).data
+        actual = serialize_todo_rows(todo_values(queryset))
+        renderer = JSONRenderer()
+        self.assertEqual(actual, expected)
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+    def test_endpoints_match_model_serializer(self):
+        todo = Todo.objects.get(title='Ünïcode ✓')
+        response = self.client.get(f'/api/todos/{todo.pk}/')
+        self.assertEqual(response.data, TodoSerializer(todo).data)
+        response = self.client.get('/api/todos/ongoing/')
+        expected = TodoSerializer(Todo.objects.filter(status='ongoing'), many=True).data
+        self.assertEqual(response.data['data']['results'], expected)
+
+
+class BulkEndpointTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(5)
+        rollups.rebuild_rollups()
+
+    def test_bulk_writes_are_relayed_as_one_batch(self):
+        deadline = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        response = self.client.post('/api/todos/bulk/', [
+            {'title': f'Bulk {i}', 'deadline': deadline, 'tags': ['import']} for i in range(3)
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        created = [todo['id'] for todo in response.data['data']]
+        self.assertEqual(Todo.objects.filter(pk__in=created).count(), 3)
+
+        # Ids are matched whatever their form
+        response = self.client.patch('/api/todos/bulk/', [
+            {'id': created[0].upper(), 'priority': 'high'},
+            {'id': created[1], 'status': 'success'}
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Todo.objects.get(pk=created[0]).priority, 'high')
+        self.assertEqual(Todo.objects.get(pk=created[1]).status, 'success')
+
+        response = self.client.delete('/api/todos/bulk/', {'ids': created[1:]}, format='json')
+        self.assertEqual(response.data['data']['deleted'], created[1:])
+
+        with mock.patch('todo_api.events.broadcast') as broadcast:
+            self.assertEqual(outbox.relay_pending(), 7)
+        broadcast.assert_called_once()
+        self.assertEqual(
+            [event['type'] for event in broadcast.call_args.args[0]['events']],
+            ['todo_create'] * 3 + ['todo_update'] * 2 + ['todo_delete'] * 2
+        )
+        self.assertEqual(rollups.check_rollups(), [])
+
+    def test_invalid_items_write_nothing(self):
+        response = self.client.post('/api/todos/bulk/', [
+            {'title': 'Valid', 'deadline': timezone.now().isoformat()},
+            {'title': 'Missing deadline'}
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('deadline', response.data['data'][1])
+        response = self.client.patch('/api/todos/bulk/', [{'id': str(Todo.objects.first().pk), 'status': 'bogus'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Todo.objects.count(), 5)
+        self.assertEqual(changes.latest_seq(), 0)
+
+
+class ChangeSyncTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(5)
+
+    def test_delta_sends_latest_state_once(self):
+        since = changes.latest_seq()
+        deadline = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        response = self.client.post('/api/todos/', {'title': 'New', 'deadline': deadline}, format='json')
+        created = response.data['data']['id']
+        self.client.patch(f'/api/todos/{created}/', {'priority': 'high'}, format='json')
+        deleted = str(Todo.objects.exclude(pk=created).first().pk)
+        self.client.delete(f'/api/todos/{deleted}/')
+
+        seq, events = changes.changes_since(since)
+        self.assertEqual(seq, changes.latest_seq())
+        self.assertEqual([event['type'] for event in events], ['todo_create', 'todo_delete'])
+        self.assertEqual(events[0]['todo']['priority'], 'high')
+        self.assertEqual(events[1]['todo_id'], deleted)
+        self.assertEqual(changes.changes_since(seq), (seq, []))
+
+    def test_snapshot_needed_when_gap_is_too_large_or_pruned(self):
+        todo = Todo.objects.first()
+        changes.record_changes('update', [todo.pk] * 5, [None] * 5)
+        self.assertIsNone(changes.changes_since(0, limit=3))
+        changes.prune_changes(keep=2)
+        # Changes still waiting for the outbox relay are kept
+        self.assertEqual(TodoChange.objects.count(), 5)
+        with mock.patch('todo_api.events.broadcast'):
+            outbox.relay_pending()
+        changes.prune_changes(keep=2)
+        self.assertIsNone(changes.changes_since(1))
+        self.assertIsNotNone(changes.changes_since(changes.latest_seq() - 2))
+
+        todos, cursor = changes.snapshot_page(page_size=2)
+        seen = [todo['id'] for todo in todos]
+        while cursor:
+            todos, cursor = changes.snapshot_page(cursor, page_size=2)
+            seen.extend(todo['id'] for todo in todos)
+        self.assertEqual(seen, [str(pk) for pk in Todo.objects.order_by('-createdAt', '-id').values_list('id', flat=True)])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite runs one write transaction at a time')
+@override_settings(TODO_OUTBOX_RELAY='command')
+class ChangeSequenceTests(TransactionTestCase):
+    def record_change(self, seqs, name, recorded=None, release=None):
+        try:
+            with transaction.atomic():
+                seqs[name] = changes.record_change('delete', uuid.uuid4(), None)
+                if recorded is not None:
+                    recorded.set()
+                    release.wait(5)
+        finally:
+            connection.close()
+
+    def test_seqs_follow_the_commit_order(self):
+        seqs = {}
+        recorded, release = threading.Event(), threading.Event()
+        first = threading.Thread(target=self.record_change, args=(seqs, 'first', recorded, release))
+        second = threading.Thread(target=self.record_change, args=(seqs, 'second'))
+        first.start()
+        recorded.wait(5)
+        second.start()
+        # The second transaction cannot take a seq, let alone commit it,
+        # while the first one holds an uncommitted lower seq
+        second.join(0.5)
+        self.assertTrue(second.is_alive())
+        self.assertEqual(changes.changes_since(0), (0, []))
+        release.set()
+        first.join()
+        second.join()
+        self.assertLess(seqs['first'], seqs['second'])
+        seq, events = changes.changes_since(0)
+        self.assertEqual([event['seq'] for event in events], [seqs['first'], seqs['second']])
+
+
+class CoalescingBroadcasterTests(TestCase):
+    def setUp(self):
+        broadcast_stats.reset()
+
+    @mock.patch('todo_api.events.broadcast')
+    def test_flushes_on_size_window_and_close(self, broadcast):
+        with CoalescingBroadcaster(window=0.01, max_size=3) as broadcaster:
+            for i in range(4):
+                broadcaster.add(todo_delete_event(i))
+            self.assertEqual(len(broadcast.call_args.args[0]['events']), 3)
+            time.sleep(0.1)
+            self.assertEqual(broadcast.call_args.args[0]['todo_id'], '3')
+            broadcaster.add(todo_delete_event(4))
+            broadcaster.add(todo_delete_event(5))
+        self.assertEqual(broadcast.call_count, 3)
+        stats = broadcast_stats.as_dict()
+        self.assertEqual((stats['batches'], stats['events'], stats['max_batch_size']), (3, 6, 3))
+
+    @mock.patch('todo_api.events.broadcast')
+    def test_sweep_is_relayed_as_one_batch(self, broadcast):
+        make_todos(6)
+        Todo.objects.filter(status='ongoing').update(deadline=timezone.now() - datetime.timedelta(hours=1))
+        Todo.objects.filter(status='success').update(status='ongoing', deadline=timezone.now() - datetime.timedelta(hours=1))
+        update_todo_statuses()
+        broadcast.assert_not_called()
+        outbox.relay_pending()
+        broadcast.assert_called_once()
+        event = broadcast.call_args.args[0]
+        self.assertEqual(event['type'], 'todo_batch')
+        self.assertEqual(len(event['events']), 4)
+
+
+class ExpirySweepTests(TestCase):
+    def setUp(self):
+        make_todos(12)
+        rollups.rebuild_rollups()
+        past = timezone.now() - datetime.timedelta(hours=1)
+        # An old failure with a passed deadline must not be reported again
+        Todo.objects.exclude(status='ongoing').update(deadline=past)
+        Todo.objects.filter(status='ongoing').update(deadline=past)
+
+    def test_chunks_report_exactly_the_expired_todos(self):
+        expected = set(Todo.objects.filter(status='ongoing').values_list('id', flat=True))
+        now = timezone.now()
+        chunks = list(expire_todos(now=now, chunk_size=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 1])
+        expired = {todo_id for chunk in chunks for todo_id, _ in chunk}
+        self.assertEqual(expired, expected)
+        self.assertEqual(set(Todo.objects.filter(updatedAt=now).values_list('id', flat=True)), expected)
+        self.assertFalse(Todo.objects.filter(status='ongoing').exists())
+        self.assertEqual(list(expire_todos()), [])
+        self.assertEqual(rollups.check_rollups(), [])
+
+
+@override_settings(TODO_EXPIRY_SCHEDULER='command', TODO_OUTBOX_RELAY='command')
+class ExpirySchedulerTests(TransactionTestCase):
+    def test_expires_todos_shortly_after_their_deadline(self):
+        soon = Todo.objects.create(title='Soon', deadline=timezone.now() + datetime.timedelta(seconds=0.3))
+
+        @sync_to_async
+        def create_later_todo():
+            # Written while the scheduler sleeps, reaches it through the channel layer
+            todo = Todo.objects.create(title='Later', deadline=timezone.now() + datetime.timedelta(seconds=0.6))
+            notify_deadlines([todo])
+            return todo
+
+        async def scenario():
+            scheduler = ExpiryScheduler(horizon=60)
+            task = asyncio.ensure_future(scheduler.serve())
+            await asyncio.sleep(0.1)
+            later = await create_later_todo()
+            await asyncio.sleep(1.2)
+            task.cancel()
+            return later
+
+        later = async_to_sync(scenario)()
+        for todo in (soon, later):
+            todo.refresh_from_db()
+            self.assertEqual(todo.status, 'failure')
+            self.assertLess(todo.updatedAt - todo.deadline, datetime.timedelta(seconds=1))
+
+    @mock.patch('todo_api.scheduler.MIN_RETRY_DELAY', 0.05)
+    def test_restarts_after_a_database_error(self):
+        todo = Todo.objects.create(title='Soon', deadline=timezone.now() + datetime.timedelta(seconds=0.3))
+        real = scheduler.upcoming_deadlines
+        calls = []
+
+        def upcoming_deadlines(until):
+            calls.append(until)
+            if len(calls) == 1:
+                raise Exception('Database is down')
+            return real(until)
+
+        async def scenario():
+            task = asyncio.ensure_future(ExpiryScheduler(horizon=60).serve())
+            await asyncio.sleep(0.8)
+            task.cancel()
+
+        with mock.patch('todo_api.scheduler.upcoming_deadlines', upcoming_deadlines), \
+                self.assertLogs('todo_api.scheduler', 'ERROR'):
+            async_to_sync(scenario)()
+        todo.refresh_from_db()
+        self.assertEqual(todo.status, 'failure')
+
+
+class SweepLeaseTests(TestCase):
+    @mock.patch('todo_api.middleware.update_todo_statuses')
+    def test_one_sweep_per_interval_across_processes(self, sweep):
+        get_cache().clear()
+        request = mock.Mock(path='/api/todos/')
+        middleware = UpdateExpiredTodosMiddleware(lambda request: None)
+        for _ in range(3):
+            # Every call plays a fresh process whose local throttle allows a sweep
+            UpdateExpiredTodosMiddleware.last_update_time = 0
+            middleware(request)
+        UpdateExpiredTodosMiddleware.sweep_thread.join()
+        sweep.assert_called_once()
+
+    def test_interval_follows_the_setting(self):
+        middleware = UpdateExpiredTodosMiddleware(lambda request: None)
+        request = mock.Mock(path='/api/todos/')
+        UpdateExpiredTodosMiddleware.last_update_time = time.time() - 120
+        with override_settings(TODO_EXPIRY_SWEEP_INTERVAL=3600):
+            self.assertFalse(middleware.sweep_due(request))
+        with override_settings(TODO_EXPIRY_SWEEP_INTERVAL=60):
+            self.assertTrue(middleware.sweep_due(request))
+
+
+@override_settings(TODO_EXPIRY_SWEEP_IN_BACKGROUND=False)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        make_todos(15)
+
+    async def test_crud_matches_sync_endpoints(self):
+        deadline = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        response = await self.async_client.post(
+            '/api/async/todos/', {'title': 'Async', 'deadline': deadline}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['data']
+        response = await self.async_client.patch(
+            f'/api/async/todos/{created["id"]}/', {'priority': 'high'}, content_type='application/json'
+        )
+        self.assertEqual(response.json()['data']['priority'], 'high')
+
+        response = await self.async_client.get(f'/api/async/todos/{created["id"]}/')
+        sync_response = await sync_to_async(self.client.get)(f'/api/todos/{created["id"]}/')
+        self.assertEqual(response.json(), sync_response.json())
+        response = await self.async_client.get('/api/async/todos/', {'page_size': 10})
+        sync_response = await sync_to_async(self.client.get)('/api/todos/', {'pagination': 'cursor', 'page_size': 10})
+        self.assertEqual(response.json()['results'], sync_response.json()['results'])
+
+        response = await self.async_client.delete(f'/api/async/todos/{created["id"]}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await Todo.objects.filter(pk=created['id']).aexists())
+        self.assertEqual(
+            [payload['type'] async for payload in TodoChange.objects.values_list('payload', flat=True)],
+            ['todo_create', 'todo_update', 'todo_delete']
+        )
+
+    async def test_write_errors_use_the_error_envelope(self):
+        todo = await Todo.objects.afirst()
+        # Deleted between the view's lookup and the write
+        await Todo.objects.filter(pk=todo.pk).adelete()
+        with mock.patch('todo_api.async_views.get_todo', return_value=todo):
+            for method in ('patch', 'delete'):
+                response = await getattr(self.async_client, method)(
+                    f'/api/async/todos/{todo.pk}/', {'title': 'Gone'}, content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json()['status'], 'error')
+
+        with mock.patch('todo_api.writes.create_todo', side_effect=Exception('Database is down')):
+            response = await self.async_client.post(
+                '/api/async/todos/', {'title': 'Async', 'deadline': todo.deadline.isoformat()},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'status': 'error', 'message': 'Database is down', 'data': None})
+
+
+class OutboxTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(3)
+
+    def test_failed_publish_is_retried(self):
+        deadline = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        with mock.patch('todo_api.events.broadcast', side_effect=ConnectionError('redis down')):
+            response = self.client.post('/api/todos/', {'title': 'Outbox', 'deadline': deadline}, format='json')
+            self.assertEqual(response.status_code, 201)
+            with self.assertRaises(ConnectionError):
+                outbox.relay_pending()
+        self.assertTrue(TodoChange.objects.filter(publishedAt__isnull=True).exists())
+
+        with mock.patch('todo_api.events.broadcast') as broadcast:
+            self.assertEqual(outbox.relay_pending(), 1)
+            self.assertEqual(outbox.relay_pending(), 0)
+        event = broadcast.call_args.args[0]
+        self.assertEqual((event['type'], event['todo']['id'], event['seq']),
+                         ('todo_create', response.data['data']['id'], changes.latest_seq()))
+        self.assertFalse(TodoChange.objects.filter(publishedAt__isnull=True).exists())
+
+
+class SearchTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(10)
+        now = timezone.now()
+        self.shoes = Todo.objects.create(
+            title='Running shoes', description='Buy a new pair', tags=['shopping', 'sport'],
+            priority='high', deadline=now + datetime.timedelta(days=3)
+        )
+        self.report = Todo.objects.create(
+            title='Quarterly report', description='Write the summary', tags=['work'],
+            priority='low', deadline=now + datetime.timedelta(days=30)
+        )
+        tag_index.index_todos([self.shoes, self.report])
+
+    def search(self, **params):
+        response = self.client.get('/api/todos/', {'no_page': '', **params})
+        self.assertEqual(response.status_code, 200)
+        return {todo['title'] for todo in response.data}
+
+    def test_filters(self):
+        self.assertEqual(self.search(q='run pair'), {'Running shoes'})
+        self.assertEqual(self.search(q='"summary'), {'Quarterly report'})
+        self.assertEqual(self.search(q='!!!'), set())
+        self.assertEqual(self.search(tags='sport,work'), {'Running shoes', 'Quarterly report'})
+        self.assertEqual(self.search(tags='sport,work', tags_match='all'), set())
+        self.assertEqual(self.search(tags='sport,shopping', tags_match='all'), {'Running shoes'})
+        self.assertEqual(self.search(priority='high,low'), {'Running shoes', 'Quarterly report'})
+        deadline = (timezone.now() + datetime.timedelta(days=7)).isoformat()
+        self.assertEqual(self.search(deadline_after=deadline), {'Quarterly report'})
+        self.assertEqual(self.search(q='shoes', deadline_before=deadline), {'Running shoes'})
+
+        # The full-text index follows updates and deletes
+        self.report.title = 'Walking shoes'
+        self.report.save()
+        get_cache().clear()
+        self.assertEqual(self.search(q='shoes'), {'Running shoes', 'Walking shoes'})
+        self.shoes.delete()
+        get_cache().clear()
+        self.assertEqual(self.search(q='shoes'), {'Walking shoes'})
+
+        response = self.client.get('/api/todos/ongoing/', {'q': 'shoes'})
+        self.assertEqual(response.data['data']['count'], 1)
+        response = self.client.get('/api/todos/', {'priority': 'urgent'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TagIndexTests(TodoAPITestCase):
+    def setUp(self):
+        make_todos(3)
+        rollups.rebuild_rollups()
+
+    def index(self):
+        return sorted(
+            (str(todo_id), tag, status)
+            for todo_id, tag, status in TodoTag.objects.values_list('todo_id', 'tag', 'status')
+        )
+
+    def expected_index(self):
+        return sorted((str(todo.pk), tag, todo.status) for todo in Todo.objects.all() for tag in set(todo.tags))
+
+    def test_writes_keep_index_in_sync(self):
+        deadline = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        response = self.client.post('/api/todos/bulk/', [
+            {'title': 'A', 'deadline': deadline, 'tags': ['work', 'urgent']},
+            {'title': 'B', 'deadline': deadline, 'tags': ['work', 'work']},
+            {'title': 'C', 'deadline': deadline, 'tags': ['home'], 'status': 'success'},
+        ], format='json')
+        a, b, c = [todo['id'] for todo in response.data['data']]
+        self.client.patch(f'/api/todos/{a}/', {'tags': ['home', 'work']}, format='json')
+        self.client.patch('/api/todos/bulk/', [{'id': b, 'tags': []}, {'id': c, 'status': 'ongoing'}], format='json')
+        response = self.client.post('/api/todos/', {'title': 'D', 'deadline': deadline, 'tags': ['home']}, format='json')
+        self.client.patch(f'/api/todos/{response.data["data"]["id"]}/mark_complete/')
+        self.client.delete(f'/api/todos/{c}/')
+        self.client.post('/api/todos/', {'title': 'E', 'deadline': deadline, 'tags': ['home']}, format='json')
+        self.assertEqual(self.index(), self.expected_index())
+
+        Todo.objects.filter(title='E').update(deadline=timezone.now() - datetime.timedelta(hours=1))
+        list(expire_todos())
+        self.assertEqual(self.index(), self.expected_index())
+        get_cache().clear()
+        response = self.client.get('/api/analytics/tags/')
+        self.assertEqual(response.data['data'], [
+            {'tag': 'home', 'total': 3, 'status_counts': {'ongoing': 1, 'success': 1, 'failure': 1},
+             'completion_rate': 33.33},
+            {'tag': 'work', 'total': 1, 'status_counts': {'ongoing': 1, 'success': 0, 'failure': 0},
+             'completion_rate': 0.0},
+        ])
+        self.assertEqual(rollups.check_rollups(), [])
+        with override_settings(TODO_ANALYTICS_USE_ROLLUPS=False):
+            get_cache().clear()
+            self.assertEqual(self.client.get('/api/analytics/tags/').data['data'], response.data['data'])
+        response = self.client.post('/api/todos/', {'title': 'F', 'deadline': deadline, 'tags': [1]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SubscriptionTests(TodoAPITestCase):
+    def test_filtered_stream_routes_events(self):
+        tag_index.index_todos(make_todos(6, priority='high', tags=['work']))
+        tag_index.index_todos(make_todos(6, priority='low', tags=['work']))
+        subscription = Subscription.parse({'priority': 'high', 'tags': 'work,home'})
+        snapshot, _ = changes.snapshot_page(todos=subscription.filter_queryset(Todo.objects.all()))
+        self.assertEqual({todo['priority'] for todo in snapshot}, {'high'})
+        self.assertEqual(len(snapshot), 6)
+
+        stream = FilteredStream(subscription, visible=set())
+        stream.show(snapshot)
+        shown, hidden = dict(snapshot[0]), serialize_todo_rows(todo_values(Todo.objects.filter(priority='low')))[0]
+        # Matching todos pass, a todo leaving the filter is deleted once
+        self.assertEqual(stream.route(todo_update_event(shown, 1))['type'], 'todo_update')
+        self.assertEqual(stream.route(todo_update_event({**shown, 'tags': ['other']}, 2)),
+                         todo_delete_event(shown['id'], 2))
+        self.assertIsNone(stream.route(todo_update_event({**shown, 'tags': ['other']}, 3)))
+        self.assertIsNone(stream.route(todo_delete_event(shown['id'], 4)))
+        # Todos the client never saw are dropped until they match
+        self.assertIsNone(stream.route(todo_update_event(hidden, 5)))
+        self.assertIsNone(stream.route(todo_delete_event(hidden['id'], 6)))
+        self.assertEqual(stream.route(todo_create_event({**hidden, 'priority': 'high'}, 7))['type'], 'todo_create')
+        self.assertEqual(stream.route(todo_delete_event(hidden['id'], 8))['type'], 'todo_delete')
+
+        with self.assertRaises(ValueError):
+            Subscription.parse({'status': 'done'})
+
+
+def make_consumer(**subscription):
+    """
+    Returns a TodoConsumer collecting the messages it sends in `sent`
+    """
+    consumer = TodoConsumer()
+    consumer.sent = []
+
+    async def base_send(message):
+        consumer.sent.append(message)
+
+    consumer.base_send = base_send
+    consumer.subscribe(Subscription.parse(subscription))
+    if consumer.stream is not None:
+        consumer.stream.visible = set()
+    return consumer
+
+
+class FrameEncodingTests(TestCase):
+    def run_handlers(self, *calls):
+        """
+        Runs (consumer, handler name, event) calls on one event loop and
+        waits for the consumers' writers
+        """
+        async def run():
+            consumers = list({id(consumer): consumer for consumer, _, _ in calls}.values())
+            for consumer in consumers:
+                consumer.start_writer()
+            for consumer, handler, event in calls:
+                await getattr(consumer, handler)(event)
+            for consumer in consumers:
+                await consumer.outbound.join()
+                consumer.stop_writer()
+        async_to_sync(run)()
+
+    def test_handlers_forward_the_frame_encoded_by_the_sender(self):
+        todo = serialize_todo_rows(todo_values(Todo.objects.filter(pk__in=[t.pk for t in make_todos(2)])))
+        high = {**todo[0], 'priority': 'high'}
+        event = encode_frames(todo_batch_event([todo_update_event(todo[1], 1), todo_create_event(high, 2)]))
+        self.assertEqual(json.loads(event['frame_text']), {'type': 'todo_batch', 'events': event['events']})
+
+        unfiltered, filtered = make_consumer(), make_consumer(priority='high')
+        update = encode_frames(todo_update_event(high, 3))
+        self.run_handlers(
+            (unfiltered, 'todo_batch', event),
+            (filtered, 'todo_batch', event),
+            (filtered, 'todo_update', update)
+        )
+        self.assertIs(unfiltered.sent[0]['text'], event['frame_text'])
+        # Only part of the batch passes the filter, so it is encoded again
+        self.assertEqual(json.loads(filtered.sent[0]['text'])['events'], [todo_create_event(high, 2)])
+        self.assertIs(filtered.sent[1]['text'], update['frame_text'])
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+@override_settings(TODO_WS_MSGPACK=True)
+class MsgpackConsumerTests(TransactionTestCase):
+    def test_msgpack_clients_get_binary_frames(self):
+        todos = make_todos(2)
+        todo = serialize_todo_rows(todo_values(Todo.objects.filter(pk=todos[0].pk)))[0]
+
+        async def run():
+            communicator = WebsocketCommunicator(
+                TodoConsumer.as_asgi(), '/ws/todos/', subprotocols=[MSGPACK_SUBPROTOCOL]
+            )
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+            snapshot = msgpack.unpackb(await communicator.receive_from())
+            self.assertEqual(snapshot['type'], 'todo_list')
+            self.assertEqual(len(snapshot['todos']), 2)
+
+            await communicator.send_to(bytes_data=msgpack.packb({'type': 'request_todos', 'since': snapshot['seq']}))
+            delta = msgpack.unpackb(await communicator.receive_from())
+            self.assertEqual((delta['type'], delta['events']), ('todo_delta', []))
+
+            await sync_to_async(broadcast)(todo_update_event(todo, 1))
+            update = msgpack.unpackb(await communicator.receive_from())
+            self.assertEqual(update, client_message(todo_update_event(todo, 1)))
+            await communicator.disconnect()
+        async_to_sync(run)()
+
+
+@override_settings(TODO_WS_QUEUE_MERGE_AT=3, TODO_WS_QUEUE_MAX=5)
+class BackpressureTests(TestCase):
+    def backlog(self, consumer, events):
+        """
+        Queues events while the writer is stalled, then lets it catch up
+        """
+        async def run():
+            release = asyncio.Event()
+            base_send = consumer.base_send
+
+            async def stalled_send(message):
+                await release.wait()
+                await base_send(message)
+
+            consumer.base_send = stalled_send
+            consumer.start_writer()
+            for event in events:
+                await consumer.send_event(event)
+            await asyncio.sleep(0)
+            release.set()
+            await consumer.outbound.join()
+            consumer.stop_writer()
+        async_to_sync(run)()
+        return [json.loads(message['text']) for message in consumer.sent if 'text' in message]
+
+    def test_slow_client_gets_the_latest_state_per_todo(self):
+        todos = serialize_todo_rows(todo_values(Todo.objects.filter(pk__in=[t.pk for t in make_todos(3)])))
+        events = [todo_create_event(todos[2], 1)] + [
+            todo_update_event({**todos[seq % 2], 'title': f'v{seq}'}, seq) for seq in range(2, 8)
+        ] + [todo_update_event({**todos[2], 'title': 'created'}, 8)]
+        merged_before = queue_stats.as_dict()['merged_events']
+        messages = self.backlog(make_consumer(), [encode_frames(event) for event in events])
+
+        # The backlog went out as one batch of the latest event per todo,
+        # the todo created in between still as a todo_create
+        self.assertEqual(messages, [{'type': 'todo_batch', 'events': [
+            client_message(todo_update_event({**todos[0], 'title': 'v6'}, 6)),
+            client_message(todo_update_event({**todos[1], 'title': 'v7'}, 7)),
+            client_message(todo_create_event({**todos[2], 'title': 'created'}, 8)),
+        ]}])
+        self.assertEqual(queue_stats.as_dict()['merged_events'], merged_before + 5)
+
+    def test_client_that_cannot_keep_up_must_resync(self):
+        todos = serialize_todo_rows(todo_values(Todo.objects.filter(pk__in=[t.pk for t in make_todos(8)])))
+        consumer = make_consumer()
+        resyncs_before = queue_stats.as_dict()['resyncs']
+        messages = self.backlog(consumer, [encode_frames(todo_update_event(todo, seq)) for seq, todo in enumerate(todos, 1)])
+
+        self.assertEqual(messages[-1]['type'], 'resync_required')
+        self.assertEqual(consumer.sent[-1], {'type': 'websocket.close', 'code': RESYNC_CLOSE_CODE})
+        self.assertEqual(queue_stats.as_dict()['resyncs'], resyncs_before + 1)
+        self.assertEqual(queue_stats.as_dict()['queued'], 0)
+
+
+class MetricsTests(TodoAPITestCase):
+    def test_requests_are_recorded_by_route(self):
+        make_todos(3)
+        requests = metrics.http_requests.get(method='GET', route='todo-list', status=200)
+        count, queries = metrics.db_queries.get(method='GET', route='todo-list')
+        self.client.get('/api/todos/')
+        self.client.get('/api/todos/')
+
+        self.assertEqual(metrics.http_requests.get(method='GET', route='todo-list', status=200), requests + 2)
+        new_count, new_queries = metrics.db_queries.get(method='GET', route='todo-list')
+        self.assertEqual(new_count, count + 2)
+        self.assertGreater(new_queries, queries)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('# TYPE todo_db_queries_per_request histogram', body)
+        self.assertRegex(body, r'todo_db_queries_per_request_bucket\{method="GET",route="todo-list",le="\+Inf"\} \d+')
+        self.assertIn('todo_ws_open_connections ', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', ['route'], buckets=(1, 5))
+        for value in (0.5, 2, 3, 10):
+            histogram.observe(value, route='a')
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{route="a",le="1"} 1',
+            'test_seconds_bucket{route="a",le="5"} 3',
+            'test_seconds_bucket{route="a",le="+Inf"} 4',
+            'test_seconds_sum{route="a"} 15.5',
+            'test_seconds_count{route="a"} 4',
+        ])
+
+
+# The inline relay publishes in on_commit callbacks of the writing request,
+# which count against its budget
+@override_settings(TODO_OUTBOX_RELAY='inline')
+class QueryBudgetTests(TodoAPITestCase):
+    # Table sizes the query counts are pinned at
+    ROWS = (10, 1000, 100000)
+
+    def fixture_todos(self):
+        """
+        Creates todos in a known state for the endpoints to read and change
+        and empties the rollup tables, so every write starts new buckets
+        """
+        now = timezone.now()
+        todos = Todo.objects.bulk_create([
+            Todo(title=f'Fixture {i}', deadline=now + datetime.timedelta(days=3),
+                 priority='high', tags=['fixture'])
+            for i in range(8)
+        ])
+        tag_index.index_todos(todos)
+        for model, _, _ in rollups.TABLES:
+            model.objects.all().delete()
+        return [str(todo.pk) for todo in todos]
+
+    def endpoints(self, ids):
+        """
+        Returns (method, url, data, queries) tuples, `queries` being the
+        pinned query count of the request. Writes include the queries of
+        the relay publishing their events.
+        """
+        deadline = (timezone.now() + datetime.timedelta(days=2)).isoformat()
+        return [
+            ('get', '/api/todos/', None, 2),
+            ('get', '/api/todos/?pagination=cursor', None, 1),
+            ('get', '/api/todos/?q=fixture&tags=fixture&priority=high', None, 2),
+            ('get', f'/api/todos/{ids[0]}/', None, 2),
+            ('post', '/api/todos/', {'title': 'New', 'deadline': deadline, 'tags': ['new']}, 9),
+            ('put', f'/api/todos/{ids[0]}/', {'title': 'Put', 'deadline': deadline, 'tags': ['put'], 'status': 'success'}, 13),
+            ('patch', f'/api/todos/{ids[1]}/', {'title': 'Patch'}, 6),
+            ('patch', f'/api/todos/{ids[2]}/mark_complete/', None, 10),
+            ('delete', f'/api/todos/{ids[3]}/', None, 11),
+            ('post', '/api/todos/bulk/', [{'title': 'Bulk', 'deadline': deadline}] * 2, 6),
+            ('patch', '/api/todos/bulk/', [{'id': ids[4], 'status': 'failure'}, {'id': ids[5], 'tags': []}], 12),
+            ('delete', '/api/todos/bulk/', {'ids': ids[6:8]}, 13),
+            ('get', '/api/todos/ongoing/', None, 2),
+            ('get', '/api/todos/success/', None, 2),
+            ('get', '/api/todos/failure/', None, 2),
+            ('get', '/api/analytics/completion-stats/', None, 2),
+            ('get', '/api/analytics/productivity-patterns/', None, 4),
+            ('get', '/api/analytics/productivity-patterns/completion-times/', None, 2),
+            ('get', '/api/analytics/tags/', None, 1),
+            ('get', '/api/analytics/duration-analysis/', None, 1),
+        ]
+
+    def budget(self, method, url):
+        match = resolve(url.split('?')[0])
+        action = match.func.actions[method]
+        if action == 'partial_update':
+            # Runs within update
+            action = 'update'
+        return getattr(match.func.cls, action).query_budget
+
+    def test_query_counts_are_pinned_at_any_table_size(self):
+        # The export streams the table in STREAM_CHUNK_SIZE chunks, its
+        # query count grows with the rows by design. The middleware expiry
+        # sweep runs once per interval, outside of any view.
+        sweep = mock.patch.object(UpdateExpiredTodosMiddleware, 'sweep_due', return_value=False)
+        sweep.start()
+        self.addCleanup(sweep.stop)
+        seeded = 0
+        for rows in self.ROWS:
+            seed_todos(rows - seeded)
+            seeded = rows
+            for method, url, data, expected in self.endpoints(self.fixture_todos()):
+                get_cache().clear()
+                with count_queries() as queries, self.captureOnCommitCallbacks(execute=True):
+                    response = getattr(self.client, method)(url, data, format='json')
+                self.assertLess(response.status_code, 400, f'{method.upper()} {url}')
+                with self.subTest(rows=rows, method=method, url=re.sub(r'[0-9a-f-]{36}', '<id>', url)):
+                    self.assertEqual(len(queries), expected, '\n'.join(queries))
+                    self.assertLessEqual(expected, self.budget(method, url))
+
+    def test_view_over_budget_fails(self):
+        @query_budget(1)
+        def view():
+            return list(Todo.objects.all()), Todo.objects.count()
+
+        with self.assertRaisesRegex(QueryBudgetExceeded, 'ran 2 queries, its budget is 1'):
+            view()
+        with override_settings(TODO_QUERY_BUDGETS=False):
+            view()
+
+    def test_write_over_budget_keeps_its_response(self):
+        # Raising once the write committed would report it as failed
+        @query_budget(1)
+        def view(request):
+            Todo.objects.create(title='Over', deadline=timezone.now() + datetime.timedelta(days=1))
+            return Todo.objects.count()
+
+        with self.assertLogs('todo_api.utils', 'ERROR') as logs:
+            self.assertEqual(view(APIRequestFactory().post('/api/todos/')), 1)
+        self.assertIn('ran 2 queries, its budget is 1', logs.output[0])
+        with self.assertRaises(QueryBudgetExceeded):
+            view(APIRequestFactory().get('/api/todos/'))
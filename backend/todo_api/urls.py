@@ -1,11 +1,17 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TodoViewSet, AnalyticsViewSet
+from . import async_views
+from .views import TodoViewSet, AnalyticsViewSet, CacheStatsView, BroadcastStatsView, WebSocketStatsView
 
 router = DefaultRouter()
 router.register(r'todos', TodoViewSet)
 router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('broadcast/stats/', BroadcastStatsView.as_view(), name='broadcast-stats'),
+    path('websocket/stats/', WebSocketStatsView.as_view(), name='websocket-stats'),
+    path('async/todos/', async_views.todo_list, name='async-todo-list'),
+    path('async/todos/<uuid:pk>/', async_views.todo_detail, name='async-todo-detail'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
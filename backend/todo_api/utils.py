@@ -1,6 +1,23 @@
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, StreamingHttpResponse
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+import contextlib
 import functools
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip when streaming (server-side cursor on
+# PostgreSQL) and per emitted block of output, for the status action
+# streams and the export alike
+STREAM_CHUNK_SIZE = 2000
+STREAM_FORMATS = ('ndjson',)
 
 def create_response(data=None, message="", success=True, status_code=status.HTTP_200_OK):
     """
@@ -69,4 +86,158 @@ def handle_exception(func):
             return func(*args, **kwargs)
         except Exception as e:
             return error_response(str(e))
-    return wrapper 
\ No newline at end of file
+    return wrapper
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when a view runs more database queries than its budget
+    """
+
+# Statements left out of query budgets: transaction control, which differs
+# between backends and between a request and a TestCase (BEGIN, or nothing
+# on PostgreSQL, against SAVEPOINT/RELEASE), and the PostgreSQL-only
+# advisory locks, so a budget is the same number everywhere
+UNCOUNTED_QUERY_PREFIXES = (
+    'BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'SELECT pg_advisory_xact_lock',
+)
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Collects the SQL of the queries run on the default connection that
+    count against query budgets
+
+    Yields:
+        The list the statements are appended to
+    """
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        if not sql.lstrip().startswith(UNCOUNTED_QUERY_PREFIXES):
+            queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        yield queries
+
+def query_budget(max_queries):
+    """
+    Decorator declaring the most database queries an API view may run
+
+    With TODO_QUERY_BUDGETS on (DEBUG and the tests) a view going over its
+    budget raises QueryBudgetExceeded listing its queries, otherwise the
+    budget is not checked. Goes above handle_exception, which would turn
+    the error into a 400 response. The budget is only checked once the view
+    returned, when a write has already committed: for requests other than
+    GET, HEAD and OPTIONS the overrun is logged and the response kept.
+
+    Queries of on_commit callbacks run in the view (the inline outbox relay)
+    are counted, queries run while a streamed response is iterated happen
+    after the view returned and are not. See count_queries for the
+    statements left out.
+
+    Args:
+        max_queries: The budget, the same for any number of rows
+
+    Returns:
+        Decorator for a view or viewset action, the budget is kept in its
+        `query_budget` attribute
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.TODO_QUERY_BUDGETS:
+                return func(*args, **kwargs)
+            with count_queries() as queries:
+                response = func(*args, **kwargs)
+            if len(queries) > max_queries:
+                message = (
+                    f'{func.__qualname__} ran {len(queries)} queries, its budget is {max_queries}:\n'
+                    + '\n'.join(queries)
+                )
+                request = next((arg for arg in args if isinstance(arg, (HttpRequest, Request))), None)
+                if request is not None and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+                    logger.error(message)
+                else:
+                    raise QueryBudgetExceeded(message)
+            return response
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+def encode_json(data):
+    """
+    Encodes data the same way DRF's JSONRenderer does (compact, UTF-8)
+    """
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+def chunked(rows, chunk_size):
+    """
+    Groups serialized rows into lists of `chunk_size` rows
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def ndjson_blocks(rows, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields blocks of `chunk_size` JSON lines, one line per serialized row
+    """
+    for chunk in chunked(rows, chunk_size):
+        yield ''.join(encode_json(row) + '\n' for row in chunk)
+
+def streaming_response(rows, stream_format='ndjson'):
+    """
+    Creates a streaming response with one JSON document per line
+
+    Args:
+        rows: Iterable of serialized rows, typically a generator reading the
+            database in chunks
+        stream_format: The requested stream format (only 'ndjson')
+
+    Returns:
+        StreamingHttpResponse with constant memory use regardless of row count
+
+    Raises:
+        ValueError: If the stream format is not supported
+    """
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError(f'Unsupported stream format "{stream_format}": expected one of {", ".join(STREAM_FORMATS)}')
+    return StreamingHttpResponse(
+        (block.encode('utf-8') for block in ndjson_blocks(rows)),
+        content_type='application/x-ndjson'
+    )
+
+def parse_todo_ids(values, max_items):
+    """
+    Parses the todo ids sent to a bulk endpoint
+
+    Args:
+        values: List of todo ids as sent by the client
+        max_items: Maximum number of ids accepted
+
+    Returns:
+        List of uuid.UUID
+
+    Raises:
+        ValueError: If values is not a list, is too long, repeats an id or
+            contains a malformed id
+    """
+    if not isinstance(values, list):
+        raise ValueError('Expected a list of todo ids')
+    if len(values) > max_items:
+        raise ValueError(f'At most {max_items} todos can be changed per request')
+    ids = []
+    for value in values:
+        try:
+            ids.append(uuid.UUID(str(value)))
+        except ValueError:
+            raise ValueError(f'Invalid todo id "{value}"')
+    if len(set(ids)) != len(ids):
+        raise ValueError('Each todo can only appear once per request')
+    return ids
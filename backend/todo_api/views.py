@@ -1,22 +1,32 @@
 from django.shortcuts import render
-from django.utils import timezone
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
 from .models import Todo
-from .serializers import TodoSerializer
-from .cron import update_todo_statuses
-from .utils import success_response, error_response, handle_exception
-from django.db.models import Count, Avg, F, ExpressionWrapper, fields, Q
-import datetime
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 100
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
+from .pagination import StandardResultsSetPagination, KeysetPagination, CappedListPagination
+from .search import TodoSearchFilter
+from .export import parse_export_format, parse_resume_position, export_queryset, export_response
+from .serializers import TodoSerializer, todo_values, serialize_todo_row, serialize_todo_rows, iter_serialized_todos
+from .utils import success_response, error_response, handle_exception, query_budget, parse_todo_ids, streaming_response, STREAM_CHUNK_SIZE
+from . import analytics, changes, metrics, rollups, scheduler, tag_index, writes
+from .events import broadcast_stats, todo_create_event, todo_update_event, todo_delete_event
+from .outbound import queue_stats
+from .response_cache import bump_generation, cached_response, get_stats
+from .conditional import conditional_collection, conditional_todo, conditional_analytics
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """
+    The export endpoint uses ?format= to pick the export format, so it must
+    not be treated as DRF's renderer override
+    """
+    def filter_renderers(self, renderers, format):
+        return renderers
 
 class TodoViewSet(viewsets.ModelViewSet):
     """
@@ -25,27 +35,69 @@ class TodoViewSet(viewsets.ModelViewSet):
     queryset = Todo.objects.all()
     serializer_class = TodoSerializer
     pagination_class = StandardResultsSetPagination
+    # ?q=, ?tags=, ?tags_match=, ?priority=, ?deadline_after=, ?deadline_before=
+    filter_backends = [TodoSearchFilter]
+
+    @property
+    def paginator(self):
+        """
+        Uses keyset pagination when the client opts in with ?pagination=cursor
+        and a capped plain list for the legacy ?no_page parameter
+        """
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_class
+            if self.uses_cursor_pagination():
+                pagination_class = KeysetPagination
+            elif 'no_page' in self.request.query_params:
+                pagination_class = CappedListPagination
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
 
-    def get_queryset(self):
-        queryset = Todo.objects.all()
-        if 'no_page' in self.request.query_params:
-            self.pagination_class = None
-        return queryset
+    def uses_cursor_pagination(self):
+        return self.request.query_params.get('pagination') == 'cursor'
+
+    @query_budget(2)
+    @conditional_collection
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        """
+        Lists todos through the read-only fast serializer path
+        """
+        queryset = todo_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize_todo_rows(page))
+        return Response(serialize_todo_rows(queryset))
+
+    @query_budget(2)
+    @conditional_todo
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieves a todo through the read-only fast serializer path
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            todo_values(self.filter_queryset(self.get_queryset())),
+            **{self.lookup_field: kwargs[lookup_url_kwarg]}
+        )
+        return Response(serialize_todo_row(row))
 
+    # Writes store their WebSocket event in the change log (the outbox),
+    # the relay publishes it once the transaction has committed
+
+    def perform_create(self, serializer):
+        writes.create_todo(serializer)
+
+    def perform_update(self, serializer):
+        writes.update_todo(serializer)
+
+    def perform_destroy(self, instance):
+        writes.delete_todo(instance)
+
+    @query_budget(9)
     def create(self, request, *args, **kwargs):
         try:
             response = super().create(request, *args, **kwargs)
-            
-            # Notify WebSocket clients about the new todo
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "todos",
-                {
-                    "type": "todo_create",
-                    "todo": response.data
-                }
-            )
-            
             return success_response(
                 data=response.data, 
                 message='Todo created successfully', 
@@ -54,20 +106,10 @@ class TodoViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return error_response(str(e))
 
+    @query_budget(13)
     def update(self, request, *args, **kwargs):
         try:
             response = super().update(request, *args, **kwargs)
-            
-            # Notify WebSocket clients about the updated todo
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "todos",
-                {
-                    "type": "todo_update",
-                    "todo": response.data
-                }
-            )
-            
             return success_response(
                 data=response.data,
                 message='Todo updated successfully'
@@ -75,21 +117,10 @@ class TodoViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return error_response(str(e))
 
+    @query_budget(11)
     def destroy(self, request, *args, **kwargs):
         try:
-            todo_id = self.get_object().id
             super().destroy(request, *args, **kwargs)
-            
-            # Notify WebSocket clients about the deleted todo
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "todos",
-                {
-                    "type": "todo_delete",
-                    "todo_id": str(todo_id)
-                }
-            )
-            
             return success_response(
                 message='Todo deleted successfully'
             )
@@ -97,141 +128,250 @@ class TodoViewSet(viewsets.ModelViewSet):
             return error_response(str(e))
 
     @action(detail=True, methods=['patch'])
+    @query_budget(10)
     @handle_exception
     def mark_complete(self, request, pk=None):
-        todo = self.get_object()
-        todo.status = 'success'
-        todo.save()
-        serializer = self.get_serializer(todo)
-        
-        # Notify WebSocket clients about the updated todo
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "todos",
-            {
-                "type": "todo_update",
-                "todo": serializer.data
-            }
-        )
-        
+        with transaction.atomic():
+            todo = get_object_or_404(Todo.objects.select_for_update(), pk=pk)
+            old_state = rollups.rollup_state(todo)
+            todo.status = 'success'
+            todo.save()
+            rollups.record_update(old_state, todo)
+            tag_index.record_status_change([todo.pk], 'success')
+            serializer = self.get_serializer(todo)
+            # WebSocket clients are notified through the outbox
+            changes.record_change('update', todo.pk, todo_update_event(serializer.data))
+            bump_generation()
         return success_response(
             data=serializer.data,
             message='Todo marked as complete'
         )
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['post'], url_path='bulk')
+    @query_budget(30)
     @handle_exception
-    def ongoing(self, request):
-        todos = Todo.objects.filter(status='ongoing')
-        serializer = self.get_serializer(todos, many=True)
+    def bulk(self, request):
+        """
+        Creates a list of todos in one transaction, relayed to WebSocket
+        clients as todo_batch messages
+        """
+        serializer = self.get_serializer(data=request.data, many=True, max_length=settings.TODO_BULK_MAX_ITEMS)
+        if not serializer.is_valid():
+            return error_response('Invalid todos', data=serializer.errors)
+        with transaction.atomic():
+            todos = serializer.save()
+            rollups.record_creates(todos)
+            tag_index.index_todos(todos)
+            data = serializer.data
+            # One outbox entry per todo, relayed to clients as todo_batch messages
+            changes.record_changes('create', [todo.pk for todo in todos], [todo_create_event(todo) for todo in data])
+            scheduler.notify_deadlines(todos)
+            bump_generation()
         return success_response(
-            data=serializer.data,
-            message='Ongoing todos retrieved'
+            data=data,
+            message=f'{len(data)} todos created',
+            status_code=status.HTTP_201_CREATED
         )
 
-    @action(detail=False, methods=['get'])
+    @bulk.mapping.patch
+    @query_budget(30)
     @handle_exception
-    def success(self, request):
-        todos = Todo.objects.filter(status='success')
-        serializer = self.get_serializer(todos, many=True)
+    def bulk_partial_update(self, request):
+        """
+        Partially updates a list of todos, each item carrying the id of the
+        todo it changes
+        """
+        items = request.data if isinstance(request.data, list) else []
+        ids = parse_todo_ids(
+            [item['id'] for item in items if isinstance(item, dict) and 'id' in item],
+            settings.TODO_BULK_MAX_ITEMS
+        )
+        with transaction.atomic():
+            todos = {str(pk): todo for pk, todo in Todo.objects.select_for_update().in_bulk(ids).items()}
+            serializer = self.get_serializer(
+                todos, data=request.data, many=True, partial=True, max_length=settings.TODO_BULK_MAX_ITEMS
+            )
+            if not serializer.is_valid():
+                return error_response('Invalid todos', data=serializer.errors)
+            old_states = {todo.pk: rollups.rollup_state(todo) for todo in todos.values()}
+            updated = serializer.save()
+            rollups.record_updates(old_states, updated)
+            tag_index.reindex_todos(
+                todo for todo, attrs in zip(updated, serializer.validated_data) if attrs.keys() & {'tags', 'status'}
+            )
+            data = serializer.data
+            changes.record_changes('update', [todo.pk for todo in updated], [todo_update_event(todo) for todo in data])
+            scheduler.notify_deadlines(updated)
+            bump_generation()
         return success_response(
-            data=serializer.data,
-            message='Completed todos retrieved'
+            data=data,
+            message=f'{len(data)} todos updated'
         )
 
-    @action(detail=False, methods=['get'])
+    @bulk.mapping.delete
+    @query_budget(30)
     @handle_exception
-    def failure(self, request):
-        todos = Todo.objects.filter(status='failure')
-        serializer = self.get_serializer(todos, many=True)
+    def bulk_destroy(self, request):
+        """
+        Deletes a list of todos, sent as a list of ids or as {"ids": [...]}
+        """
+        ids = request.data.get('ids') if isinstance(request.data, dict) else request.data
+        ids = parse_todo_ids(ids, settings.TODO_BULK_MAX_ITEMS)
+        with transaction.atomic():
+            found = set(Todo.objects.select_for_update().filter(pk__in=ids).values_list('id', flat=True))
+            todos = Todo.objects.filter(pk__in=found)
+            rollups.record_delete_queryset(todos)
+            todos.delete()
+            deleted_ids = [todo_id for todo_id in ids if todo_id in found]
+            changes.record_changes('delete', deleted_ids, [todo_delete_event(todo_id) for todo_id in deleted_ids])
+            bump_generation()
         return success_response(
-            data=serializer.data,
-            message='Failed todos retrieved'
+            data={
+                'deleted': [str(todo_id) for todo_id in deleted_ids],
+                'not_found': [str(todo_id) for todo_id in ids if todo_id not in found]
+            },
+            message=f'{len(deleted_ids)} todos deleted'
+        )
+
+    def list_by_status(self, todo_status, message):
+        """
+        Lists the todos with the given status one page at a time, or all of
+        them as a constant-memory stream with ?stream=ndjson, narrowed by
+        the search parameters
+        """
+        todos = self.filter_queryset(Todo.objects.filter(status=todo_status))
+        stream_format = self.request.query_params.get('stream')
+        if stream_format:
+            return streaming_response(iter_serialized_todos(todos, STREAM_CHUNK_SIZE), stream_format)
+        page = self.paginate_queryset(todo_values(todos))
+        return success_response(
+            data=self.get_paginated_response(serialize_todo_rows(page)).data,
+            message=message
+        )
+
+    @action(detail=False, methods=['get'], content_negotiation_class=ExportContentNegotiation)
+    @query_budget(1)
+    @handle_exception
+    def export(self, request):
+        """
+        Streams every todo as NDJSON or CSV (?format=ndjson|csv), ordered by
+        (updatedAt, id) and gzipped on the fly when the client accepts it.
+        Interrupted exports resume with ?since=<updatedAt>&after=<id> of the
+        last row received.
+        """
+        export_format = parse_export_format(request.query_params.get('format'))
+        since, after = parse_resume_position(
+            request.query_params.get('since'),
+            request.query_params.get('after')
+        )
+        return export_response(
+            export_queryset(Todo.objects.all(), since, after),
+            export_format,
+            gzip='gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
         )
 
+    @action(detail=False, methods=['get'])
+    @query_budget(2)
+    @conditional_collection
+    @cached_response
+    @handle_exception
+    def ongoing(self, request):
+        return self.list_by_status('ongoing', 'Ongoing todos retrieved')
+
+    @action(detail=False, methods=['get'])
+    @query_budget(2)
+    @conditional_collection
+    @cached_response
+    @handle_exception
+    def success(self, request):
+        return self.list_by_status('success', 'Completed todos retrieved')
+
+    @action(detail=False, methods=['get'])
+    @query_budget(2)
+    @conditional_collection
+    @cached_response
+    @handle_exception
+    def failure(self, request):
+        return self.list_by_status('failure', 'Failed todos retrieved')
+
 class AnalyticsViewSet(viewsets.ViewSet):
     """
     API viewset for analytics endpoints
     """
     
     @action(detail=False, methods=['get'], url_path='completion-stats')
+    @query_budget(2)
+    @conditional_analytics
+    @cached_response
     @handle_exception
     def task_completion_stats(self, request):
-        status_counts = Todo.objects.values('status').annotate(count=Count('status'))
-        
-        now = timezone.now()
-        start_date = now - datetime.timedelta(days=90) 
-        
-        weekly_data = []
-        current = start_date
-        
-        while current <= now:
-            week_end = current + datetime.timedelta(days=7)
-            week_todos = Todo.objects.filter(createdAt__gte=current, createdAt__lt=week_end)
-            total = week_todos.count()
-
-            success = week_todos.filter(status='success').count()
-            
-            if total > 0:
-                completion_rate = (success / total) * 100
-            else:
-                completion_rate = 0
-                
-            weekly_data.append({
-                'week_start': current.strftime('%Y-%m-%d'),
-                'week_end': week_end.strftime('%Y-%m-%d'),
-                'total_tasks': total,
-                'completed_tasks': success,
-                'completion_rate': round(completion_rate, 2)
-            })
-            current = week_end
-        
-        data = {
-            'status_distribution': status_counts,
-            'weekly_completion': weekly_data
-        }
+        window = analytics.parse_window(request.query_params.get('window'))
+        bucket = analytics.parse_bucket(request.query_params.get('bucket'))
+        data = analytics.completion_stats(window=window, bucket=bucket)
         return success_response(
             data=data,
             message='Task completion statistics retrieved'
         )
     
     @action(detail=False, methods=['get'], url_path='productivity-patterns')
+    @query_budget(4)
+    @conditional_analytics
+    @cached_response
     @handle_exception
     def productivity_patterns(self, request):
-        todos = Todo.objects.all()
-        creation_hours = []
-        for hour in range(24):
-            count = todos.filter(createdAt__hour=hour).count()
-            if count > 0:  
-                creation_hours.append({'hour': hour, 'count': count})
-
-        completed_todos = todos.filter(status='success')
-        completion_time_data = []
-        if completed_todos.exists():
-            for todo in completed_todos:
-                delta = todo.updatedAt - todo.createdAt
-                hours = delta.total_seconds() / 3600  
-                completion_time_data.append({
-                    'id': str(todo.id),
-                    'title': todo.title,
-                    'completion_time_hours': round(hours, 2)
-                })
+        limit = analytics.parse_limit(request.query_params.get('completion_limit'))
+        summary = analytics.completion_time_summary()
+        completion_time_data = analytics.completion_times(
+            analytics.completion_times_queryset()[:limit]
+        )
 
-        avg_completion_time = 0
-        if completion_time_data:
-            avg_completion_time = sum(item['completion_time_hours'] for item in completion_time_data) / len(completion_time_data)
-            
         data = {
-            'creation_hour_distribution': creation_hours,
-            'avg_completion_time_hours': round(avg_completion_time, 2),
+            'creation_hour_distribution': analytics.creation_hour_distribution(),
+            'avg_completion_time_hours': summary['avg_hours'],
+            'completion_time_percentiles': summary['percentiles'],
+            'completion_time_histogram': summary['histogram'],
+            'completion_time_count': summary['count'],
             'completion_time_data': completion_time_data
         }
         return success_response(
             data=data,
             message='Productivity patterns retrieved'
         )
+
+    @action(detail=False, methods=['get'], url_path='productivity-patterns/completion-times')
+    @query_budget(2)
+    @conditional_analytics
+    @cached_response
+    @handle_exception
+    def completion_times(self, request):
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(analytics.completion_times_queryset(), request, view=self)
+        response = paginator.get_paginated_response(analytics.completion_times(page))
+        return success_response(
+            data=response.data,
+            message='Completion times retrieved'
+        )
     
+    @action(detail=False, methods=['get'])
+    @query_budget(1)
+    @conditional_analytics
+    @cached_response
+    @handle_exception
+    def tags(self, request):
+        """
+        Per-tag todo counts, status breakdown and completion rate, most used
+        tags first (?limit=, default 100)
+        """
+        limit = analytics.parse_limit(request.query_params.get('limit'))
+        return success_response(
+            data=tag_index.tag_stats(limit, rollup=settings.TODO_ANALYTICS_USE_ROLLUPS),
+            message='Tag statistics retrieved'
+        )
+
     @action(detail=False, methods=['get'], url_path='duration-analysis')
+    @query_budget(1)
+    @conditional_analytics
+    @cached_response
     @handle_exception
     def task_duration_analysis(self, request):
         todos = Todo.objects.all()
@@ -271,3 +411,50 @@ class AnalyticsViewSet(viewsets.ViewSet):
             data=data,
             message='Task duration analysis retrieved'
         )
+
+class CacheStatsView(APIView):
+    """
+    Reports the response cache hit/miss counters
+    """
+
+    @handle_exception
+    def get(self, request):
+        return success_response(
+            data=get_stats(),
+            message='Cache statistics retrieved'
+        )
+
+
+class BroadcastStatsView(APIView):
+    """
+    Reports the batch size and flush latency of the coalesced broadcasts
+    of this process
+    """
+
+    @handle_exception
+    def get(self, request):
+        return success_response(
+            data=broadcast_stats.as_dict(),
+            message='Broadcast statistics retrieved'
+        )
+
+
+class WebSocketStatsView(APIView):
+    """
+    Reports the outbound queue depth and the merged and dropped events of
+    the WebSocket clients of this process
+    """
+
+    @handle_exception
+    def get(self, request):
+        return success_response(
+            data=queue_stats.as_dict(),
+            message='WebSocket statistics retrieved'
+        )
+
+
+def metrics_view(request):
+    """
+    Serves the metrics of this process in the Prometheus text format
+    """
+    return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,63 @@
+from django.db import transaction
+from .models import Todo
+from .events import todo_create_event, todo_update_event, todo_delete_event
+from .response_cache import bump_generation
+from . import changes, rollups, scheduler, tag_index
+
+# Single-todo writes shared by the sync viewset and the async views. Each
+# one saves the todo together with its rollup, tag index, change log and
+# scheduler bookkeeping in one transaction. The change log entry carries the
+# WebSocket event, published by the outbox relay after the commit.
+
+def create_todo(serializer):
+    """
+    Saves a validated TodoSerializer as a new todo
+
+    Returns:
+        The todo_create event, with its sequence number
+    """
+    with transaction.atomic():
+        todo = serializer.save()
+        rollups.record_create(todo)
+        tag_index.index_todos([todo])
+        seq = changes.record_change('create', todo.pk, todo_create_event(serializer.data))
+        scheduler.notify_deadlines([todo])
+        bump_generation()
+    return todo_create_event(serializer.data, seq)
+
+def update_todo(serializer):
+    """
+    Saves a validated TodoSerializer bound to an existing todo
+
+    Returns:
+        The todo_update event, with its sequence number
+    """
+    with transaction.atomic():
+        # Update the locked row, so the buckets the todo leaves are the ones
+        # it is counted in and not those of a copy read before a concurrent write
+        serializer.instance = Todo.objects.select_for_update().get(pk=serializer.instance.pk)
+        old_state = rollups.rollup_state(serializer.instance)
+        todo = serializer.save()
+        rollups.record_update(old_state, todo)
+        if serializer.validated_data.keys() & {'tags', 'status'}:
+            tag_index.reindex_todos([todo])
+        seq = changes.record_change('update', todo.pk, todo_update_event(serializer.data))
+        scheduler.notify_deadlines([todo])
+        bump_generation()
+    return todo_update_event(serializer.data, seq)
+
+def delete_todo(todo):
+    """
+    Deletes a todo
+
+    Returns:
+        The todo_delete event, with its sequence number
+    """
+    with transaction.atomic():
+        todo_id = todo.pk
+        todo = Todo.objects.select_for_update().get(pk=todo_id)
+        rollups.record_delete(todo)
+        todo.delete()
+        seq = changes.record_change('delete', todo_id, todo_delete_event(todo_id))
+        bump_generation()
+    return todo_delete_event(todo_id, seq)
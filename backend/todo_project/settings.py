@@ -33,6 +33,7 @@ CRONJOBS = [
     ('* * * * *', 'todo_api.cron.update_todo_statuses'),
 ]
 MIDDLEWARE = [
+    'todo_api.middleware.MetricsMiddleware',  # Request metrics, outermost to time the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
@@ -81,6 +82,30 @@ else:
         },
     }
 
+# Cache used for API responses. Local memory (LRU) in development, Redis in
+# production so that every worker sees the same write generation
+if DEBUG:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {
+                "MAX_ENTRIES": env.int('TODO_RESPONSE_CACHE_MAX_ENTRIES', default=1000),
+            },
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": env('REDIS_URL', default='redis://localhost:6379/0'),
+        },
+    }
+TODO_RESPONSE_CACHE_ALIAS = 'default'
+TODO_RESPONSE_CACHE_ENABLED = env.bool('TODO_RESPONSE_CACHE_ENABLED', default=True)
+# Seconds a cached response lives, also bounds the staleness of time
+# relative analytics (e.g. the completion-stats window)
+TODO_RESPONSE_CACHE_TIMEOUT = env.int('TODO_RESPONSE_CACHE_TIMEOUT', default=300)
+
 WSGI_APPLICATION = 'todo_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -130,6 +155,64 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 100,
 }
+# Upper bound on the rows returned by the legacy ?no_page listing, the full
+# table is available from the streaming /api/todos/export/ endpoint
+TODO_NO_PAGE_MAX_RESULTS = env.int('TODO_NO_PAGE_MAX_RESULTS', default=1000)
+# Serve the status and creation-hour distributions and the tag statistics
+# from the incrementally maintained TodoRollup and TodoTagRollup tables
+# instead of aggregating the todo table and the tag index
+TODO_ANALYTICS_USE_ROLLUPS = env.bool('TODO_ANALYTICS_USE_ROLLUPS', default=True)
+# Maximum number of todos per request on the /api/todos/bulk/ endpoints and
+# rows per INSERT/UPDATE statement when writing them
+TODO_BULK_MAX_ITEMS = env.int('TODO_BULK_MAX_ITEMS', default=1000)
+TODO_BULK_BATCH_SIZE = env.int('TODO_BULK_BATCH_SIZE', default=500)
+# WebSocket sync: reconnecting clients replay at most TODO_SYNC_MAX_DELTA
+# changes, otherwise they reload the list in chunks of TODO_SYNC_SNAPSHOT_CHUNK
+# todos. prune_todo_changes keeps the latest TODO_CHANGE_LOG_RETENTION changes.
+TODO_SYNC_MAX_DELTA = env.int('TODO_SYNC_MAX_DELTA', default=1000)
+TODO_SYNC_SNAPSHOT_CHUNK = env.int('TODO_SYNC_SNAPSHOT_CHUNK', default=500)
+TODO_CHANGE_LOG_RETENTION = env.int('TODO_CHANGE_LOG_RETENTION', default=100000)
+# Expired todos moved to failure per transaction by the expiry sweep
+TODO_EXPIRY_CHUNK_SIZE = env.int('TODO_EXPIRY_CHUNK_SIZE', default=500)
+# Deadline-driven expiry: '' keeps the per-request middleware sweep,
+# 'lifespan' runs the scheduler inside ASGI servers with lifespan support and
+# 'command' expects `manage.py run_expiry_scheduler`. Either of the latter
+# disables the middleware and the per-minute cron sweep.
+TODO_EXPIRY_SCHEDULER = env('TODO_EXPIRY_SCHEDULER', default='')
+if TODO_EXPIRY_SCHEDULER:
+    CRONJOBS = [job for job in CRONJOBS if job[1] != 'todo_api.cron.update_todo_statuses']
+# Seconds of upcoming deadlines the scheduler keeps in memory between reloads
+TODO_EXPIRY_SCHEDULER_HORIZON = env.int('TODO_EXPIRY_SCHEDULER_HORIZON', default=3600)
+# Middleware sweep (no scheduler): at most one sweep per interval across all
+# processes sharing this cache alias, run in a background thread
+TODO_EXPIRY_SWEEP_INTERVAL = env.int('TODO_EXPIRY_SWEEP_INTERVAL', default=60)
+TODO_EXPIRY_LEASE_CACHE_ALIAS = 'default'
+TODO_EXPIRY_SWEEP_IN_BACKGROUND = env.bool('TODO_EXPIRY_SWEEP_IN_BACKGROUND', default=True)
+# Transactional outbox: WebSocket events are stored with the write and
+# published by a relay, either a background thread of the writing process
+# ('thread'), `manage.py run_outbox_relay` workers ('command') or the writing
+# thread itself after the commit ('inline', needed by the in-memory channel
+# layer used with DEBUG). One relay publishes at a time (see outbox.py).
+# Relay threads are woken by the commits of their process and only poll
+# every TODO_OUTBOX_POLL_INTERVAL seconds as a safety net, run_outbox_relay
+# workers poll every TODO_OUTBOX_COMMAND_POLL_INTERVAL seconds.
+TODO_OUTBOX_RELAY = env('TODO_OUTBOX_RELAY', default='inline' if DEBUG else 'thread')
+TODO_OUTBOX_BATCH_SIZE = env.int('TODO_OUTBOX_BATCH_SIZE', default=500)
+TODO_OUTBOX_POLL_INTERVAL = env.float('TODO_OUTBOX_POLL_INTERVAL', default=30.0)
+TODO_OUTBOX_COMMAND_POLL_INTERVAL = env.float('TODO_OUTBOX_COMMAND_POLL_INTERVAL', default=0.25)
+TODO_OUTBOX_MAX_RETRY_DELAY = env.float('TODO_OUTBOX_MAX_RETRY_DELAY', default=30.0)
+# Also encode broadcasts as msgpack for WebSocket clients negotiating the
+# todos.msgpack subprotocol (needs the msgpack package)
+TODO_WS_MSGPACK = env.bool('TODO_WS_MSGPACK', default=True)
+# Messages waiting for a slow WebSocket client: from MERGE_AT on, queued
+# events are merged into the latest one per todo; past MAX the client is
+# asked to resync and disconnected
+TODO_WS_QUEUE_MERGE_AT = env.int('TODO_WS_QUEUE_MERGE_AT', default=100)
+TODO_WS_QUEUE_MAX = env.int('TODO_WS_QUEUE_MAX', default=1000)
+# Request, database and WebSocket metrics served at /metrics
+TODO_METRICS = env.bool('TODO_METRICS', default=True)
+# Fail views running more queries than their @query_budget (utils.py)
+TODO_QUERY_BUDGETS = env.bool('TODO_QUERY_BUDGETS', default=DEBUG)
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # For development only, should be restricted in production
 CORS_ALLOW_METHODS = [
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
+from todo_api.views import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('todo_api.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -94,6 +94,10 @@ export default function Home() {
       if (DEBUG_MODE) console.log('Todo created:', data);
       setTodos(prevTodos => {
         if (!Array.isArray(prevTodos)) return [data.todo];
+        // Already listed when the snapshot was read after the create
+        if (prevTodos.some(todo => todo.id === data.todo.id)) {
+          return prevTodos.map(todo => todo.id === data.todo.id ? data.todo : todo);
+        }
         return [data.todo, ...prevTodos];
       });
     });
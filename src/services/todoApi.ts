@@ -7,33 +7,37 @@ import { CreateTodoPayload, Todo, UpdateTodoPayload } from '@/types/todo';
 const API_URL = 'https://resollect-assignment-254j.onrender.com/api';
 
 
-interface PaginatedResponse<T> {
-  count: number;
+interface CursorPage<T> {
   next: string | null;
-  previous: string | null;
   results: T[];
 }
+
+// Largest page the API serves; ?no_page is capped server side, so the full
+// list is read page by page with keyset cursors
+const PAGE_SIZE = 1000;
+
 export const todoApi = {
   async getTodos(): Promise<Todo[]> {
-    // Add no_page=true to get unpaginated results
-    const response = await fetch(`${API_URL}/todos/?no_page=true`, {
-      mode: 'cors',
-      credentials: 'omit',
-    });
-    if (!response.ok) {
-      throw new Error('Failed to fetch todos');
-    }
-    const data = await response.json();
-    // Removed excessive logging that was causing console spam
-    // console.log('Todo data received:', data);
-    if (Array.isArray(data)) {
-      return data;
-    } else if (data && typeof data === 'object' && 'results' in data) {
-      return (data as PaginatedResponse<Todo>).results;
-    } else {
-      console.error('Unexpected response format:', data);
-      return []; 
+    const todos: Todo[] = [];
+    let url: string | null = `${API_URL}/todos/?pagination=cursor&page_size=${PAGE_SIZE}`;
+    while (url) {
+      const response: Response = await fetch(url, {
+        mode: 'cors',
+        credentials: 'omit',
+      });
+      if (!response.ok) {
+        throw new Error('Failed to fetch todos');
+      }
+      const data = await response.json();
+      if (!data || typeof data !== 'object' || !Array.isArray(data.results)) {
+        console.error('Unexpected response format:', data);
+        return todos;
+      }
+      const page = data as CursorPage<Todo>;
+      todos.push(...page.results);
+      url = page.next;
     }
+    return todos;
   },
   async getTodo(id: string): Promise<Todo> {
     const response = await fetch(`${API_URL}/todos/${id}/`, {
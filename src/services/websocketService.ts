@@ -6,18 +6,36 @@ type WebSocketEventType = 'connect' | 'disconnect' | 'todo_list' | 'todo_create'
 // Define interfaces for type-safe event payloads
 interface TodoListPayload {
   todos: Todo[];
+  seq: number | null;
 }
 
 interface TodoCreatePayload {
   todo: Todo;
+  seq?: number | null;
 }
 
 interface TodoUpdatePayload {
   todo: Todo;
+  seq?: number | null;
 }
 
 interface TodoDeletePayload {
   todo_id: string;
+  seq?: number | null;
+}
+
+// Single todo event as broadcast by the server
+type TodoEvent =
+  | ({ type: 'todo_create' } & TodoCreatePayload)
+  | ({ type: 'todo_update' } & TodoUpdatePayload)
+  | ({ type: 'todo_delete' } & TodoDeletePayload);
+
+// One chunk of the todo list snapshot, the first one carries the seq the
+// snapshot started at and every one the cursor of the next chunk
+interface TodoListChunk {
+  todos: Todo[];
+  seq: number | null;
+  next: string | null;
 }
 
 interface ErrorPayload {
@@ -55,6 +73,16 @@ class WebSocketService {
   private reconnectDelay = 3000; // 3 seconds initial delay
   private isConnecting = false;
   public mockConnected = false; // Public so it can be checked
+  // Sequence number of the last change applied, sent back on reconnect to
+  // only receive the missed changes
+  private lastSeq: number | null = null;
+  // True from the connection until the snapshot or delta is complete
+  private syncing = false;
+  // Chunks of the snapshot being received, and its starting seq
+  private snapshot: Todo[] | null = null;
+  private snapshotSeq: number | null = null;
+  // Events broadcast while syncing, applied once the sync is complete
+  private pendingEvents: TodoEvent[] = [];
   
   // Initialize the WebSocket connection
   public connect(): void {
@@ -76,6 +104,8 @@ class WebSocketService {
       console.log(`Connecting to WebSocket at: ${wsUrl}`);
       
       this.socket = new WebSocket(wsUrl);
+      // The server sends the missed changes or a snapshot on connect
+      this.startSync();
       
       this.socket.onopen = () => {
         console.log('WebSocket connected');
@@ -85,16 +115,14 @@ class WebSocketService {
       };
       
       this.socket.onmessage = (event) => {
+        let data: { type?: string; [key: string]: unknown };
         try {
-          const data = JSON.parse(event.data);
-          const type = data.type as WebSocketEventType;
-          
-          if (type) {
-            this.notifyListeners(type, data);
-          }
+          data = JSON.parse(event.data);
         } catch (error) {
           console.error('Error parsing WebSocket message:', error);
+          return;
         }
+        this.handleMessage(data);
       };
       
       this.socket.onclose = () => {
@@ -141,9 +169,12 @@ class WebSocketService {
   
   // Get WebSocket URL based on current environment
   private getWebSocketUrl(): string {
+    // Reconnecting clients only ask for the changes they missed
+    const query = this.lastSeq !== null ? `?since=${this.lastSeq}` : '';
+
     // Check if we're in a browser environment
     if (typeof window === 'undefined') {
-      return 'ws://localhost:8000/ws/todos/';
+      return `ws://localhost:8000/ws/todos/${query}`;
     }
     
     // Get the current host (works with any deployment)
@@ -152,11 +183,118 @@ class WebSocketService {
     
     // For development with backend on a different port
     if (host.includes('localhost') || host.includes('127.0.0.1')) {
-      return 'ws://localhost:8000/ws/todos/';
+      return `ws://localhost:8000/ws/todos/${query}`;
     }
     
     // For production deployment
-    return `${protocol}//${host}/ws/todos/`;
+    return `${protocol}//${host}/ws/todos/${query}`;
+  }
+
+  // Dispatch a server message to the listeners
+  private handleMessage(data: { type?: string; [key: string]: unknown }): void {
+    switch (data.type) {
+      case 'todo_list':
+        this.receiveSnapshotChunk(data as unknown as TodoListChunk);
+        break;
+      case 'todo_delta': {
+        // Changes missed while disconnected, then those broadcast since
+        const delta = data as unknown as { seq: number; events: TodoEvent[] };
+        delta.events.forEach(event => this.applyEvent(event));
+        this.finishSync(delta.seq);
+        break;
+      }
+      case 'todo_batch':
+        (data.events as TodoEvent[]).forEach(event => this.receiveEvent(event));
+        break;
+      case 'todo_create':
+      case 'todo_update':
+      case 'todo_delete':
+        this.receiveEvent(data as unknown as TodoEvent);
+        break;
+      case 'resync_required':
+        // The server closes the socket, reconnect() resumes from lastSeq
+        console.warn('WebSocket fell behind, resyncing');
+        break;
+      case 'error':
+        this.notifyListeners('error', data as unknown as ErrorPayload);
+        break;
+    }
+  }
+
+  // Start waiting for a snapshot or delta, queuing the broadcast events
+  private startSync(): void {
+    this.syncing = true;
+    this.snapshot = null;
+    this.snapshotSeq = null;
+    this.pendingEvents = [];
+  }
+
+  // Accumulate snapshot chunks, the listeners get the whole list at once
+  private receiveSnapshotChunk(chunk: TodoListChunk): void {
+    if (this.snapshot === null || chunk.seq !== null) {
+      // First chunk
+      this.snapshot = [];
+      this.snapshotSeq = chunk.seq;
+    }
+    this.snapshot.push(...chunk.todos);
+    if (chunk.next) {
+      this.send({ type: 'request_todos', cursor: chunk.next });
+      return;
+    }
+    const todos = this.snapshot;
+    const seq = this.snapshotSeq;
+    this.snapshot = null;
+    // The list replaces whatever the listeners had, the changes are counted from its seq
+    this.lastSeq = null;
+    this.notifyListeners('todo_list', { todos, seq });
+    this.finishSync(seq);
+  }
+
+  // Apply the events queued during the sync that it did not include
+  private finishSync(seq: number | null): void {
+    if (seq !== null) {
+      this.lastSeq = Math.max(this.lastSeq ?? 0, seq);
+    }
+    const pending = this.pendingEvents;
+    this.syncing = false;
+    this.pendingEvents = [];
+    pending.forEach(event => this.applyEvent(event));
+  }
+
+  private receiveEvent(event: TodoEvent): void {
+    if (this.syncing) {
+      this.pendingEvents.push(event);
+      return;
+    }
+    this.applyEvent(event);
+  }
+
+  // Notify the listeners of a todo event, skipping those already applied
+  private applyEvent(event: TodoEvent): void {
+    const seq = event.seq ?? null;
+    if (seq !== null) {
+      if (this.lastSeq !== null && seq <= this.lastSeq) {
+        return;
+      }
+      this.lastSeq = seq;
+    }
+    switch (event.type) {
+      case 'todo_create':
+        this.notifyListeners('todo_create', { todo: event.todo, seq });
+        break;
+      case 'todo_update':
+        this.notifyListeners('todo_update', { todo: event.todo, seq });
+        break;
+      case 'todo_delete':
+        this.notifyListeners('todo_delete', { todo_id: event.todo_id, seq });
+        break;
+    }
+  }
+
+  private send(message: Record<string, unknown>): void {
+    if (this.socket?.readyState === WebSocket.OPEN) {
+      this.socket.send(JSON.stringify(message));
+    }
   }
   
   // Mock method to simulate server-side create event
@@ -250,8 +388,13 @@ class WebSocketService {
       return;
     }
     
+    if (this.syncing) {
+      // The todos are already on their way
+      return;
+    }
     if (this.socket?.readyState === WebSocket.OPEN) {
-      this.socket.send(JSON.stringify({ type: 'request_todos' }));
+      this.startSync();
+      this.socket.send(JSON.stringify({ type: 'request_todos', since: this.lastSeq }));
     } else {
       console.warn('WebSocket not connected, cannot request todos');
     }